@@ -4,10 +4,27 @@ import datetime
 from pathlib import Path
 import subprocess
 import os
+import sys
+import json
+import tempfile
+import threading
+
+from results import ResultsStore
+from util import metrics
 
 # Save the logs to this path
 PATH_CONTROL_LOG = Path('/test_logs') / 'Started performance test at {}.log'.format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 print("Controller script started. Log file at", PATH_CONTROL_LOG)
+# One line-buffered handle for the whole run, shared by the scheduler and the worker callbacks
+_control_log = PATH_CONTROL_LOG.open('a', buffering=1)
+_control_log_lock = threading.Lock()
+
+# Every iteration is also stored as one JSON line, see integration/results.py for the report
+PATH_RESULTS = PATH_CONTROL_LOG.with_suffix('.results.jsonl')
+results_store = ResultsStore(PATH_RESULTS)
+
+# Agreement block cursors are shared by every run of the test script
+os.environ.setdefault('BLOCK_CURSOR_PATH', str(Path('/test_logs') / 'block_cursors.json'))
 
 # This is the test script to run
 PATH_TEST_FLOW = Path.cwd() / 'integration' / 'test04_consume_asset.py'
@@ -43,59 +60,274 @@ else: # Enable for a manual start time
     END_HOUR = int(END_TIME.split(':')[0])
     END_MINUTE = int(END_TIME.split(':')[1])
 
+# Exact start and end datetimes, the end is on the next day if it's not after the start
+START_DATETIME = datetime.datetime.combine(datetime.date.today(), datetime.datetime.strptime(START_TIME, "%H:%M").time())
+END_DATETIME = datetime.datetime.combine(START_DATETIME.date(), datetime.time(END_HOUR, END_MINUTE))
+if END_DATETIME <= START_DATETIME:
+    END_DATETIME += datetime.timedelta(days=1)
+
 # Testing interval
 if 'DOCKER_INTERVAL' in os.environ:
     INTERVAL = int(os.environ['DOCKER_INTERVAL'])
 else:
     INTERVAL = 30
 
+# Number of warm worker processes, 0 to run each flow in a new python process
+if 'CONTROLLER_WORKERS' in os.environ:
+    N_WORKERS = int(os.environ['CONTROLLER_WORKERS'])
+else:
+    N_WORKERS = 0
+
+# Open-loop load: target flows per second, replaces the fixed INTERVAL if set
+if 'CONTROLLER_RATE' in os.environ:
+    RATE = float(os.environ['CONTROLLER_RATE'])
+    ARRIVAL = os.environ.get('CONTROLLER_ARRIVAL', 'poisson')
+    MAX_IN_FLIGHT = int(os.environ.get('CONTROLLER_MAX_IN_FLIGHT', max(N_WORKERS, 1)))
+else:
+    RATE = None
+
+# Load profiles file, replaces the fixed INTERVAL and the start/end times if set
+PATH_PROFILES = os.environ.get('CONTROLLER_PROFILE')
+
+# Coordinator mode: listen on host:port, and hand out the iterations to the workers of integration/distributed.py
+COORDINATOR_ADDRESS = os.environ.get('CONTROLLER_COORDINATOR')
+# Account manifest from util.provision.save_manifest(), one consumer account is leased to each worker,
+# of the coordinator or of the warm pool (needed for more than one warm worker)
+PATH_ACCOUNTS = os.environ.get('CONTROLLER_ACCOUNTS')
+
+# Serve the live metrics in the Prometheus text format on this port, i.e. http://controller:9100/metrics
+if 'CONTROLLER_METRICS_PORT' in os.environ:
+    METRICS_PORT = int(os.environ['CONTROLLER_METRICS_PORT'])
+else:
+    METRICS_PORT = None
+
+
+def log(log_str):
+    """Print, and append to the control log"""
+    print(log_str, end="")
+    with _control_log_lock:
+        _control_log.write(log_str)
+
 
 def schedule_at_interval():
     """Add scheduled jobs at INTERVAL time
     """
-    schedule.every(INTERVAL).seconds.do(run_python_test_script)
+    schedule.every(INTERVAL).seconds.do(run_iteration)
 
 
-def run_python_test_script():
+def read_flow_output(path):
+    """The output of a flow saved by the test script to FLOW_OUTPUT_PATH, None if it didn't save one"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run_python_test_script(scenario='consume', intended=None):
     """Simple wrapper on subprocess.call()
+
+    :param intended: time.time() the iteration was scheduled to start at, now if None
     """
-    log_str = "Running script {} at {}\n".format(PATH_TEST_FLOW, datetime.datetime.utcnow().isoformat())
-    print(log_str, end="")
-    with PATH_CONTROL_LOG.open('a') as f:
-        f.write(log_str)
+    if scenario == 'consume':
+        args = ['python', PATH_TEST_FLOW]
+    else:
+        args = ['python', PATH_TEST_FLOW.parent / 'scenarios.py', scenario]
+    log_str = "Running script {} at {}\n".format(' '.join(str(arg) for arg in args[1:]), datetime.datetime.utcnow().isoformat())
+    log(log_str)
 
-    # Run the process
-    ret_code = subprocess.call(['python', PATH_TEST_FLOW])
+    # Run the process, it saves the flow output (with the phase timings) to FLOW_OUTPUT_PATH
+    started = time.time()
+    flow_started(scenario)
+    fd, path_output = tempfile.mkstemp(prefix='flow-', suffix='.json')
+    os.close(fd)
+    ret_code = subprocess.call(args, env=dict(os.environ, FLOW_OUTPUT_PATH=path_output))
+    output = read_flow_output(path_output)
+    record_result({
+        'worker': None,
+        'scenario': scenario,
+        'intended': intended if intended is not None else started,
+        'started': started,
+        'finished': time.time(),
+        'phases': output.get('phases', {}) if isinstance(output, dict) else {},
+        'error': "process returns {}".format(ret_code) if ret_code else None,
+        'error_class': 'ProcessError',
+    })
 
     log_str = "Finished run at {}, process returns {}\n\n".format(datetime.datetime.utcnow().isoformat(), ret_code)
-    print(log_str, end="")
-    with PATH_CONTROL_LOG.open('a') as f:
-        f.write(log_str)
+    log(log_str)
+    return ret_code
+
+
+def flow_started(scenario):
+    metrics.registry.add_gauge('flows_in_flight', 1, scenario=scenario)
+
+
+def record_result(result):
+    """Store the result of an iteration, and update the live metrics"""
+    scenario = result['scenario']
+    results_store.record(scenario, result['started'], result['finished'], error=result['error'],
+                         error_class=result['error_class'], phases=result['phases'], worker=result['worker'],
+                         intended=result.get('intended'))
+    metrics.registry.add_gauge('flows_in_flight', -1, scenario=scenario)
+    metrics.registry.inc('flows_failed_total' if result['error'] else 'flows_completed_total', scenario=scenario)
+    metrics.registry.observe('flow_duration_seconds', result['finished'] - result['started'], scenario=scenario)
+    for phase, seconds in result['phases'].items():
+        metrics.registry.observe('flow_phase_seconds', seconds, scenario=scenario, phase=phase)
+    # Faucet, dispenser and RPC calls counted in the worker processes since their last result
+    for name, labels, value in result.get('counters', ()):
+        metrics.registry.inc(name, value, **labels)
+
+
+def log_warm_iteration(result, intended=None):
+    """Log and store the result of an iteration from the worker pool
+
+    :param intended: time.time() the iteration was scheduled to start at, before waiting for a free worker
+    """
+    if intended is not None:
+        result['intended'] = intended
+    record_result(result)
+    log_str = "Finished run on {} at {}, {}\n\n".format(
+        result['worker'], datetime.datetime.utcfromtimestamp(result['finished']).isoformat(),
+        "error {}".format(result['error']) if result['error'] else "success")
+    log(log_str)
 
 
+def run_warm_iteration():
+    """Send one flow iteration to the warm worker pool, without waiting for it
+    """
+    log_str = "Sending flow iteration to the worker pool at {}\n".format(datetime.datetime.utcnow().isoformat())
+    log(log_str)
+    flow_started('consume')
+    intended = time.time()
+    worker_pool.submit(callback=lambda result: log_warm_iteration(result, intended))
+
+
+def run_distributed_iteration():
+    """Queue one flow iteration for the workers of the coordinator, without waiting for it
+    """
+    log_str = "Queueing flow iteration for {} workers at {}\n".format(
+        len(coordinator.dispatcher.workers()), datetime.datetime.utcnow().isoformat())
+    log(log_str)
+    flow_started('consume')
+    intended = time.time()
+    coordinator.submit(lambda result: log_warm_iteration(result, intended))
+
+
+def submit_iteration(done, scenario='consume', intended=None):
+    """Start one flow iteration for the open-loop generator, and call done(result) when it's finished
+    """
+    if COORDINATOR_ADDRESS or N_WORKERS:
+        def _callback(result):
+            log_warm_iteration(result, intended)
+            done(result)
+        flow_started(scenario)
+        if COORDINATOR_ADDRESS:
+            coordinator.submit(_callback, scenario)
+        else:
+            worker_pool.submit(callback=_callback, scenario=scenario)
+    else:
+        def _run():
+            ret_code = run_python_test_script(scenario, intended)
+            done({'error': "process returns {}".format(ret_code) if ret_code else None})
+        threading.Thread(target=_run, daemon=True).start()
+
+
+def run_open_loop():
+    """Offer RATE flows per second from START_TIME to END_TIME, with at most MAX_IN_FLIGHT running
+    """
+    log_str = "Open-loop load of {} flows/s ({} arrivals, {} in flight) from {} until {}\n".format(
+        RATE, ARRIVAL, MAX_IN_FLIGHT, START_DATETIME, END_DATETIME)
+    log(log_str)
+
+    time.sleep(max(0, (START_DATETIME - datetime.datetime.now()).total_seconds()))
+    generator = OpenLoopGenerator(submit_iteration, RATE, ARRIVAL, MAX_IN_FLIGHT)
+    generator.run(until=END_DATETIME.timestamp())
+
+    log_str = "Open-loop load finished: {}\n".format(json.dumps(generator.summary()))
+    log(log_str)
+
+
+def run_load_profiles():
+    """Run each profile of PATH_PROFILES until its exact deadline
+    """
+    for start, end, profile in load_profiles(PATH_PROFILES):
+        log_str = "Profile {} ({}, scenarios {}) from {} until {}\n".format(
+            profile.name, profile.type, profile.scenarios, start, end)
+        log(log_str)
+
+        time.sleep(max(0, (start - datetime.datetime.now()).total_seconds()))
+        generator = OpenLoopGenerator(submit_iteration, lambda elapsed, profile=profile: profile.rate_at(elapsed),
+                                      profile.arrival, profile.max_in_flight, profile.scenarios)
+        generator.run(until=end.timestamp())
+
+        log_str = "Profile {} finished: {}\n".format(profile.name, json.dumps(generator.summary()))
+        log(log_str)
+
+
+def close_workers():
+    """Wait for the iterations in flight, and stop the workers"""
+    if COORDINATOR_ADDRESS:
+        coordinator.stop()
+    elif N_WORKERS:
+        worker_pool.close()
+    results_store.close()
+
+
+if METRICS_PORT:
+    metrics.serve(METRICS_PORT)
+    log("Serving metrics on port {}\n".format(METRICS_PORT))
+
+accounts = list()
+if PATH_ACCOUNTS:
+    with open(PATH_ACCOUNTS) as f:
+        accounts = json.load(f)
+
+if COORDINATOR_ADDRESS:
+    from distributed import Coordinator, parse_address
+    coordinator = Coordinator(parse_address(COORDINATOR_ADDRESS), accounts=accounts).start()
+    log("Coordinator listening on {}, {} accounts to lease\n".format(COORDINATOR_ADDRESS, len(accounts)))
+    run_iteration = run_distributed_iteration
+elif N_WORKERS:
+    from workers import WarmWorkerPool
+    worker_pool = WarmWorkerPool(N_WORKERS, accounts)
+    run_iteration = run_warm_iteration
+else:
+    run_iteration = run_python_test_script
+
+if PATH_PROFILES or RATE:
+    from loadgen import OpenLoopGenerator
+    from profiles import load_profiles
+    if PATH_PROFILES:
+        run_load_profiles()
+    else:
+        run_open_loop()
+    close_workers()
+    sys.exit(0)
+
 # Schedule the jobs
 try:
     schedule.every().day.at(START_TIME).do(schedule_at_interval)
 except:
     print(START_TIME)
     raise
-schedule.every(INTERVAL).seconds.do(run_python_test_script)
+schedule.every(INTERVAL).seconds.do(run_iteration)
 
 log_str = "Scheduler set to start at {} every {} seconds until {}\n".format(START_TIME, INTERVAL,  END_TIME)
 print("Current datetime:", datetime.datetime.now())
-print(log_str, end="")
-with PATH_CONTROL_LOG.open('a') as f:
-    f.write(log_str)
+log(log_str)
 
 while 1:
     schedule.run_pending()
 
     # Check if END_TIME, and break
-    if datetime.datetime.now().hour >= END_HOUR and datetime.datetime.now().minute >= END_MINUTE:
+    if datetime.datetime.now() >= END_DATETIME:
         log_str = "Scheduler finished at {}".format(END_TIME)
-        print(log_str, end="")
-        with PATH_CONTROL_LOG.open('a') as f:
-            f.write(log_str)
+        log(log_str)
+        close_workers()
         break
 
     time.sleep(1)
@@ -0,0 +1,259 @@
+"""
+Coordinator/worker mode of the controller, to generate more load than a single container can.
+
+The coordinator (the controller with CONTROLLER_COORDINATOR=host:port) serves the scenario slots and the
+consumer account leases over a multiprocessing manager connection. Workers on any host connect to it, lease
+one account each, take slots, run them in a warm context and send back their result, which the coordinator
+merges into its own result stream. Start N local worker processes with:
+
+    python integration/distributed.py <coordinator host:port> [N processes]
+
+The authentication key is shared through the CONTROLLER_AUTHKEY environment variable.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+DEFAULT_AUTHKEY = 'mantaray'
+
+# Returned by Dispatcher.next_slot() once the coordinator is stopped and all slots are taken
+STOP = 'stop'
+
+
+def parse_address(value):
+    """'host:port' to (host, port)"""
+    host, _, port = value.rpartition(':')
+    return host or '', int(port)
+
+
+def get_authkey():
+    return os.environ.get('CONTROLLER_AUTHKEY', DEFAULT_AUTHKEY).encode()
+
+
+class DispatchManager(BaseManager):
+    pass
+
+
+# Workers only need the type ID, the coordinator registers the Dispatcher instance in Coordinator.start()
+DispatchManager.register('dispatcher')
+
+
+class Dispatcher:
+    """The state shared by the coordinator with the workers: slot and result queues, and account leases"""
+
+    def __init__(self, accounts=()):
+        """
+        :param accounts: Manifest entries (dict of address, password, encrypted_key), as saved by
+            util.provision.save_manifest(), one is leased to each worker
+        """
+        self._slots = queue.Queue()
+        self._results = queue.Queue()
+        self._free_accounts = list(accounts)
+        self._leases = dict()
+        self._workers = dict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def put_slot(self, slot_id, scenario):
+        self._slots.put((slot_id, scenario))
+
+    def next_slot(self, worker, timeout=1.0):
+        """The next (slot ID, scenario) for the worker
+
+        :return: The slot, None if there isn't any within the timeout, or STOP
+        """
+        with self._lock:
+            self._workers[worker] = time.time()
+        if self._stopped.is_set() and self._slots.empty():
+            return STOP
+        try:
+            return self._slots.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put_result(self, result):
+        self._results.put(result)
+
+    def get_result(self, timeout=1.0):
+        try:
+            return self._results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def lease_account(self, worker):
+        """Lease an account to the worker, the same one if it reconnects
+
+        :return: Manifest entry, or None if there isn't any free account
+        """
+        with self._lock:
+            if worker not in self._leases:
+                if not self._free_accounts:
+                    return None
+                self._leases[worker] = self._free_accounts.pop(0)
+            return self._leases[worker]
+
+    def release_account(self, worker):
+        with self._lock:
+            entry = self._leases.pop(worker, None)
+            if entry:
+                self._free_accounts.append(entry)
+
+    def workers(self, max_idle=30):
+        """Workers which asked for a slot in the last max_idle seconds"""
+        with self._lock:
+            return sorted(worker for worker, seen in self._workers.items() if time.time() - seen < max_idle)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class Coordinator:
+    """Hand out scenario slots to the workers, and call back with their results"""
+
+    def __init__(self, address, authkey=None, accounts=(), slot_timeout=1800):
+        """
+        :param address: (host, port) to listen on
+        :param accounts: Manifest entries to lease to the workers
+        :param slot_timeout: Seconds after which a slot without result counts as failed, i.e. a lost worker
+        """
+        self.address = address
+        self.authkey = authkey or get_authkey()
+        self.slot_timeout = slot_timeout
+        self.dispatcher = Dispatcher(accounts)
+        self._pending = dict()
+        self._slot_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        dispatcher = self.dispatcher
+
+        class _Manager(DispatchManager):
+            pass
+        _Manager.register('dispatcher', callable=lambda: dispatcher)
+
+        self._server = _Manager(address=self.address, authkey=self.authkey).get_server()
+        threading.Thread(target=self._server.serve_forever, name='coordinator-server', daemon=True).start()
+        self._thread = threading.Thread(target=self._collect, name='coordinator-results', daemon=True)
+        self._thread.start()
+        logging.info("Coordinator listening on {}:{}".format(*self._server.address))
+        return self
+
+    def submit(self, done, scenario='consume'):
+        """Queue one slot for the next free worker, done(result) is called with its result dict
+
+        Wrapped by controller.submit_iteration() for loadgen.OpenLoopGenerator.
+        """
+        slot_id = next(self._slot_ids)
+        with self._lock:
+            self._pending[slot_id] = (done, scenario, time.time())
+        self.dispatcher.put_slot(slot_id, scenario)
+        return slot_id
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _collect(self):
+        while True:
+            result = self.dispatcher.get_result(timeout=1.0)
+            if result is not None:
+                with self._lock:
+                    done, _, _ = self._pending.pop(result.pop('slot'), (None, None, None))
+                if done:
+                    done(result)
+            self._expire()
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            expired = [(slot_id, pending) for slot_id, pending in self._pending.items()
+                       if now - pending[2] > self.slot_timeout]
+            for slot_id, _ in expired:
+                del self._pending[slot_id]
+        for slot_id, (done, scenario, queued) in expired:
+            logging.error("Slot {} ({}) without result after {}s".format(slot_id, scenario, self.slot_timeout))
+            done({
+                'worker': None,
+                'scenario': scenario,
+                'started': queued,
+                'finished': now,
+                'output': None,
+                'phases': {},
+                'error': "SlotTimeout: no result after {}s".format(self.slot_timeout),
+                'error_class': 'SlotTimeout',
+            })
+
+    def stop(self, timeout=None):
+        """Let the workers finish the queued slots and wait for their results, then stop serving"""
+        self.dispatcher.stop()
+        deadline = time.time() + (timeout if timeout is not None else self.slot_timeout)
+        while self._pending and time.time() < deadline:
+            time.sleep(1)
+        # Leave the workers time to see the STOP before the server goes away
+        time.sleep(2)
+        self._server.stop_event.set()
+
+
+def run_worker(address, authkey=None):
+    """Connect to the coordinator, and run slots until it stops"""
+    import workers
+    from test04_consume_asset import teardown
+
+    name = "{}:{}".format(socket.gethostname(), os.getpid())
+    manager = DispatchManager(address=address, authkey=authkey or get_authkey())
+    manager.connect()
+    dispatcher = manager.dispatcher()
+
+    entry = dispatcher.lease_account(name)
+    if entry:
+        logging.info("Worker {} leased account {}".format(name, entry['address']))
+    try:
+        # Funded in setup(), before the first slot, so the refill is not part of a measured flow
+        ctx = workers.init_context(entry)
+    except BaseException:
+        dispatcher.release_account(name)
+        raise
+
+    try:
+        while True:
+            try:
+                slot = dispatcher.next_slot(name)
+            except (EOFError, ConnectionError):
+                logging.info("Worker {}: coordinator is gone".format(name))
+                break
+            if slot == STOP:
+                break
+            if slot is None:
+                continue
+            slot_id, scenario = slot
+            result = workers._run_iteration(scenario)
+            result.update(worker=name, slot=slot_id)
+            dispatcher.put_result(result)
+    finally:
+        teardown(ctx)
+        try:
+            dispatcher.release_account(name)
+        except (EOFError, ConnectionError):
+            pass
+    logging.info("Worker {} stopped".format(name))
+
+
+if __name__ == '__main__':
+    assert 2 <= len(sys.argv) <= 3, "Usage: distributed.py <coordinator host:port> [N processes]"
+    coordinator_address = parse_address(sys.argv[1])
+    n_processes = int(sys.argv[2]) if len(sys.argv) == 3 else 1
+    processes = [multiprocessing.Process(target=run_worker, args=(coordinator_address,))
+                 for _ in range(n_processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,151 @@
+"""
+Open-loop load generator.
+
+Flow iterations are started on a schedule of intended start times (constant or Poisson arrivals), whatever
+the duration of the previous iterations. When `max_in_flight` iterations are running, new iterations wait
+for a free slot, but their latency is still measured from the intended start time, so a slow system
+isn't hidden by a slower offered load (coordinated omission).
+"""
+import logging
+import random
+import threading
+import time
+
+from util import metrics
+
+ARRIVAL_PROCESSES = ('poisson', 'constant')
+
+
+# Time step while the arrival rate is zero, i.e. before a spike
+IDLE_STEP = 0.1
+
+
+def arrival_offsets(rate, arrival='poisson', rng=random, horizon=None):
+    """Generator of intended start times, in seconds from the start of the run
+
+    :param rate: Mean arrivals per second, or a function of the seconds since the start returning the rate
+    :param arrival: 'poisson' for exponential inter-arrival times, or 'constant'
+    :param horizon: Seconds from the start at which to stop, None for an infinite generator. A rate which
+        stays at zero (i.e. a ramp down to 0) yields nothing more, so it needs a horizon to end.
+    """
+    assert arrival in ARRIVAL_PROCESSES, "Unknown arrival process {}, select from {}".format(arrival, ARRIVAL_PROCESSES)
+    rate_at = rate if callable(rate) else lambda _: rate
+    assert callable(rate) or rate > 0, "The arrival rate must be positive"
+    offset = 0.0
+    while horizon is None or offset < horizon:
+        current_rate = rate_at(offset)
+        if current_rate <= 0:
+            offset += IDLE_STEP
+            continue
+        if arrival == 'poisson':
+            offset += rng.expovariate(current_rate)
+        else:
+            offset += 1 / current_rate
+        yield offset
+
+
+class OpenLoopGenerator:
+    """Start flow iterations at a target arrival rate, with at most max_in_flight running at once"""
+
+    def __init__(self, submit, rate, arrival='poisson', max_in_flight=10, scenarios=None, seed=None,
+                 registry=metrics.registry):
+        """
+        :param submit: Callable starting one iteration asynchronously, submit(done, scenario, intended) must
+            call done(result) when the iteration is finished, with a result dict containing at least an 'error'
+            key. intended is the time.time() the iteration was scheduled to start at.
+        :param rate: Mean arrivals per second, or a function of the seconds since the start returning the rate
+        :param arrival: 'poisson' or 'constant'
+        :param max_in_flight: Maximum number of iterations running at once
+        :param scenarios: dict of scenario name: weight, each iteration runs a random scenario of the mix
+        :param seed: Random seed of the Poisson arrivals and of the scenario mix
+        """
+        self.submit = submit
+        self.rate = rate
+        self.arrival = arrival
+        self.max_in_flight = max_in_flight
+        self.scenarios = scenarios or {'consume': 1}
+        self.registry = registry
+        self.records = list()
+        self._rng = random.Random(seed)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._started = None
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def _done(self, scenario, intended, started, result):
+        finished = time.time()
+        record = {
+            'scenario': scenario,
+            'intended': intended,
+            'started': started,
+            'finished': finished,
+            # Latency from the intended start, the service time excludes the wait for a free slot
+            'latency': finished - intended,
+            'service_time': finished - started,
+            'error': result.get('error') if result else 'no result',
+        }
+        with self._lock:
+            self.records.append(record)
+            self._in_flight -= 1
+        self.registry.observe('flow_latency_seconds', record['latency'], scenario=scenario)
+        self.registry.observe('flow_service_seconds', record['service_time'], scenario=scenario)
+        self._slots.release()
+
+    def run(self, until):
+        """Generate load until the `until` timestamp, then wait for the running iterations
+
+        :param until: time.time() at which to stop starting new iterations
+        :return: list of records, one per iteration
+        """
+        self._started = time.time()
+        names = list(self.scenarios)
+        weights = [self.scenarios[name] for name in names]
+        for offset in arrival_offsets(self.rate, self.arrival, self._rng, until - self._started):
+            intended = self._started + offset
+            if intended >= until:
+                break
+            delay = intended - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if not self._slots.acquire(blocking=False):
+                logging.debug("{} iterations in flight, waiting for a free slot".format(self.max_in_flight))
+                self._slots.acquire()
+            with self._lock:
+                self._in_flight += 1
+            started = time.time()
+            scenario = self._rng.choices(names, weights)[0]
+            self.submit(lambda result, scenario=scenario, intended=intended, started=started:
+                        self._done(scenario, intended, started, result), scenario, intended)
+
+        # Drain the iterations in flight
+        for _ in range(self.max_in_flight):
+            self._slots.acquire()
+        for _ in range(self.max_in_flight):
+            self._slots.release()
+        return self.records
+
+    def summary(self):
+        """Throughput and latency quantiles of the completed iterations"""
+        with self._lock:
+            records = list(self.records)
+        if not records:
+            return {'completed': 0}
+        elapsed = max(r['finished'] for r in records) - self._started
+        latencies = sorted(r['latency'] for r in records)
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            'offered_rate': None if callable(self.rate) else self.rate,
+            'completed': len(records),
+            'errors': sum(1 for r in records if r['error']),
+            'throughput': len(records) / elapsed if elapsed > 0 else None,
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+        }
@@ -0,0 +1,150 @@
+"""
+Declarative load profiles for the controller, loaded from an INI file.
+
+The [run] section sets the start time and the sequence of profiles, each profile is a [profile:<name>]
+section, run one after the other with exact deadlines:
+
+    [run]
+    # now, HH:MM (today, or tomorrow if already past) or YYYY-MM-DD HH:MM
+    start = now
+    profiles = warmup, knee, soak
+
+    [profile:warmup]
+    type = ramp
+    duration = 600
+    start_rate = 0.01
+    end_rate = 0.2
+    max_in_flight = 8
+    scenarios = consume:1
+
+    [profile:knee]
+    type = step
+    duration = 1800
+    start_rate = 0.1
+    step_rate = 0.1
+    step_duration = 300
+    scenarios = consume:0.6, publish:0.2, search:0.2
+
+    [profile:soak]
+    type = constant
+    duration = 7200
+    rate = 0.2
+    scenarios = consume:0.7, publish:0.1, search:0.1, compute:0.1
+
+    [profile:burst]
+    type = spike
+    duration = 900
+    rate = 0.05
+    spike_rate = 1
+    spike_start = 300
+    spike_duration = 60
+
+Rates are in flows per second, durations in seconds.
+"""
+import configparser
+import datetime
+import math
+
+PROFILE_TYPES = ('constant', 'ramp', 'step', 'spike')
+
+
+class LoadProfile:
+    """Arrival rate as a function of the time since the start of the profile, and a scenario mix"""
+
+    def __init__(self, name, profile_type, duration, rate=0.0, start_rate=0.0, end_rate=0.0, step_rate=0.0,
+                 step_duration=60.0, spike_rate=0.0, spike_start=0.0, spike_duration=0.0, max_in_flight=10,
+                 arrival='poisson', scenarios=None):
+        assert profile_type in PROFILE_TYPES, \
+            "Unknown profile type {}, select from {}".format(profile_type, PROFILE_TYPES)
+        assert duration > 0, "Profile {} needs a positive duration".format(name)
+        self.name = name
+        self.type = profile_type
+        self.duration = duration
+        self.rate = rate
+        self.start_rate = start_rate
+        self.end_rate = end_rate
+        self.step_rate = step_rate
+        self.step_duration = step_duration
+        self.spike_rate = spike_rate
+        self.spike_start = spike_start
+        self.spike_duration = spike_duration
+        self.max_in_flight = max_in_flight
+        self.arrival = arrival
+        self.scenarios = scenarios or {'consume': 1}
+
+    def rate_at(self, elapsed):
+        """Flows per second, `elapsed` seconds after the start of the profile"""
+        if self.type == 'constant':
+            return self.rate
+        if self.type == 'ramp':
+            fraction = min(max(elapsed / self.duration, 0), 1)
+            return self.start_rate + (self.end_rate - self.start_rate) * fraction
+        if self.type == 'step':
+            return self.start_rate + self.step_rate * math.floor(elapsed / self.step_duration)
+        if self.type == 'spike':
+            if self.spike_start <= elapsed < self.spike_start + self.spike_duration:
+                return self.spike_rate
+            return self.rate
+
+    def __repr__(self):
+        return "<LoadProfile {} {} for {}s>".format(self.name, self.type, self.duration)
+
+
+def parse_scenarios(value):
+    """'consume:0.7, search:0.3' to {'consume': 0.7, 'search': 0.3}"""
+    scenarios = dict()
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition(':')
+        scenarios[name.strip()] = float(weight) if weight else 1.0
+    return scenarios
+
+
+def parse_start(value, now=None):
+    """The start datetime from 'now', 'HH:MM' or 'YYYY-MM-DD HH:MM'"""
+    now = now or datetime.datetime.now()
+    value = value.strip()
+    if value == 'now':
+        return now
+    if len(value) <= 5:
+        start = datetime.datetime.combine(now.date(), datetime.datetime.strptime(value, "%H:%M").time())
+        if start < now:
+            start += datetime.timedelta(days=1)
+        return start
+    return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M")
+
+
+def load_profiles(path, now=None):
+    """Load the [run] and [profile:<name>] sections
+
+    :return: list of (start datetime, end datetime, LoadProfile), back to back in the order of [run] profiles
+    """
+    parser = configparser.ConfigParser()
+    assert parser.read(str(path)), "Load profile file {} not found".format(path)
+    run = parser['run']
+    start = parse_start(run.get('start', 'now'), now)
+
+    schedule = list()
+    for name in [n.strip() for n in run['profiles'].split(',') if n.strip()]:
+        section = parser['profile:{}'.format(name)]
+        profile = LoadProfile(
+            name,
+            section.get('type', 'constant'),
+            section.getfloat('duration'),
+            rate=section.getfloat('rate', 0.0),
+            start_rate=section.getfloat('start_rate', 0.0),
+            end_rate=section.getfloat('end_rate', 0.0),
+            step_rate=section.getfloat('step_rate', 0.0),
+            step_duration=section.getfloat('step_duration', 60.0),
+            spike_rate=section.getfloat('spike_rate', 0.0),
+            spike_start=section.getfloat('spike_start', 0.0),
+            spike_duration=section.getfloat('spike_duration', 0.0),
+            max_in_flight=section.getint('max_in_flight', 10),
+            arrival=section.get('arrival', 'poisson'),
+            scenarios=parse_scenarios(section.get('scenarios', 'consume')),
+        )
+        end = start + datetime.timedelta(seconds=profile.duration)
+        schedule.append((start, end, profile))
+        start = end
+    return schedule
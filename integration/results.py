@@ -0,0 +1,125 @@
+"""
+Append-only store of the flow iteration results, and the percentile report over time windows.
+
+Each iteration is one JSON line: scenario, intended start, start and end timestamps, phase timings, status and
+error class. The latency percentiles of the report are measured from the intended start, so the time spent
+waiting for a free worker counts (no coordinated omission), the service time percentiles from the actual start.
+Produce a report of a soak test with:
+
+    python integration/results.py /test_logs/<results file>.jsonl [window seconds]
+"""
+import csv
+import json
+import math
+import sys
+import threading
+import time
+
+
+class ResultsStore:
+    """JSON lines file, kept open for appending, safe to use from several threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(str(path), 'a', buffering=1)
+
+    def record(self, scenario, start, end, error=None, error_class=None, phases=None, worker=None, intended=None):
+        """Append the result of one iteration
+
+        :param error: Error message, None if the iteration succeeded
+        :param error_class: Name of the exception class
+        :param phases: dict of phase name: seconds
+        :param intended: When the iteration was scheduled to start, before queueing for a worker, `start` if None
+        """
+        intended = start if intended is None else intended
+        row = {
+            'scenario': scenario,
+            'worker': worker,
+            'intended': intended,
+            'start': start,
+            'end': end,
+            'latency': end - intended,
+            'duration': end - start,
+            'status': 'error' if error else 'ok',
+            'error_class': error_class if error else None,
+            'error': error,
+            'phases': phases or {},
+        }
+        line = json.dumps(row)
+        with self._lock:
+            self._file.write(line + '\n')
+        return row
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def load_results(path):
+    rows = list()
+    with open(str(path)) as f:
+        for line in f:
+            if line.strip():
+                rows.append(json.loads(line))
+    return rows
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(q * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def report(rows, window=60):
+    """Latency percentiles, throughput and error rate per time window and scenario
+
+    :param rows: Results, as from load_results()
+    :param window: Window size in seconds, windows are aligned on the first iteration start
+    :return: list of dicts, ordered by window and scenario
+    """
+    if not rows:
+        return list()
+    origin = min(row.get('intended', row['start']) for row in rows)
+    groups = dict()
+    for row in rows:
+        index = int((row['end'] - origin) // window)
+        groups.setdefault((index, row['scenario']), list()).append(row)
+
+    report_rows = list()
+    for (index, scenario), group in sorted(groups.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        ok = [row for row in group if row['status'] == 'ok']
+        # Rows stored before the intended start was recorded only have the service time
+        latencies = sorted(row.get('latency', row['duration']) for row in ok)
+        durations = sorted(row['duration'] for row in ok)
+        errors = [row for row in group if row['status'] != 'ok']
+        error_classes = dict()
+        for row in errors:
+            error_classes[row['error_class']] = error_classes.get(row['error_class'], 0) + 1
+        report_rows.append({
+            'window_start': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(origin + index * window)),
+            'scenario': scenario,
+            'completed': len(group),
+            'throughput': len(group) / window,
+            'error_rate': len(errors) / len(group),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'service_p50': percentile(durations, 0.50),
+            'service_p95': percentile(durations, 0.95),
+            'service_p99': percentile(durations, 0.99),
+            'errors': json.dumps(error_classes) if error_classes else '',
+        })
+    return report_rows
+
+
+if __name__ == '__main__':
+    assert 2 <= len(sys.argv) <= 3, "Usage: results.py <results.jsonl> [window seconds]"
+    window_seconds = float(sys.argv[2]) if len(sys.argv) == 3 else 60
+    report_rows = report(load_results(sys.argv[1]), window_seconds)
+    if report_rows:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(report_rows[0]))
+        writer.writeheader()
+        writer.writerows(report_rows)
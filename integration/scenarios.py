@@ -0,0 +1,106 @@
+"""
+The flow scenarios of the load tests, each a function of the context from test04_consume_asset.setup().
+"""
+import logging
+
+from ocean_utils.agreements.service_factory import ServiceDescriptor
+from ocean_utils.utils.utilities import get_timestamp
+from squid_py.brizo.brizo import Brizo
+from squid_py.models.algorithm_metadata import AlgorithmMetadata
+
+from test04_consume_asset import consume_flow
+from util.events import subscribe_event
+from util.misc import get_algorithm_example, get_metadata_example
+
+
+def publish_flow(ctx):
+    """Register a new asset
+
+    :return: The DID
+    """
+    ddo = ctx.ocn.assets.create(get_metadata_example(), ctx.publisher_account)
+    logging.info(f'registered ddo: {ddo.did}')
+    return ddo.did
+
+
+def search_flow(ctx):
+    """Text search in the metadata store
+
+    :return: Number of assets found
+    """
+    ddos = ctx.ocn.assets.search('data')
+    logging.info("Search returned {} assets".format(len(ddos)))
+    return len(ddos)
+
+
+def compute_flow(ctx):
+    """Publish an asset with a compute service, order it and start a compute job
+
+    :return: The compute job ID
+    """
+    ocn = ctx.ocn
+    cluster = ocn.compute.build_cluster_attributes('kubernetes', '/cluster/url')
+    containers = [ocn.compute.build_container_attributes(
+        "tensorflow/tensorflow",
+        "latest",
+        "sha256:cb57ecfa6ebbefd8ffc7f75c0f00e57a7fa739578a429b6f72a0df19315deadc")
+    ]
+    servers = [ocn.compute.build_server_attributes('1', 'xlsize', 16, 0, '16gb', '1tb', 2242244)]
+    provider_attributes = ocn.compute.build_service_provider_attributes(
+        'Azure', 'Compute power 1', cluster, containers, servers
+    )
+    attributes = ocn.compute.create_compute_service_attributes(
+        13, 3600, ctx.publisher_account.address, get_timestamp(), provider_attributes
+    )
+    service_endpoint = Brizo.get_compute_endpoint(ocn.config)
+    template_id = ocn.keeper.template_manager.create_template_id(
+        ocn.keeper.template_manager.SERVICE_TO_TEMPLATE_NAME['compute']
+    )
+    service_descriptor = ServiceDescriptor.compute_service_descriptor(attributes, service_endpoint, template_id)
+    ddo = ocn.assets.create(get_metadata_example(), ctx.publisher_account, [service_descriptor],
+                            use_secret_store=False)
+    logging.info(f'registered compute ddo: {ddo.did}')
+
+    agreement_id = ocn.compute.order(ddo.did, ctx.consumer_account)
+    # The chain head when the process started, unless the agreement block was recorded
+    from_block = ctx.block_cursors.from_block(agreement_id)
+    subscribe_event("created agreement", ctx.keeper, agreement_id, from_block)
+    subscribe_event("lock reward", ctx.keeper, agreement_id, from_block)
+    compute_approval_event = ocn.keeper.compute_execution_condition.subscribe_condition_fulfilled(
+        agreement_id, 30, None, [], from_block=from_block, wait=True
+    )
+    assert compute_approval_event, 'compute agreement is not approved yet.'
+
+    algorithm_meta = AlgorithmMetadata({
+        'language': 'python',
+        'rawcode': get_algorithm_example(),
+        'container': {
+            'tag': 'latest',
+            'image': 'amancevice/pandas',
+            'entrypoint': 'python $ALGO'
+        }
+    })
+    job_id = ocn.compute.start(agreement_id, ddo.did, ctx.consumer_account, algorithm_meta=algorithm_meta)
+    logging.info(f'compute job started: jobId={job_id}')
+    return job_id
+
+
+SCENARIOS = {
+    'consume': consume_flow,
+    'publish': publish_flow,
+    'search': search_flow,
+    'compute': compute_flow,
+}
+
+
+if __name__ == '__main__':
+    import sys
+    from test04_consume_asset import add_log_file_handler, save_flow_output, setup, teardown
+
+    assert len(sys.argv) == 2 and sys.argv[1] in SCENARIOS, "Usage: scenarios.py {}".format('|'.join(SCENARIOS))
+    add_log_file_handler()
+    ctx = setup()
+    try:
+        save_flow_output(SCENARIOS[sys.argv[1]](ctx))
+    finally:
+        teardown(ctx)
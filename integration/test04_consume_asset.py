@@ -9,118 +9,301 @@
 # export PARITY_ADDRESS1=0x06C0035fE67Cce2B8862D63Dc315D8C8c72207cA
 # export PARITY_PASSWORD1=ocean_secret
 # export PARITY_KEY_FILE1=/path/to/consumer/keyfile.json
+# export ASSET_POOL_PATH=/test_logs/asset_pool.json  # Optional, order pooled assets instead of publishing one per flow
+# export ASSET_POOL_SIZE=10
+# export ASSET_POOL_WORKERS=8  # Optional, publish the missing pooled assets concurrently, pipelining their transactions
+# export CONSUME_PARALLEL=true  # Optional, download with util.download instead of ocn.assets.consume()
+# export EVENT_STORE_PATH=/test_logs/events.sqlite  # Optional, answer the agreement checks from a local event index
+#
+# Run as a script for a single flow, or import setup() and consume_flow() to run many flows
+# from a warm process (see integration/workers.py).
 
 #%%
 import json
 import logging
 import os
+import time
+from types import SimpleNamespace
 
 from ocean_keeper import Keeper
+from ocean_keeper.web3_provider import Web3Provider
 from ocean_keeper.utils import get_account
 from ocean_utils.agreements.service_types import ServiceTypes
 from squid_py import Ocean
 import squid_py
 
 # Setup logging
-from util.events import subscribe_event
+from util.asset_pool import AssetPool
+from util.balance_maintainer import BalanceMaintainer
+from util.block_cursor import BlockCursorStore
+from util.events import record_phase_latencies, wait_for_agreement
 
-from util import logging as manta_logging, config
+from util import logging as manta_logging, config, metrics
 from util.misc import get_metadata_example
+from util.tracing import tracer
 
 manta_logging.logger.setLevel('INFO')
-from squid_py import Config
 from pathlib import Path
 import datetime
 
 #%% Set environment
 os.environ['USE_K8S_CLUSTER']='true'
 
-#%% Add a file  handler
-path_log_file = Path('/test_logs') / '{}.log'.format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-fh = logging.FileHandler(path_log_file)
-fh.setLevel(logging.DEBUG)
-manta_logging.logger.addHandler(fh)
-logging.info("Log file at: {}".format(path_log_file))
-# %% [markdown]
-# Get the configuration from the INI file
-#%%
-CONFIG_INI_PATH = config.get_config_file_path()
-logging.critical("Deployment type: {}".format(config.get_deployment_type()))
-logging.critical("Configuration file selected: {}".format(CONFIG_INI_PATH))
-logging.critical("Squid API version: {}".format(squid_py.__version__))
 
-config_from_ini = Config(CONFIG_INI_PATH)
+def add_log_file_handler():
+    """Add a file handler, logging to a new file in /test_logs"""
+    path_log_file = Path('/test_logs') / '{}.log'.format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    fh = logging.FileHandler(path_log_file)
+    fh.setLevel(logging.DEBUG)
+    manta_logging.logger.addHandler(fh)
+    logging.info("Log file at: {}".format(path_log_file))
+    return path_log_file
 
-#%%
-ocn = Ocean(config_from_ini)
-keeper = Keeper.get_instance()
 
-#%%
-# DOCKER_STRICT = False
-DOCKER_STRICT = True  # Strictly enforce the environment variables
-if DOCKER_STRICT:
-    assert 'PARITY_ADDRESS' in os.environ
-    assert 'PARITY_PASSWORD' in os.environ
-    assert 'PARITY_KEY_FILE' in os.environ
-    assert 'PARITY_ADDRESS1' in os.environ
-    assert 'PARITY_PASSWORD1' in os.environ
-    assert 'PARITY_KEY_FILE1' in os.environ
+def save_flow_output(output):
+    """Save the output of a flow for the controller, to the FLOW_OUTPUT_PATH file if it's set"""
+    if 'FLOW_OUTPUT_PATH' in os.environ:
+        with open(os.environ['FLOW_OUTPUT_PATH'], 'w') as f:
+            json.dump(output, f)
 
-# %% [markdown]
-# Get Publisher account, and register an asset for testing
 
-#%%
-# Get account from env vars: PARITY_ADDRESS, PARITY_PASSWORD, PARITY_KEY_FILE
-publisher_account = get_account(0)
+def wait_funded(balance_maintainer, acct, timeout=120):
+    """Wait for the balance maintainer to check, and refill if needed, the account"""
+    assert balance_maintainer.wait_ready(acct, timeout=timeout), "Refill of {} not done after {}s: {}".format(
+        acct.address, timeout, balance_maintainer.last_error(acct) or "timeout")
 
-print("Publisher address: {}".format(publisher_account.address))
-print("Publisher   ETH: {:0.1f}".format(ocn.accounts.balance(publisher_account).eth/10**18))
-print("Publisher OCEAN: {:0.1f}".format(ocn.accounts.balance(publisher_account).ocn/10**18))
 
-#%%
-# Register an asset
-metadata = get_metadata_example()
+def setup(event_fetcher=False, consumer_account=None):
+    """Everything that can be reused across flows: Ocean, Keeper, the accounts and the balance maintainer
 
-ddo = ocn.assets.create(metadata, publisher_account)
-logging.info(f'registered ddo: {ddo.did}')
+    :param event_fetcher: Wait for the agreement events with a util.event_fetcher.AgreementEventFetcher
+        polling in the background, one log query for all the agreements of the process, instead of 4
+        filters per agreement. Worth it in a long-lived worker process running many flows.
+    :param consumer_account: Account of this process, i.e. leased from an account manifest, which also
+        publishes. By default the PARITY_ADDRESS1 consumer and the PARITY_ADDRESS publisher, shared by
+        every process using the same environment.
+    :return: SimpleNamespace context for consume_flow()
+    """
+    # %% [markdown]
+    # Get the configuration from the INI file
+    #%%
+    deployment_config = config.get_deployment_config()
+    logging.critical("Deployment type: {}".format(deployment_config.deployment_type))
+    logging.critical("Configuration file selected: {}".format(deployment_config.config_file_path))
+    logging.critical("Squid API version: {}".format(squid_py.__version__))
 
-# %% [markdown]
-# Get Consumer account
-#%%
-# Get account from env vars: PARITY_ADDRESS1, PARITY_PASSWORD1, PARITY_KEY_FILE1
-consumer_account = get_account(1)
-print("Consumer address: {}".format(consumer_account.address))
-print("Consumer   ETH: {:0.1f}".format(ocn.accounts.balance(consumer_account).eth/10**18))
-print("Consumer OCEAN: {:0.1f}".format(ocn.accounts.balance(consumer_account).ocn/10**18))
-assert (ocn.accounts.balance(consumer_account).eth/10**18) > 1, "Insuffient ETH in account {}".format(consumer_account.address)
-# Ensure the consumer always has 10 OCEAN
-if (ocn.accounts.balance(consumer_account).ocn/10**18) < 10:
-    refill_amount = 10 - ocn.accounts.balance(consumer_account).ocn/10**18 < 10
-    ocn.accounts.request_tokens(consumer_account, refill_amount)
+    config_from_ini = config.get_squid_config()
 
-# %% [markdown]
-# Initiate the agreement for accessing (downloading) the asset
-#%%
-agreement_id = ocn.assets.order(ddo.did, 'Access', consumer_account)
-logging.info("Consumer has placed an order for asset {}".format(ddo.did))
-logging.info("The service agreement ID is {}".format(agreement_id))
+    #%%
+    ocn = Ocean(config_from_ini)
+    keeper = Keeper.get_instance()
 
-# %% [markdown]
-# In Ocean Protocol, downloading an asset is enforced by a contract.
-# The contract conditions and clauses are set by the publisher. Conditions trigger events, which are monitored
-# to ensure the contract is successfully executed.
-#%%
-# Listen to events in the download process
-subscribe_event("created agreement", keeper, agreement_id)
-subscribe_event("lock reward", keeper, agreement_id)
-subscribe_event("access secret store", keeper, agreement_id)
-subscribe_event("escrow reward", keeper, agreement_id)
+    #%%
+    # DOCKER_STRICT = False
+    DOCKER_STRICT = True  # Strictly enforce the environment variables
+    if DOCKER_STRICT:
+        assert 'PARITY_ADDRESS' in os.environ
+        assert 'PARITY_PASSWORD' in os.environ
+        assert 'PARITY_KEY_FILE' in os.environ
+        assert 'PARITY_ADDRESS1' in os.environ
+        assert 'PARITY_PASSWORD1' in os.environ
+        assert 'PARITY_KEY_FILE1' in os.environ
+
+    # %% [markdown]
+    # Get Publisher account
+
+    #%%
+    # Get account from env vars: PARITY_ADDRESS, PARITY_PASSWORD, PARITY_KEY_FILE
+    publisher_account = get_account(0)
+
+    print("Publisher address: {}".format(publisher_account.address))
+    print("Publisher   ETH: {:0.1f}".format(ocn.accounts.balance(publisher_account).eth/10**18))
+    print("Publisher OCEAN: {:0.1f}".format(ocn.accounts.balance(publisher_account).ocn/10**18))
+
+    # %% [markdown]
+    # Get Consumer account
+    #%%
+    # Get account from env vars: PARITY_ADDRESS1, PARITY_PASSWORD1, PARITY_KEY_FILE1
+    leased = consumer_account is not None
+    if not leased:
+        consumer_account = get_account(1)
+    print("Consumer address: {}".format(consumer_account.address))
+
+    # Ensure the consumer always has 1 ETH and 10 OCEAN, refilled in the background
+    balance_maintainer = BalanceMaintainer(ocn, [consumer_account], min_eth=1, min_ocean=10, refill_ocean=10).start()
+
+    # Every agreement of this process is ordered after the current chain head
+    block_cursors = BlockCursorStore(os.environ.get('BLOCK_CURSOR_PATH', Path('/test_logs') / 'block_cursors.json'))
+    block_cursors.set_checkpoint(Web3Provider.get_web3().eth.blockNumber)
+
+    # Pre-published assets, validated and topped up once per process
+    asset_pool = None
+    if 'ASSET_POOL_PATH' in os.environ:
+        asset_pool = AssetPool(os.environ['ASSET_POOL_PATH'], int(os.environ.get('ASSET_POOL_SIZE', 10)))
+        pool_workers = int(os.environ.get('ASSET_POOL_WORKERS', 1))
+        if pool_workers > 1:
+            # The DID registrations of the concurrent publications get their nonces from the manager
+            from util.nonce_manager import NonceManager, signer_from_key_file
+            nonce_manager = NonceManager(max_outstanding=pool_workers).start()
+            signer = signer_from_key_file(os.environ['PARITY_KEY_FILE'], os.environ['PARITY_PASSWORD'])
+            try:
+                with nonce_manager.routed(keeper.did_registry, signer):
+                    asset_pool.ensure(ocn, publisher_account, max_workers=pool_workers)
+            finally:
+                nonce_manager.stop()
+        else:
+            asset_pool.ensure(ocn, publisher_account)
+        logging.info("Asset pool of {} assets".format(len(asset_pool)))
+
+    # The first check and refill run before any measured flow
+    wait_funded(balance_maintainer, consumer_account)
+
+    # Local index of the agreement events, shared by the processes using the same file
+    event_store = event_indexer = None
+    if 'EVENT_STORE_PATH' in os.environ:
+        from util.event_store import EventIndexer, EventStore
+        event_store = EventStore(os.environ['EVENT_STORE_PATH'])
+        # A new store starts at the chain head, an existing one resumes after its last indexed block
+        from_block = Web3Provider.get_web3().eth.blockNumber if event_store.last_block < 0 else 0
+        event_indexer = EventIndexer(keeper, event_store, from_block=from_block)
+        event_indexer.start()
+
+    fetcher = None
+    if event_fetcher:
+        from util.event_fetcher import AgreementEventFetcher
+        fetcher = AgreementEventFetcher(keeper, from_block=Web3Provider.get_web3().eth.blockNumber)
+        fetcher.start()
+
+    if leased:
+        # The env publisher is shared by all the processes, only the asset pool (under its file lock) uses it
+        publisher_account = consumer_account
+
+    return SimpleNamespace(ocn=ocn, keeper=keeper, publisher_account=publisher_account,
+                           consumer_account=consumer_account, balance_maintainer=balance_maintainer,
+                           block_cursors=block_cursors, asset_pool=asset_pool, event_fetcher=fetcher,
+                           event_store=event_store, event_indexer=event_indexer)
+
+
+def teardown(ctx):
+    """Stop the background threads of a context from setup()"""
+    ctx.balance_maintainer.stop()
+    if ctx.event_fetcher:
+        ctx.event_fetcher.stop()
+    if ctx.event_indexer:
+        ctx.event_indexer.stop()
+        ctx.event_store.close()
+
+
+def consume_flow(ctx):
+    """Publish an asset, order it, wait for the agreement conditions and consume it
+
+    Each step is a span of util.tracing, nested in one 'consume flow' span.
+
+    :param ctx: Context from setup()
+    :return: dict of the agreement ID, and the phase timings in seconds
+    """
+    ocn = ctx.ocn
+    consumer_account = ctx.consumer_account
+    block_cursors = ctx.block_cursors
+    phases = dict()
+
+    with tracer.span('consume flow', account=consumer_account.address) as flow_span:
+        # %% [markdown]
+        # Register an asset for testing, or take the next one of the asset pool
+        #%%
+        if ctx.asset_pool:
+            did = ctx.asset_pool.next()
+            logging.info(f'pooled ddo: {did}')
+        else:
+            metadata = get_metadata_example()
+
+            with tracer.span('publish', account=ctx.publisher_account.address) as span:
+                ddo = ocn.assets.create(metadata, ctx.publisher_account)
+                span.set_attribute('did', ddo.did)
+            phases['publish'] = span.duration
+            did = ddo.did
+            logging.info(f'registered ddo: {did}')
+        flow_span.set_attribute('did', did)
+
+        # %% [markdown]
+        # Initiate the agreement for accessing (downloading) the asset
+        #%%
+        # The first refill was done in setup(), only wait if a later one is in progress or failed
+        with tracer.span('wait balance', account=consumer_account.address):
+            wait_funded(ctx.balance_maintainer, consumer_account)
+            assert (ocn.accounts.balance(consumer_account).eth/10**18) > 1, "Insuffient ETH in account {}".format(consumer_account.address)
+
+        # The consumer sends the order and the lock reward, the refills of the account wait until they are mined
+        with ctx.balance_maintainer.in_use(consumer_account):
+            # The agreement is created after the current chain head, so event subscriptions can start scanning from there
+            order_block = Web3Provider.get_web3().eth.blockNumber
+
+            ordered_at = time.time()
+            with tracer.span('order', did=did, account=consumer_account.address, block=order_block) as span:
+                agreement_id = ocn.assets.order(did, 'Access', consumer_account)
+                span.set_attribute('agreement_id', agreement_id)
+            phases['order'] = span.duration
+            flow_span.set_attribute('agreement_id', agreement_id)
+            logging.info("Consumer has placed an order for asset {}".format(did))
+            logging.info("The service agreement ID is {}".format(agreement_id))
+
+            # %% [markdown]
+            # In Ocean Protocol, downloading an asset is enforced by a contract.
+            # The contract conditions and clauses are set by the publisher. Conditions trigger events, which are monitored
+            # to ensure the contract is successfully executed.
+            #%%
+            # Listen to all events in the download process at once, each condition is a child span
+            with tracer.span('wait agreement', agreement_id=agreement_id):
+                if ctx.event_fetcher:
+                    condition_results = ctx.event_fetcher.wait_for_agreement(agreement_id, from_block=order_block)
+                else:
+                    condition_results = wait_for_agreement(ctx.keeper, agreement_id, from_block=order_block,
+                                                           store=ctx.event_store)
+        for condition_result in condition_results.values():
+            logging.info("{} fulfilled after {:0.2f}s".format(condition_result.name, condition_result.latency))
+            phases[condition_result.name] = condition_result.latency
+
+        # %% [markdown]
+        # Now that the agreement is signed, the consumer can download the asset.
+        #%%
+
+        with tracer.span('access granted', did=did, agreement_id=agreement_id,
+                         account=consumer_account.address) as span:
+            # From the local event index if it has the event already, otherwise on-chain
+            if not (ctx.event_store and ctx.event_store.is_access_granted(agreement_id, consumer_account.address)):
+                assert ocn.agreements.is_access_granted(agreement_id, did, consumer_account.address)
+        phases['access granted'] = span.duration
+
+        with tracer.span('consume', did=did, agreement_id=agreement_id,
+                         account=consumer_account.address) as span:
+            if os.environ.get('CONSUME_PARALLEL', 'false').lower() == 'true':
+                from util.download import consume_asset
+                paths = consume_asset(ocn, agreement_id, did, consumer_account, 'downloads_nile')
+                span.set_attribute('files', len(paths))
+            else:
+                ocn.assets.consume(agreement_id, did, ServiceTypes.ASSET_ACCESS, consumer_account, 'downloads_nile')
+        phases['consume'] = span.duration
+        logging.info('Success buying asset.')
+    # Outside the flow span, later checks of the agreement start scanning from its block
+    block_cursors.record(agreement_id, order_block)
+    # The block timestamps of the phase histograms are RPCs, also outside the flow span
+    record_phase_latencies(condition_results, ordered_at)
+    return {'agreement_id': agreement_id, 'phases': phases}
 
-# %% [markdown]
-# Now that the agreement is signed, the consumer can download the asset.
-#%%
 
-assert ocn.agreements.is_access_granted(agreement_id, ddo.did, consumer_account.address)
+if __name__ == '__main__':
+    path_log_file = add_log_file_handler()
+    # Trace of the flow steps, view it with python -m util.tracing <file>.trace.jsonl > trace.json
+    if 'TRACE_PATH' not in os.environ:
+        tracer.open(path_log_file.with_suffix('.trace.jsonl'))
+    ctx = setup()
+    try:
+        save_flow_output(consume_flow(ctx))
+    finally:
+        teardown(ctx)
 
-ocn.assets.consume(agreement_id, ddo.did, ServiceTypes.ASSET_ACCESS, consumer_account, 'downloads_nile')
-logging.info('Success buying asset.')
+    #%%
+    # Save the phase latencies of this run, merge the runs with metrics.HistogramRegistry.from_json() and .merge()
+    metrics.registry.to_json(path_log_file.with_suffix('.histograms.json'))
+    metrics.registry.to_csv(path_log_file.with_suffix('.histograms.csv'))
+    tracer.close()
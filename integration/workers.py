@@ -0,0 +1,132 @@
+"""
+Pool of warm worker processes for the controller.
+
+Each worker imports squid_py and web3, builds its Ocean and Keeper instances, loads the contract ABIs and
+starts its agreement event fetcher once, in test04_consume_asset.setup(). Flow iterations are then sent to the workers, so their latency
+reflects the protocol rather than the Python cold start.
+"""
+import logging
+import multiprocessing
+import time
+import traceback
+
+from util import metrics
+
+_context = None
+# Counter values already sent to the controller with a result
+_reported_counters = dict()
+
+
+def init_context(entry=None):
+    """Set up the warm context of this process
+
+    :param entry: Manifest entry of the account leased to this process, which sends all its transactions,
+        None to use the accounts of the environment
+    """
+    global _context
+    import test04_consume_asset
+    consumer_account = None
+    if entry:
+        from util.provision import manifest_account
+        consumer_account = manifest_account(entry)
+    # One background log query for the agreement events of all the flows of this worker
+    _context = test04_consume_asset.setup(event_fetcher=True, consumer_account=consumer_account)
+    from ocean_keeper.web3_provider import Web3Provider
+    metrics.install_rpc_counter(Web3Provider.get_web3())
+    logging.info("Worker {} ready, account {}".format(multiprocessing.current_process().name,
+                                                     _context.consumer_account.address))
+    return _context
+
+
+def _init_worker(accounts=None):
+    init_context(accounts.get() if accounts is not None else None)
+
+
+def _counter_deltas():
+    """The counters incremented since the last call, as a list of (name, labels, increment)"""
+    deltas = list()
+    for name, labels, value in metrics.registry.counters():
+        key = (name, tuple(sorted(labels.items())))
+        if value != _reported_counters.get(key, 0):
+            deltas.append((name, labels, value - _reported_counters.get(key, 0)))
+            _reported_counters[key] = value
+    return deltas
+
+
+def _run_iteration(scenario='consume'):
+    from scenarios import SCENARIOS
+    started = time.time()
+    try:
+        output = SCENARIOS[scenario](_context)
+        error = error_class = None
+    except Exception as e:
+        output = None
+        error = "{}: {}".format(type(e).__name__, e)
+        error_class = type(e).__name__
+        logging.error(traceback.format_exc())
+    return {
+        'worker': multiprocessing.current_process().name,
+        'scenario': scenario,
+        'started': started,
+        'finished': time.time(),
+        'output': output,
+        'phases': output.get('phases', {}) if isinstance(output, dict) else {},
+        'error': error,
+        'error_class': error_class,
+        'counters': _counter_deltas(),
+    }
+
+
+def _failed_iteration(scenario, started, e):
+    """The result of an iteration which raised outside of its flow, i.e. the worker died"""
+    return {
+        'worker': None,
+        'scenario': scenario,
+        'started': started,
+        'finished': time.time(),
+        'output': None,
+        'phases': {},
+        'error': "{}: {}".format(type(e).__name__, e),
+        'error_class': type(e).__name__,
+        'counters': [],
+    }
+
+
+class WarmWorkerPool:
+    """N worker processes, each with a warm Ocean and Keeper instance, and its own account"""
+
+    def __init__(self, n_workers, accounts=()):
+        """
+        :param accounts: Manifest entries, as saved by util.provision.save_manifest(), one is leased to each
+            worker. Without them, the workers share the accounts of the environment, only for one worker.
+        """
+        assert len(accounts) >= n_workers or (not accounts and n_workers == 1), \
+            "{} workers need as many accounts, got {}".format(n_workers, len(accounts))
+        self.n_workers = n_workers
+        queue = None
+        if accounts:
+            queue = multiprocessing.Queue()
+            for entry in accounts[:n_workers]:
+                queue.put(entry)
+        self._pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(queue,))
+
+    def submit(self, callback=None, scenario='consume'):
+        """Run one flow iteration on the next free worker
+
+        :param callback: Called in the parent process with the result dict of the iteration, also if it failed
+            outside of the flow
+        :param scenario: Name of the flow, a key of scenarios.SCENARIOS
+        :return: multiprocessing AsyncResult
+        """
+        started = time.time()
+
+        def _error_callback(e):
+            logging.error("Iteration failed in the worker pool: {}".format(e))
+            if callback:
+                callback(_failed_iteration(scenario, started, e))
+        return self._pool.apply_async(_run_iteration, (scenario,), callback=callback, error_callback=_error_callback)
+
+    def close(self):
+        """Wait for the submitted iterations, and stop the workers"""
+        self._pool.close()
+        self._pool.join()
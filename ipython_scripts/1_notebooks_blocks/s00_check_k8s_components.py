@@ -1,16 +1,15 @@
 # %% [markdown]
 # # Pre-sail checklist - Ocean protocol component status
 # With simulated Kubernetes endpoints deployed, this script will make a simple
-# HTTP request to each, and report the status returned.
+# HTTP request to each, all at once, and report the status and latency returned.
 #
 # %%
 # Standard imports
-import requests
-import os
 import logging
-from pathlib import Path
 
 from mantaray_utilities import logging as manta_logging
+from util import config
+from util.probe import EndpointProber, format_result
 
 #%%
 # For this test, set the configuration environment variable for kubernetes.
@@ -20,39 +19,22 @@ from mantaray_utilities import logging as manta_logging
 
 manta_logging.logger.setLevel('INFO')
 
-# Get the configuration file path for this environment
-OCEAN_CONFIG_PATH = Path(os.environ['OCEAN_CONFIG_PATH'])
-assert OCEAN_CONFIG_PATH.exists()
-logging.info("OCEAN_CONFIG_PATH:{}".format(OCEAN_CONFIG_PATH))
-
-import configparser
-config = configparser.ConfigParser()
-config.read(OCEAN_CONFIG_PATH)
+# Get the configuration of this environment, parsed once from the environment and the INI file
+deployment_config = config.get_deployment_config()
+logging.info("Configuration file selected: {}".format(deployment_config.config_file_path))
 
 # %%
 # The endpoints (microservices) are defined in the below dictionary
 
 #%%
 # For now, the endpoints are hard-coded by the dev-ops team.
-endpoints_dict = {
-    'aquarius': config['resources']['aquarius.url'],
-    'brizo': config['resources']['brizo.url'],
-    'Ethereum node': config['keeper-contracts']['keeper.url'],
-    'secret_store': config['keeper-contracts']['secret_store.url'],
-}
+endpoints_dict = deployment_config.endpoints
 
 swagger_pages = dict()
 swagger_pages['aquarius Swagger documentation'] = endpoints_dict['aquarius'] + '/api/v1/docs/'
 swagger_pages['brizo Swagger documentation'] = endpoints_dict['brizo'] + '/api/v1/docs/'
 
 
-def check_endpoint(endpoint_name, endpoint_url, verb='GET', ):
-    """HTTP Request on the given URL"""
-    res = requests.request(verb, endpoint_url)
-    logging.debug("{} : returns {}".format(endpoint_name, res.status_code))
-    return res
-
-
 # %%
 # The microscervices for MetaData storage (aquarius) and for service negotiation (brizo) have Swagger documentation :)
 #%%
@@ -60,26 +42,18 @@ print("Aquarius MetaData storage API:", swagger_pages['aquarius Swagger document
 print("Brizo Access API:", swagger_pages['brizo Swagger documentation'])
 
 # %% [markdown]
-# Finally, we will iterate over the endpoint and check for a response
+# Finally, we will check all the endpoints at once for a response, each with a 5 second timeout
 #
 #%%
-flag_fail = False
+prober = EndpointProber(endpoints_dict, timeout=5)
 for endpoint in endpoints_dict:
-    with manta_logging.LoggerCritical():
-        print("Checking {} at {}".format(endpoint, endpoints_dict[endpoint]))
-        try:
-            res = check_endpoint(endpoint, endpoints_dict[endpoint])
-            if 'Content-Type' in res.headers:
-                if res.headers['Content-Type'] == 'application/json':
-                    if 'software' in res.json().keys() and 'version' in res.json().keys():
-                        print("\t Success: {} v{}".format(res.json()['software'], res.json()['version']))
-                else:
-                    print("\t Success")
-            else:
-                print("\t Success")
-        except:
-            flag_fail = True
-            print('\t Failed!')
+    print("Checking {} at {}".format(endpoint, endpoints_dict[endpoint]))
+with manta_logging.LoggerCritical():
+    probe_results = prober.probe_all()
+for probe_result in probe_results.values():
+    print(format_result(probe_result))
+flag_fail = not all(probe_result.ok for probe_result in probe_results.values())
+prober.close()
 
 if flag_fail:
     print("Failure in a component, please contact an administrator on our Gitter channel - https://gitter.im/oceanprotocol/Lobby")
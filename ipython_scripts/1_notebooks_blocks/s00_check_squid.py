@@ -57,10 +57,10 @@ ocn = Ocean(configuration)
 # The following cell performs some sanity checks on versions of smart contracts. The smart contract signatures
 # are placed in an 'artifacts' folder. When you pip-install the squid-py API, these artifacts are located in the
 # virtual environment, and you don't need to worry about them. For demonstration purposes, I've moved the artifacts
-# into the project folder here.
+# into the project folder here. The contracts verified before on the same chain, with the same artifacts, are
+# not checked again.
 
-assert_contracts.assert_contract_ABI_versions(ocn, 'nile')
-assert_contracts.assert_contract_code(ocn, 'nile')
+assert_contracts.verify_contracts(ocn, 'nile')
 
 # %% [markdown]
 # The following cell will print some summary information of the Ocean connection.
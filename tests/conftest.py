@@ -0,0 +1,5 @@
+"""The integration scripts import each other as top-level modules, i.e. `from loadgen import ...`"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'integration'))
@@ -0,0 +1,66 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('ocean_keeper')
+
+from util.user import AccountPool  # noqa: E402
+
+
+class _Account:
+    def __init__(self, address):
+        self.address = address
+        self.password = None
+
+
+class _Accounts:
+    def __init__(self, eth):
+        self.eth = eth
+        self.lists = 0
+
+    def list(self):
+        self.lists += 1
+        return [_Account('0x{:040x}'.format(i)) for i in range(len(self.eth))]
+
+    def balance(self, acct):
+        time.sleep(0.01)
+        return SimpleNamespace(eth=self.eth[int(acct.address, 16)] * 10 ** 18, ocn=0)
+
+
+def _pool(eth, **kwargs):
+    accounts = _Accounts(eth)
+    passwords = {'0x{:040x}'.format(i): 'secret' for i in range(len(eth))}
+    return AccountPool(SimpleNamespace(accounts=accounts), passwords, **kwargs), accounts
+
+
+def test_leases_are_exclusive():
+    pool, _ = _pool([5, 0, 5])
+    first = pool.lease()
+    second = pool.lease()
+    assert {first.address, second.address} == {'0x{:040x}'.format(0), '0x{:040x}'.format(2)}
+    assert first.password == 'secret'
+    with pytest.raises(TimeoutError):
+        pool.lease(timeout=0.01)
+    pool.release(first)
+    with pool.leased() as acct:
+        assert acct is first
+
+
+def test_random_account_from_the_funded_accounts():
+    pool, accounts = _pool([5, 0, 5, 5])
+    leased = pool.lease()
+    picked = {pool.random_account().address for _ in range(200)}
+    assert leased.address in picked and '0x{:040x}'.format(1) not in picked
+    assert accounts.lists == 1
+
+
+def test_one_refresh_at_a_time():
+    pool, accounts = _pool([5] * 20, ttl=60)
+    threads = [threading.Thread(target=pool.random_account) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert accounts.lists == 1
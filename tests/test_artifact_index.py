@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('eth_utils')
+
+from util import artifact_index  # noqa: E402
+
+TRANSFER = {'type': 'event', 'name': 'Transfer', 'anonymous': False, 'inputs': [
+    {'name': 'from', 'type': 'address', 'indexed': True},
+    {'name': 'to', 'type': 'address', 'indexed': True},
+    {'name': 'value', 'type': 'uint256', 'indexed': False}]}
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+
+def _write_artifact(path, name, version, mtime):
+    path.write_text(json.dumps({'name': name, 'address': '0x' + '12' * 20, 'version': version,
+                                'abi': [TRANSFER, {'type': 'function', 'name': 'transfer'}], 'bytecode': '0x00'}))
+    os.utime(str(path), ns=(mtime, mtime))
+
+
+def test_index(tmp_path):
+    artifacts = tmp_path / 'artifacts'
+    artifacts.mkdir()
+    _write_artifact(artifacts / 'OceanToken.pacific.json', 'OceanToken', 'v0.12.7', 10 ** 18)
+    _write_artifact(artifacts / 'OceanToken.nile.json', 'OceanToken', 'v0.12.0', 10 ** 18)
+    index_path = tmp_path / 'index.pickle'
+    artifact_index.invalidate()
+
+    token = artifact_index.load_index(artifacts, 'pacific', index_path)['OceanToken']
+    assert token.version == 'v0.12.7'
+    assert token.topics == {TRANSFER_TOPIC: 'Transfer'}
+    assert index_path.exists()
+    assert artifact_index.load_index(artifacts, 'pacific', index_path)['OceanToken'] is token
+
+    # A modified artifact is parsed again
+    _write_artifact(artifacts / 'OceanToken.pacific.json', 'OceanToken', 'v0.13.0', 2 * 10 ** 18)
+    assert artifact_index.load_index(artifacts, 'pacific', index_path)['OceanToken'].version == 'v0.13.0'
+
+    # A new process loads the pickled index
+    artifact_index.invalidate()
+    assert artifact_index.load_index(artifacts, 'pacific', index_path)['OceanToken'].version == 'v0.13.0'
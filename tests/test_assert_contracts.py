@@ -0,0 +1,70 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('pip_api')
+pytest.importorskip('ocean_keeper')
+
+from util import artifact_index, assert_contracts  # noqa: E402
+
+ADDRESSES = {'DIDRegistry': '0x' + '1' * 40, 'Dispenser': '0x' + '2' * 40}
+
+
+class FakeEth:
+    def __init__(self, codes, genesis=b'\x01' * 32):
+        self.codes = codes
+        self.genesis = genesis
+        self.calls = list()
+
+    def getBlock(self, number):
+        return {'hash': self.genesis}
+
+    def getCode(self, address):
+        self.calls.append(address)
+        return self.codes.get(address, b'')
+
+
+@pytest.fixture
+def chain(tmp_path, monkeypatch):
+    artifacts = tmp_path / 'artifacts_nile'
+    artifacts.mkdir()
+    for name, address in ADDRESSES.items():
+        (artifacts / '{}.nile.json'.format(name)).write_text(json.dumps(
+            {'name': name, 'address': address, 'abi': [], 'version': 'v0.12.7'}))
+    monkeypatch.setattr(artifact_index, 'DEFAULT_INDEX_FOLDER', tmp_path / 'cache')
+    artifact_index.invalidate()
+
+    eth = FakeEth({address: b'\x60\x80' for address in ADDRESSES.values()})
+    web3 = SimpleNamespace(eth=eth, provider=SimpleNamespace(),
+                           manager=SimpleNamespace(request_blocking=lambda method, params: '8995'))
+    monkeypatch.setattr(assert_contracts, 'Web3Provider', SimpleNamespace(get_web3=lambda: web3))
+    yield SimpleNamespace(ocn=SimpleNamespace(_config=SimpleNamespace(keeper_path=str(artifacts))), eth=eth,
+                          cache_path=tmp_path / 'cache' / 'verified_contracts.json')
+    artifact_index.invalidate()
+
+
+def test_cache_hit_skips_the_code_checks(chain):
+    contracts = assert_contracts.verify_contracts(chain.ocn, 'nile', chain.cache_path)
+    assert sorted(name for name, _, _, _ in contracts) == sorted(ADDRESSES)
+    assert sorted(chain.eth.calls) == sorted(ADDRESSES.values())
+
+    chain.eth.calls.clear()
+    assert assert_contracts.verify_contracts(chain.ocn, 'nile', chain.cache_path) == contracts
+    assert chain.eth.calls == []
+
+
+def test_another_chain_is_verified_again(chain):
+    assert_contracts.verify_contracts(chain.ocn, 'nile', chain.cache_path)
+    chain.eth.calls.clear()
+    # A redeployment of the local chain keeps the chain ID, not the genesis block
+    chain.eth.genesis = b'\x02' * 32
+    assert_contracts.verify_contracts(chain.ocn, 'nile', chain.cache_path)
+    assert len(chain.eth.calls) == len(ADDRESSES)
+
+
+def test_missing_code_is_not_cached(chain):
+    del chain.eth.codes[ADDRESSES['Dispenser']]
+    with pytest.raises(AssertionError):
+        assert_contracts.verify_contracts(chain.ocn, 'nile', chain.cache_path)
+    assert not chain.cache_path.exists()
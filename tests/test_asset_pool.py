@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from util.asset_pool import AssetPool
+
+
+class _Assets:
+    def __init__(self):
+        self.created = 0
+        self.gone = set()
+
+    def create(self, metadata, publisher_account):
+        self.created += 1
+        return SimpleNamespace(did='did:op:{}'.format(self.created))
+
+    def resolve(self, did):
+        if did in self.gone:
+            raise ValueError('not found')
+        return SimpleNamespace(did=did)
+
+
+def test_fill_validate_and_next(tmp_path):
+    ocn = SimpleNamespace(assets=_Assets())
+    publisher = SimpleNamespace(address='0xpublisher')
+    pool = AssetPool(tmp_path / 'pool.json', size=3)
+    assert pool.fill(ocn, publisher, metadata_factory=dict) == ['did:op:1', 'did:op:2', 'did:op:3']
+    # Full, another process doesn't publish again
+    assert AssetPool(tmp_path / 'pool.json', size=3).fill(ocn, publisher, metadata_factory=dict) == []
+
+    ocn.assets.gone.add('did:op:2')
+    assert pool.validate(ocn) == ['did:op:2']
+    pool.fill(ocn, publisher, metadata_factory=dict)
+    assert sorted(AssetPool(tmp_path / 'pool.json').dids) == ['did:op:1', 'did:op:3', 'did:op:4']
+
+    handed_out = [pool.next() for _ in range(6)]
+    assert sorted(set(handed_out)) == sorted(pool.dids)
+    assert handed_out[:3] == handed_out[3:]
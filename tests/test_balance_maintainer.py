@@ -0,0 +1,56 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('ocean_keeper')
+
+from util.balance_maintainer import SCALE, BalanceMaintainer  # noqa: E402
+
+
+class _Accounts:
+    def __init__(self, ocean, fail=()):
+        self.ocean = dict(ocean)
+        self.fail = set(fail)
+        self.requests = list()
+
+    def balance(self, acct):
+        return SimpleNamespace(eth=5 * SCALE, ocn=self.ocean[acct.address] * SCALE)
+
+    def request_tokens(self, acct, amount):
+        self.requests.append((acct.address, time.time()))
+        if acct.address in self.fail:
+            raise ValueError('dispenser reverted')
+        self.ocean[acct.address] += amount
+        return True
+
+
+def _account(address):
+    return SimpleNamespace(address=address)
+
+
+def test_only_successful_refills_count():
+    accounts = _Accounts({'0xa': 0, '0xb': 0, '0xc': 50}, fail={'0xb'})
+    good, bad, funded = _account('0xa'), _account('0xb'), _account('0xc')
+    maintainer = BalanceMaintainer(SimpleNamespace(accounts=accounts), [good, bad, funded])
+    assert maintainer.check_once() == 1
+    assert (maintainer.refills, maintainer.refill_failures) == (1, 1)
+    assert maintainer.wait_ready(good, 0) and maintainer.wait_ready(funded, 0)
+    assert not maintainer.wait_ready(bad, 0)
+    assert isinstance(maintainer.last_error(bad), ValueError)
+
+
+def test_refill_waits_while_the_account_is_in_use():
+    accounts = _Accounts({'0xa': 0})
+    acct = _account('0xa')
+    maintainer = BalanceMaintainer(SimpleNamespace(accounts=accounts), [acct])
+    with maintainer.in_use(acct):
+        thread = threading.Thread(target=maintainer.check_once)
+        thread.start()
+        time.sleep(0.1)
+        assert accounts.requests == []
+        released = time.time()
+    thread.join()
+    assert accounts.requests[0][1] >= released
+    assert maintainer.wait_ready(acct, 0)
@@ -0,0 +1,47 @@
+import multiprocessing
+
+from util.block_cursor import BlockCursorStore
+
+
+def test_record_and_get(tmp_path):
+    store = BlockCursorStore(tmp_path / 'cursors.json', max_agreements=2)
+    for i in range(3):
+        store.record('0x{}'.format(i), 100 + i)
+    assert store.get('0x2') == 102
+    # The oldest agreement was dropped
+    assert store.get('0x0', default=None) is None
+    assert BlockCursorStore(tmp_path / 'cursors.json').get('0x1') == 101
+
+
+def test_from_block_falls_back_to_the_checkpoint(tmp_path):
+    path = tmp_path / 'cursors.json'
+    assert BlockCursorStore(path).from_block('0x1') == 0
+
+    first = BlockCursorStore(path)
+    first.set_checkpoint(500)
+    first.record('0x1', 520)
+    assert (first.from_block('0x1'), first.from_block('0x2')) == (520, 500)
+
+    # A later process starts from the checkpoint of the earlier run, until it sets its own
+    second = BlockCursorStore(path)
+    assert second.from_block('0x2') == 500
+    second.set_checkpoint(600)
+    # The checkpoint of a later process doesn't move the one of this process past its agreements
+    first.record('0x3', 510)
+    assert first.checkpoint == 500 and BlockCursorStore(path).checkpoint == 600
+
+
+def _record_many(path, worker):
+    store = BlockCursorStore(path)
+    for i in range(20):
+        store.record('0x{}-{}'.format(worker, i), i)
+
+
+def test_concurrent_processes_keep_all_updates(tmp_path):
+    path = tmp_path / 'cursors.json'
+    processes = [multiprocessing.Process(target=_record_many, args=(path, worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(BlockCursorStore(path)._read()['agreements']) == 80
@@ -0,0 +1,52 @@
+import pytest
+
+from util import config
+
+INI = """
+[keeper-contracts]
+keeper.url = https://nile.dev-ocean.com
+keeper.path = artifacts_nile
+secret_store.url = https://secret-store.nile.dev-ocean.com/
+
+[resources]
+aquarius.url = https://aquarius.marketplace.dev-ocean.com
+brizo.url =
+downloads.path = downloads_nile
+"""
+
+
+@pytest.fixture
+def k8s_deployment(tmp_path, monkeypatch):
+    for name in ('JUPYTER_DEPLOYMENT', 'JUPYTER_DEPLOYMENT_TEST', 'NETWORK_NAME'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('USE_K8S_CLUSTER', 'true')
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'config_k8s_deployed.ini').write_text(INI)
+    config.invalidate_deployment_config()
+    yield tmp_path
+    config.invalidate_deployment_config()
+
+
+def test_deployment_config_from_the_ini_file(k8s_deployment):
+    deployment_config = config.get_deployment_config()
+    assert deployment_config.deployment_type == 'USE_K8S_CLUSTER'
+    assert deployment_config.config_file_path == k8s_deployment / 'config_k8s_deployed.ini'
+    assert deployment_config.keeper_path == k8s_deployment / 'artifacts_nile'
+    assert deployment_config.network_name == 'nile'
+    assert deployment_config.downloads_path == 'downloads_nile' and deployment_config.faucet_url is None
+    # The empty brizo URL is not checked
+    assert deployment_config.endpoints == {
+        'aquarius': 'https://aquarius.marketplace.dev-ocean.com',
+        'Ethereum node': 'https://nile.dev-ocean.com',
+        'secret_store': 'https://secret-store.nile.dev-ocean.com/',
+    }
+
+
+def test_deployment_config_is_parsed_once(k8s_deployment, monkeypatch):
+    deployment_config = config.get_deployment_config()
+    with pytest.raises(AttributeError):
+        deployment_config.network_name = 'spree'
+    monkeypatch.setenv('NETWORK_NAME', 'spree')
+    assert config.get_deployment_config() is deployment_config
+    config.invalidate_deployment_config()
+    assert config.get_deployment_config().network_name == 'spree'
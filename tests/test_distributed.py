@@ -0,0 +1,91 @@
+import multiprocessing
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import distributed
+import workers
+
+pytestmark = [
+    pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                       reason="The fake setup and scenarios are inherited by forked workers"),
+    # The manager server ends its thread with sys.exit(0) once stopped
+    pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning'),
+]
+
+
+def _whoami(ctx):
+    time.sleep(0.05)
+    return {'account': ctx, 'phases': {'whoami': 0.05}}
+
+
+@pytest.fixture
+def fake_flows(monkeypatch):
+    def init_context(entry):
+        workers._context = entry['address']
+        return workers._context
+    monkeypatch.setattr(workers, 'init_context', init_context)
+    monkeypatch.setitem(sys.modules, 'scenarios', SimpleNamespace(SCENARIOS={'whoami': _whoami}))
+    monkeypatch.setitem(sys.modules, 'test04_consume_asset', SimpleNamespace(teardown=lambda ctx: None))
+
+
+def test_parse_address():
+    assert distributed.parse_address('10.0.0.1:5000') == ('10.0.0.1', 5000)
+    assert distributed.parse_address(':5000') == ('', 5000)
+
+
+def test_dispatcher_leases_one_account_per_worker():
+    dispatcher = distributed.Dispatcher([{'address': '0xa'}])
+    assert dispatcher.lease_account('w1') == dispatcher.lease_account('w1') == {'address': '0xa'}
+    assert dispatcher.lease_account('w2') is None
+    dispatcher.release_account('w1')
+    assert dispatcher.lease_account('w2') == {'address': '0xa'}
+
+
+def test_workers_run_the_coordinator_slots(fake_flows):
+    accounts = [{'address': '0xa'}, {'address': '0xb'}]
+    coordinator = distributed.Coordinator(('127.0.0.1', 0), b'test', accounts).start()
+    processes = [multiprocessing.Process(target=distributed.run_worker, args=(coordinator._server.address, b'test'))
+                 for _ in accounts]
+    for process in processes:
+        process.start()
+
+    results = list()
+    done = threading.Semaphore(0)
+
+    def _done(result):
+        results.append(result)
+        done.release()
+    slots = [coordinator.submit(_done, 'whoami') for _ in range(10)]
+    for _ in slots:
+        assert done.acquire(timeout=30), "A slot never got its result"
+    coordinator.stop(timeout=5)
+    for process in processes:
+        process.join(timeout=10)
+        assert process.exitcode == 0
+
+    assert coordinator.pending == 0
+    assert all(result['error'] is None for result in results)
+    leased = {result['worker']: result['output']['account'] for result in results}
+    assert len(set(leased.values())) == len(leased)
+    assert set(leased.values()) <= {'0xa', '0xb'}
+    # Both workers released their lease on STOP
+    assert sorted(entry['address'] for entry in coordinator.dispatcher._free_accounts) == ['0xa', '0xb']
+
+
+def test_lost_slots_time_out():
+    coordinator = distributed.Coordinator(('127.0.0.1', 0), b'test', slot_timeout=0.2).start()
+    results = list()
+    done = threading.Event()
+
+    def _done(result):
+        results.append(result)
+        done.set()
+    coordinator.submit(_done, 'consume')
+    assert done.wait(timeout=5)
+    coordinator.stop(timeout=0)
+    assert results[0]['error_class'] == 'SlotTimeout' and results[0]['scenario'] == 'consume'
+    assert coordinator.pending == 0
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler
+
+import pytest
+import requests
+
+from util.download import (ChecksumMismatch, FileSpec, RangeRequestHandler, download_file, download_files,
+                           request_first_chunk, serve_directory)
+from util.misc import ThreadingHTTPServer
+
+CONTENT = os.urandom(100000)
+
+
+@pytest.fixture
+def files(tmp_path):
+    served = tmp_path / 'served'
+    served.mkdir()
+    (served / 'data.bin').write_bytes(CONTENT)
+    (served / 'empty.txt').write_bytes(b'')
+    return served
+
+
+def _start(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def url(files):
+    server = serve_directory(str(files))
+    yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def _counting_server(files, ranges, handler=RangeRequestHandler):
+    class CountingHandler(handler):
+        root = str(files)
+
+        def send_head(self):
+            ranges.append(self.headers.get('Range'))
+            return super().send_head()
+    return _start(CountingHandler)
+
+
+def test_request_first_chunk(url):
+    with requests.Session() as session:
+        res, size, name, ranged = request_first_chunk(session, url + 'data.bin', 1000)
+        with res:
+            assert (size, name, ranged) == (len(CONTENT), 'data.bin', True)
+            assert res.content == CONTENT[:1000]
+        # Range Not Satisfiable, there is no first byte
+        res, size, _, ranged = request_first_chunk(session, url + 'empty.txt', 1000)
+        res.close()
+        assert (size, ranged) == (0, False)
+
+
+def test_small_file_in_one_request(files, tmp_path):
+    ranges = list()
+    server = _counting_server(files, ranges)
+    try:
+        spec = FileSpec('http://127.0.0.1:{}/data.bin'.format(server.server_address[1]), str(tmp_path / 'out'),
+                        checksum=hashlib.md5(CONTENT).hexdigest(), checksum_type='MD5')
+        with requests.Session() as session:
+            path = download_file(spec, session, chunk_size=len(CONTENT) * 2)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert ranges == ['bytes=0-{}'.format(len(CONTENT) * 2 - 1)]
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+
+
+def test_ranged_download(url, tmp_path):
+    spec = FileSpec(url + 'data.bin', str(tmp_path / 'out'), content_length=str(len(CONTENT)),
+                    checksum=hashlib.md5(CONTENT).hexdigest(), checksum_type='MD5')
+    path, empty = download_files([spec, FileSpec(url + 'empty.txt', str(tmp_path / 'out'))], chunk_size=16384)
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert os.path.getsize(empty) == 0
+    assert sorted(os.listdir(str(tmp_path / 'out'))) == ['data.bin', 'empty.txt']
+
+
+def test_resume(files, tmp_path):
+    ranges = list()
+    server = _counting_server(files, ranges)
+    destination = tmp_path / 'out'
+    destination.mkdir()
+    chunk_size = 40000
+    (destination / 'data.bin.part').write_bytes(CONTENT[:chunk_size] + bytes(len(CONTENT) - chunk_size))
+    (destination / 'data.bin.part.json').write_text(json.dumps(
+        {'size': len(CONTENT), 'chunk_size': chunk_size, 'done': [0]}))
+    try:
+        spec = FileSpec('http://127.0.0.1:{}/data.bin'.format(server.server_address[1]), str(destination),
+                        checksum=hashlib.sha256(CONTENT).hexdigest(), checksum_type='sha256')
+        with requests.Session() as session, ThreadPoolExecutor(2) as executor:
+            path = download_file(spec, session, executor, chunk_size=chunk_size)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert (destination / 'data.bin').read_bytes() == CONTENT
+    # The first chunk on disk is not read again from the first response
+    assert sorted(ranges) == ['bytes=0-39999', 'bytes=40000-79999', 'bytes=80000-99999']
+    assert os.listdir(str(destination)) == ['data.bin'] and path.endswith('data.bin')
+
+
+def test_checksum_mismatch_removes_the_part_file(url, tmp_path):
+    spec = FileSpec(url + 'data.bin', str(tmp_path / 'out'), checksum='0' * 32, checksum_type='MD5')
+    with requests.Session() as session, pytest.raises(ChecksumMismatch):
+        download_file(spec, session, chunk_size=16384)
+    assert os.listdir(str(tmp_path / 'out')) == []
+
+
+def test_server_without_range_support(files, tmp_path):
+    class NoRangeHandler(RangeRequestHandler):
+        send_head = SimpleHTTPRequestHandler.send_head
+
+    ranges = list()
+    server = _counting_server(files, ranges, NoRangeHandler)
+    try:
+        spec = FileSpec('http://127.0.0.1:{}/data.bin'.format(server.server_address[1]), str(tmp_path / 'out'),
+                        content_length=len(CONTENT), checksum=hashlib.md5(CONTENT).hexdigest(), checksum_type='MD5')
+        with requests.Session() as session:
+            path = download_file(spec, session, chunk_size=16384)
+    finally:
+        server.shutdown()
+        server.server_close()
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    # The whole file came with the first response
+    assert len(ranges) == 1
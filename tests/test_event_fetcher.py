@@ -0,0 +1,97 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('web3')
+pytest.importorskip('eth_utils')
+pytest.importorskip('ocean_keeper')
+
+from util import event_fetcher  # noqa: E402
+from util.event_fetcher import AgreementEventFetcher  # noqa: E402
+
+ADDRESS = '0x' + 'ab' * 20
+AGREEMENT_ID = '0x' + '11' * 32
+
+
+class _Event:
+    def processLog(self, log):
+        return log
+
+
+class _Eth:
+    def __init__(self):
+        self.blockNumber = 10
+        self.logs = list()
+        self.queries = list()
+
+    def getLogs(self, query):
+        self.queries.append(query)
+        return [log for log in self.logs if query['fromBlock'] <= log['blockNumber'] <= query['toBlock']]
+
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    eth = _Eth()
+    monkeypatch.setattr(event_fetcher.Web3Provider, 'get_web3', lambda: SimpleNamespace(eth=eth))
+    monkeypatch.setattr(event_fetcher, 'get_log_sources',
+                        lambda keeper, conditions: ({ADDRESS: [('lockReward', _Event)]}, ['0x' + '22' * 32]))
+    return AgreementEventFetcher(None, conditions=('lockReward',), timeout=60)
+
+
+def test_event_resolves_the_future(fetcher):
+    futures = fetcher.watch(AGREEMENT_ID)
+    fetcher.web3.eth.logs.append({'address': ADDRESS, 'blockNumber': 5,
+                                  'topics': [bytes(32), bytes.fromhex('11' * 32)]})
+    fetcher.poll_once()
+    future = futures['lockReward']
+    assert future.result(0)['blockNumber'] == 5
+    assert future.received is not None
+    assert fetcher.in_flight == 0
+    assert fetcher.poll_once() is None and fetcher._next_block == 11
+
+
+def test_backfill_and_expiry(fetcher):
+    fetcher.seek(8)
+    futures = fetcher.watch(AGREEMENT_ID, from_block=3)
+    fetcher.timeout = 0
+    fetcher.poll_once()
+    assert [(query['fromBlock'], query['toBlock']) for query in fetcher.web3.eth.queries] == [(3, 7), (8, 10)]
+    with pytest.raises(Exception):
+        futures['lockReward'].result(0)
+    assert fetcher.in_flight == 0
+
+
+def test_duplicate_logs_and_expiry_resolve_once(fetcher):
+    futures = fetcher.watch(AGREEMENT_ID)
+    log = {'address': ADDRESS, 'blockNumber': 5, 'topics': [bytes(32), bytes.fromhex('11' * 32)]}
+    fetcher._dispatch(log)
+    fetcher._dispatch(log)
+    fetcher.timeout = 0
+    fetcher._expire()
+    assert futures['lockReward'].result(0) is log
+    assert fetcher.in_flight == 0
+
+
+def test_concurrent_dispatch_and_expiry(fetcher):
+    fetcher.timeout = 0
+    logs = list()
+    for i in range(200):
+        agreement_id = '0x' + '{:064x}'.format(i + 1)
+        fetcher.watch(agreement_id)
+        logs.append({'address': ADDRESS, 'blockNumber': 5, 'topics': [bytes(32), bytes.fromhex(agreement_id[2:])]})
+    errors = list()
+
+    def _dispatch_all():
+        try:
+            for log in logs:
+                fetcher._dispatch(log)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_dispatch_all) for _ in range(4)] + [threading.Thread(target=fetcher._expire)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors and fetcher.in_flight == 0
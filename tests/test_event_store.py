@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip('web3')
+pytest.importorskip('eth_utils')
+pytest.importorskip('ocean_keeper')
+
+from util import events  # noqa: E402
+from util.event_store import EventStore  # noqa: E402
+
+AGREEMENT_ID = '0x' + '11' * 32
+
+
+def _event(block, **args):
+    args.setdefault('_agreementId', bytes.fromhex(AGREEMENT_ID[2:]))
+    return {'blockNumber': block, 'logIndex': 0, 'transactionHash': bytes.fromhex('aa' * 32), 'args': args}
+
+
+def test_store(tmp_path):
+    store = EventStore(tmp_path / 'events.sqlite')
+    assert store.last_block == -1 and not store.covers(0)
+    store.add_events([('lock reward', _event(12)),
+                      ('access secret store', _event(14, _grantee='0xABC'))], 10, 15)
+    store.add_events([], 16, 20)
+    assert (store.first_block, store.last_block) == (10, 20)
+    assert store.covers(12) and not store.covers(9)
+
+    assert store.get_event(AGREEMENT_ID, 'lock reward')['blockNumber'] == 12
+    assert store.get_event(AGREEMENT_ID, 'escrow reward') is None
+    assert sorted(store.get_agreement_events(AGREEMENT_ID)) == ['access secret store', 'lock reward']
+    assert store.is_access_granted(AGREEMENT_ID, '0xabc')
+    assert not store.is_access_granted(AGREEMENT_ID, '0xdef')
+    store.close()
+
+
+class _IndexingStore:
+    """The indexer commits the event right after the lookup missed it"""
+    first_block = 0
+
+    def __init__(self):
+        self.indexed = False
+
+    @property
+    def last_block(self):
+        return 20 if self.indexed else 10
+
+    def covers(self, from_block):
+        return True
+
+    def get_event(self, agreement_id, condition):
+        self.indexed = True
+        return None
+
+
+def test_chain_query_starts_after_the_store_snapshot(monkeypatch):
+    queried = list()
+    monkeypatch.setitem(events.event_map, 'lock reward',
+                        lambda keeper, agreement_id, from_block: queried.append(from_block) or {'blockNumber': 15})
+    assert events.subscribe_event('lock reward', None, AGREEMENT_ID, 5, _IndexingStore()) == {'blockNumber': 15}
+    assert queried == [11]
@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('web3')
+pytest.importorskip('eth_utils')
+pytest.importorskip('ocean_keeper')
+
+from util import event_fetcher  # noqa: E402
+from util.event_stream import BlockWatcher  # noqa: E402
+
+LOCK_ADDRESS = '0x' + 'ab' * 20
+ESCROW_ADDRESS = '0x' + 'cd' * 20
+AGREEMENT_ID = '0x' + '11' * 32
+
+
+class _Event:
+    def processLog(self, log):
+        return log
+
+
+class _Eth:
+    def __init__(self):
+        self.blockNumber = 10
+        self.logs = list()
+
+    def getLogs(self, query):
+        return [log for log in self.logs if query['fromBlock'] <= log['blockNumber'] <= query['toBlock']]
+
+
+def _log(address, block):
+    return {'address': address, 'blockNumber': block, 'topics': [bytes(32), bytes.fromhex(AGREEMENT_ID[2:])]}
+
+
+@pytest.fixture
+def eth(monkeypatch):
+    eth = _Eth()
+    monkeypatch.setattr(event_fetcher.Web3Provider, 'get_web3', lambda: SimpleNamespace(eth=eth))
+    monkeypatch.setattr(event_fetcher, 'get_log_sources', lambda keeper, conditions: (
+        {LOCK_ADDRESS: [('lockReward', _Event)], ESCROW_ADDRESS: [('escrowReward', _Event)]}, ['0x' + '22' * 32]))
+    return eth
+
+
+def test_events_in_the_order_they_are_mined(eth):
+    loop = asyncio.new_event_loop()
+    watcher = BlockWatcher(None, conditions=('lockReward', 'escrowReward'), poll_interval=0.01, loop=loop).start()
+
+    async def _mine():
+        await asyncio.sleep(0.05)
+        eth.logs.append(_log(ESCROW_ADDRESS, 11))
+        eth.blockNumber = 11
+        await asyncio.sleep(0.05)
+        eth.logs.append(_log(LOCK_ADDRESS, 12))
+        eth.blockNumber = 12
+
+    async def _collect():
+        loop.create_task(_mine())
+        return [ev async for ev in watcher.agreement_events(AGREEMENT_ID)]
+
+    try:
+        events = loop.run_until_complete(asyncio.wait_for(_collect(), 5))
+        loop.run_until_complete(watcher.stop())
+    finally:
+        loop.close()
+    assert [(ev.name, ev.event['blockNumber']) for ev in events] == [('escrowReward', 11), ('lockReward', 12)]
+    assert events[0].received <= events[1].received
+
+
+def test_back_filled_agreement(eth):
+    eth.logs.extend([_log(LOCK_ADDRESS, 3), _log(ESCROW_ADDRESS, 4)])
+    loop = asyncio.new_event_loop()
+    watcher = BlockWatcher(None, conditions=('lockReward', 'escrowReward'), poll_interval=0.01, loop=loop).start()
+    try:
+        events = loop.run_until_complete(asyncio.wait_for(watcher.wait_for_agreement(AGREEMENT_ID, from_block=2), 5))
+        loop.run_until_complete(watcher.stop())
+    finally:
+        loop.close()
+    assert sorted(events) == ['escrowReward', 'lockReward']
@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip('ocean_keeper')
+
+from util import events  # noqa: E402
+from util.events import ConditionResult, record_phase_latencies  # noqa: E402
+from util.metrics import HistogramRegistry  # noqa: E402
+
+
+def _results():
+    return {
+        'created agreement': ConditionResult('created agreement', 100, event={'blockNumber': 1}, received=102),
+        'lock reward': ConditionResult('lock reward', 100, event={'blockNumber': 2}, received=105),
+        'access secret store': ConditionResult('access secret store', 100, error=TimeoutError()),
+    }
+
+
+def test_phase_latencies(monkeypatch):
+    monkeypatch.setattr(events, 'get_block_timestamp', lambda block: 1000 + 10 * block)
+    registry = HistogramRegistry()
+    record_phase_latencies(_results(), ordered_at=101, registry=registry)
+    assert registry.get('agreement_phase_wall_seconds', phase='created agreement').max == 1
+    assert registry.get('agreement_phase_wall_seconds', phase='lock reward').max == 3
+    assert registry.get('agreement_phase_block_seconds', phase='lock reward').max == 10
+    assert registry.get('agreement_total_seconds').max == 4
+
+
+def test_timestamp_errors_do_not_fail_the_agreement(monkeypatch):
+    def _rpc_error(block):
+        raise ConnectionError('node down')
+    monkeypatch.setattr(events, 'get_block_timestamp', _rpc_error)
+    registry = HistogramRegistry()
+    record_phase_latencies(_results(), ordered_at=101, registry=registry)
+    assert registry.get('agreement_total_seconds').count == 1
+    assert registry.get('agreement_phase_block_seconds', phase='lock reward') is None
@@ -0,0 +1,28 @@
+import threading
+import time
+from itertools import islice
+
+from loadgen import OpenLoopGenerator, arrival_offsets
+from util.metrics import HistogramRegistry
+
+
+def test_constant_arrivals():
+    assert list(islice(arrival_offsets(2, 'constant'), 3)) == [0.5, 1.0, 1.5]
+
+
+def test_arrivals_stop_at_the_horizon():
+    offsets = list(arrival_offsets(10, 'poisson', horizon=5))
+    assert offsets and all(offset < 5 for offset in offsets[:-1])
+
+
+def test_latency_includes_the_wait_for_a_slot():
+    def submit(done, scenario, intended):
+        threading.Timer(0.05, done, ({'error': None},)).start()
+
+    generator = OpenLoopGenerator(submit, 100, 'constant', max_in_flight=1, registry=HistogramRegistry())
+    records = generator.run(time.time() + 0.3)
+    assert records
+    assert all(record['latency'] >= record['service_time'] for record in records)
+    # Arrivals every 10ms served in 50ms, the queue builds up
+    assert max(record['latency'] for record in records) > 0.1
+    assert generator.summary()['completed'] == len(records)
@@ -0,0 +1,28 @@
+from itertools import islice
+from pathlib import Path
+
+from util.metadata_generator import MetadataGenerator, assert_valid_metadata
+from util.misc import load_metadata_template
+
+TEMPLATE = load_metadata_template(str(Path(__file__).resolve().parents[1] / 'assets' / 'sample_metadata.json'))
+
+
+def test_valid_and_varied():
+    documents = list(islice(MetadataGenerator(TEMPLATE, seed=1), 200))
+    for metadata in documents:
+        assert_valid_metadata(metadata)
+    assert len(set(metadata['main']['name'] for metadata in documents)) == 200
+    assert len(set(metadata['main']['price'] for metadata in documents)) > 1
+
+
+def test_seeded():
+    first = list(islice(MetadataGenerator(TEMPLATE, seed=42), 5))
+    assert first == list(islice(MetadataGenerator(TEMPLATE, seed=42), 5))
+
+
+def test_custom_distributions():
+    generator = MetadataGenerator(TEMPLATE, seed=1, n_files=lambda rng: 3, price=lambda rng: '7')
+    metadata = generator.generate()
+    assert metadata['main']['price'] == '7'
+    assert [file['index'] for file in metadata['main']['files']] == [0, 1, 2]
+    assert TEMPLATE['main'].get('files') != metadata['main']['files']
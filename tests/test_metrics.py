@@ -0,0 +1,53 @@
+import urllib.request
+
+from util import metrics
+from util.metrics import Histogram, HistogramRegistry
+
+
+def test_histogram_quantiles():
+    histogram = Histogram('latency')
+    for value in range(1, 101):
+        histogram.observe(value / 10)
+    assert histogram.count == 100
+    assert histogram.min == 0.1 and histogram.max == 10
+    assert 4 <= histogram.quantile(0.5) <= 6
+    assert histogram.quantile(0.99) <= 10
+
+
+def test_registry_round_trip(tmp_path):
+    registry = HistogramRegistry()
+    registry.observe('phase_seconds', 1, phase='order')
+    registry.observe('phase_seconds', 2, phase='order')
+    registry.to_json(str(tmp_path / 'histograms.json'))
+
+    loaded = HistogramRegistry.from_json(str(tmp_path / 'histograms.json'))
+    loaded.merge(registry)
+    assert loaded.get('phase_seconds', phase='order').count == 4
+
+
+def test_prometheus_format():
+    registry = HistogramRegistry(buckets=(1, 5))
+    registry.inc('faucet_requests_total')
+    registry.inc('rpc_requests_total', 2, method='eth_call')
+    registry.add_gauge('flows_in_flight', 1, scenario='consume')
+    registry.observe('flow_seconds', 3)
+    text = registry.to_prometheus()
+    assert '# TYPE faucet_requests_total counter\nfaucet_requests_total 1\n' in text
+    assert 'rpc_requests_total{method="eth_call"} 2' in text
+    assert 'flows_in_flight{scenario="consume"} 1' in text
+    assert 'flow_seconds_bucket{le="1"} 0' in text
+    assert 'flow_seconds_bucket{le="+Inf"} 1' in text
+    assert 'flow_seconds_count 1' in text
+
+
+def test_serve():
+    registry = HistogramRegistry()
+    registry.inc('served_total')
+    server = metrics.serve(0, '127.0.0.1', registry)
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert 'served_total 1' in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,36 @@
+import json
+import multiprocessing
+
+import pytest
+
+from util.misc import atomic_write, file_lock
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'state' / 'pool.json'
+    with atomic_write(path) as f:
+        json.dump({'assets': []}, f)
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as f:
+            f.write('{"partial')
+            raise RuntimeError
+    assert json.loads(path.read_text()) == {'assets': []}
+    assert [p.name for p in path.parent.iterdir()] == ['pool.json']
+
+
+def _increment(path, times):
+    for _ in range(times):
+        with file_lock(path):
+            count = json.loads(path.read_text()) if path.exists() else 0
+            with atomic_write(path) as f:
+                json.dump(count + 1, f)
+
+
+def test_file_lock_across_processes(tmp_path):
+    path = tmp_path / 'counter.json'
+    processes = [multiprocessing.Process(target=_increment, args=(path, 25)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert json.loads(path.read_text()) == 100
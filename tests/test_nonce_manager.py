@@ -0,0 +1,215 @@
+import hashlib
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('ocean_keeper')
+
+from util.nonce_manager import NonceManager, Signer  # noqa: E402
+
+SIGNER = Signer('0xPublisher', b'key')
+
+
+class FakeEth:
+    """The node side: a pool of sent transactions, mined on demand"""
+
+    gasPrice = 10
+
+    def __init__(self, nonce=0):
+        self.mined = nonce
+        self.pool = dict()
+        self.sent = list()
+        self.receipts = dict()
+        self.send_hook = None
+        self.account = SimpleNamespace(
+            signTransaction=lambda transaction, key: SimpleNamespace(rawTransaction=dict(transaction)))
+        self._lock = threading.Lock()
+
+    def getTransactionCount(self, address, block='latest'):
+        with self._lock:
+            if block != 'pending':
+                return self.mined
+            nonce = self.mined
+            while nonce in self.pool:
+                nonce += 1
+            return nonce
+
+    def sendRawTransaction(self, transaction):
+        if self.send_hook:
+            self.send_hook(transaction)
+        with self._lock:
+            if transaction['nonce'] < self.mined or transaction['nonce'] in self.pool:
+                raise ValueError('nonce too low')
+            tx_hash = hashlib.sha256(repr(sorted(transaction.items())).encode()).digest()
+            self.pool[transaction['nonce']] = tx_hash
+            self.sent.append(transaction)
+            return tx_hash
+
+    def mine(self):
+        with self._lock:
+            while self.mined in self.pool:
+                self.receipts[self.pool.pop(self.mined)] = {'status': 1}
+                self.mined += 1
+
+    def drop(self, nonce):
+        with self._lock:
+            del self.pool[nonce]
+
+    def getTransactionReceipt(self, tx_hash):
+        return self.receipts.get(tx_hash)
+
+
+def _manager(eth, **kwargs):
+    return NonceManager(web3=SimpleNamespace(eth=eth), **kwargs)
+
+
+def test_nonces_follow_the_node():
+    eth = FakeEth(nonce=5)
+    manager = _manager(eth)
+    assert manager.send(SIGNER, {'to': '0x1', 'value': 0}).nonce == 5
+    assert manager.send(SIGNER, {'to': '0x1', 'value': 0}).nonce == 6
+    eth.mine()
+    manager.poll_once()
+    assert manager.outstanding() == 0
+
+
+def test_resync_after_a_nonce_used_outside_the_manager():
+    eth = FakeEth()
+    manager = _manager(eth)
+    manager.send(SIGNER, {'to': '0x1', 'value': 0})
+    # Another client sent nonce 1 from the same account
+    eth.pool[1] = b'outside'
+    assert manager.send(SIGNER, {'to': '0x1', 'value': 0}).nonce == 2
+    assert [transaction['nonce'] for transaction in eth.sent] == [0, 2]
+
+
+def test_failed_send_before_a_later_nonce_is_filled():
+    eth = FakeEth()
+    manager = _manager(eth)
+    manager.send(SIGNER, {'to': '0x1', 'value': 0})
+    sending, later_sent = threading.Event(), threading.Event()
+
+    def _hook(transaction):
+        if transaction['nonce'] == 1 and transaction['to'] == '0x1':
+            sending.set()
+            later_sent.wait(5)
+            raise ValueError('insufficient funds for gas * price + value')
+        if transaction['nonce'] == 2:
+            later_sent.set()
+    eth.send_hook = _hook
+
+    errors = list()
+
+    def _send():
+        try:
+            manager.send(SIGNER, {'to': '0x1', 'value': 0})
+        except ValueError as e:
+            errors.append(e)
+    thread = threading.Thread(target=_send)
+    thread.start()
+    assert sending.wait(5)
+    assert manager.send(SIGNER, {'to': '0x2', 'value': 0}).nonce == 2
+    thread.join()
+
+    assert errors
+    fill = [transaction for transaction in eth.sent if transaction['nonce'] == 1]
+    assert fill and fill[0]['to'] == SIGNER.address and fill[0]['value'] == 0
+    eth.mine()
+    manager.poll_once()
+    assert eth.mined == 3 and manager.outstanding() == 0
+
+
+def test_dropped_transaction_is_filled_on_timeout():
+    eth = FakeEth()
+    manager = _manager(eth, timeout=60)
+    dropped = manager.send(SIGNER, {'to': '0x1', 'value': 0})
+    later = manager.send(SIGNER, {'to': '0x1', 'value': 0})
+    eth.drop(0)
+    dropped.first_sent -= 120
+    manager.poll_once()
+
+    with pytest.raises(TimeoutError):
+        dropped.result(0)
+    assert eth.sent[-1]['nonce'] == 0 and eth.sent[-1]['to'] == SIGNER.address
+    assert eth.sent[-1]['gasPrice'] > dropped.transaction['gasPrice']
+    eth.mine()
+    manager.poll_once()
+    assert later.result(0) == {'status': 1}
+    assert manager.outstanding() == 0
+
+
+def test_last_dropped_nonce_goes_to_the_next_send():
+    eth = FakeEth()
+    manager = _manager(eth, max_outstanding=1, timeout=60)
+    dropped = manager.send(SIGNER, {'to': '0x1', 'value': 0})
+    eth.drop(0)
+    dropped.first_sent -= 120
+    manager.poll_once()
+    with pytest.raises(TimeoutError):
+        dropped.result(0)
+    # The slot was released, and the nonce is reused instead of leaving a gap
+    assert manager.send(SIGNER, {'to': '0x1', 'value': 0}).nonce == 0
+
+
+def test_concurrent_sends_get_distinct_nonces():
+    eth = FakeEth()
+    manager = _manager(eth, max_outstanding=4, poll_interval=0.01)
+    outstanding = list()
+    eth.send_hook = lambda transaction: outstanding.append(manager.outstanding(SIGNER.address))
+    miner = threading.Event()
+
+    def _mine():
+        while not miner.wait(0.005):
+            eth.mine()
+    threading.Thread(target=_mine, daemon=True).start()
+    manager.start()
+    try:
+        results = list()
+
+        def _sends():
+            results.extend(manager.send(SIGNER, {'to': '0x1', 'value': 0}) for _ in range(5))
+        threads = [threading.Thread(target=_sends) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(pending.result(5) == {'status': 1} for pending in results)
+    finally:
+        manager.stop()
+        miner.set()
+    assert sorted(transaction['nonce'] for transaction in eth.sent) == list(range(40))
+    assert max(outstanding) < 4
+
+
+class _Function:
+    def __init__(self, *args):
+        self.args = args
+
+    def buildTransaction(self, transaction):
+        return dict(transaction, to='0xRegistry', data=repr(self.args), gas=transaction.get('gas', 100000))
+
+
+class _Registry:
+    contract = SimpleNamespace(functions=SimpleNamespace(registerAttribute=_Function))
+
+    def __init__(self):
+        self.sent = list()
+
+    def send_transaction(self, fn_name, fn_args, transact=None):
+        self.sent.append(transact['from'])
+        return b'direct'
+
+
+def test_routed_sends_only_the_signer_transactions():
+    eth = FakeEth()
+    manager = _manager(eth)
+    registry = _Registry()
+    with manager.routed(registry, SIGNER):
+        tx_hash = registry.send_transaction('registerAttribute', (b'did', b'sum', [], 'url'),
+                                            {'from': '0xpublisher', 'passphrase': 'secret'})
+        assert registry.send_transaction('registerAttribute', (), {'from': '0xOther'}) == b'direct'
+    assert tx_hash == eth.pool[0]
+    assert eth.sent[0]['data'] == repr((b'did', b'sum', [], 'url'))
+    assert registry.sent == ['0xOther']
+    assert registry.send_transaction('registerAttribute', (), {'from': SIGNER.address}) == b'direct'
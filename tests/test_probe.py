@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from util.metrics import HistogramRegistry
+from util.misc import ThreadingHTTPServer
+from util.probe import EndpointProber
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = list()
+
+    def setup(self):
+        super().setup()
+        self.connections.append(self.client_address)
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(1)
+        status, body = (500, b'down') if self.path == '/error' else (200, json.dumps(
+            {'software': 'Aquarius', 'version': '1.0.7'}).encode())
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json' if status == 200 else 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/stale':
+            # Keep-alive announced, but the server drops the idle connection
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _Handler.connections = list()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_probe_all(server):
+    registry = HistogramRegistry()
+    prober = EndpointProber({'aquarius': server + '/about', 'brizo': server + '/error'}, registry=registry)
+    try:
+        first = prober.probe_all()
+        second = prober.probe_all()
+    finally:
+        prober.close()
+    assert first['aquarius'].ok and (first['aquarius'].software, first['aquarius'].version) == ('Aquarius', '1.0.7')
+    assert not first['brizo'].ok and first['brizo'].status == 500
+    # The second probe reuses the keep-alive connection
+    assert first['aquarius'].connect > 0 and second['aquarius'].connect == 0
+    assert registry.get('endpoint_ttfb_seconds', endpoint='aquarius').count == 2
+    assert ('endpoint_probe_failures_total', {'endpoint': 'brizo'}, 2) in registry.counters()
+
+
+def test_hung_endpoint_only_delays_itself(server):
+    prober = EndpointProber({'aquarius': server + '/about', 'slow': server + '/slow'},
+                            timeouts={'slow': 0.2}, registry=HistogramRegistry())
+    try:
+        started = time.time()
+        results = prober.probe_all()
+    finally:
+        prober.close()
+    assert results['aquarius'].ok and results['aquarius'].total < 0.5
+    assert not results['slow'].ok and 'timed out' in results['slow'].error
+    assert time.time() - started < 1
+
+
+def test_stale_keep_alive_connection_is_retried(server):
+    prober = EndpointProber({'aquarius': server + '/stale'}, registry=HistogramRegistry())
+    try:
+        prober.probe_all()
+        # Let the server close its side before the next request goes out on the stale connection
+        time.sleep(0.2)
+        result = prober.probe_all()['aquarius']
+    finally:
+        prober.close()
+    assert result.ok and result.error is None and result.connect > 0
+    assert len(_Handler.connections) == 2
@@ -0,0 +1,59 @@
+import datetime
+
+from loadgen import arrival_offsets
+from profiles import LoadProfile, load_profiles, parse_scenarios, parse_start
+
+
+def test_arrivals_end_when_the_rate_drops_to_zero():
+    ramp_down = LoadProfile('down', 'ramp', 10, start_rate=1, end_rate=0)
+    offsets = list(arrival_offsets(ramp_down.rate_at, 'constant', horizon=10))
+    assert 0 < len(offsets) < 10
+
+    spike = LoadProfile('spike', 'spike', 10, spike_rate=2, spike_start=2, spike_duration=1)
+    assert len(list(arrival_offsets(spike.rate_at, 'constant', horizon=10))) == 2
+
+
+def test_rate_of_the_profiles():
+    assert LoadProfile('c', 'constant', 10, rate=0.5).rate_at(3) == 0.5
+    assert LoadProfile('r', 'ramp', 10, start_rate=1, end_rate=3).rate_at(5) == 2
+    assert LoadProfile('s', 'step', 100, start_rate=1, step_rate=1, step_duration=10).rate_at(25) == 3
+    spike = LoadProfile('p', 'spike', 100, rate=1, spike_rate=5, spike_start=10, spike_duration=5)
+    assert [spike.rate_at(t) for t in (9, 10, 14, 15)] == [1, 5, 5, 1]
+
+
+def test_parse_scenarios():
+    assert parse_scenarios('consume:0.7, search:0.3,') == {'consume': 0.7, 'search': 0.3}
+    assert parse_scenarios('consume') == {'consume': 1.0}
+
+
+def test_parse_start():
+    now = datetime.datetime(2020, 1, 1, 12, 0)
+    assert parse_start('now', now) == now
+    assert parse_start('13:30', now) == datetime.datetime(2020, 1, 1, 13, 30)
+    assert parse_start('11:00', now) == datetime.datetime(2020, 1, 2, 11, 0)
+
+
+def test_load_profiles_back_to_back(tmp_path):
+    path = tmp_path / 'profiles.ini'
+    path.write_text("""
+[run]
+start = 2020-01-01 12:00
+profiles = warmup, soak
+
+[profile:warmup]
+type = ramp
+duration = 60
+start_rate = 0.1
+end_rate = 1
+
+[profile:soak]
+type = constant
+duration = 120
+rate = 1
+scenarios = consume:0.5, search:0.5
+""")
+    (start, end, warmup), (soak_start, soak_end, soak) = load_profiles(path)
+    assert (warmup.type, soak.type) == ('ramp', 'constant')
+    assert end == soak_start == datetime.datetime(2020, 1, 1, 12, 1)
+    assert soak_end - soak_start == datetime.timedelta(seconds=120)
+    assert soak.scenarios == {'consume': 0.5, 'search': 0.5}
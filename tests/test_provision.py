@@ -0,0 +1,83 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('ocean_keeper')
+
+from util import provision  # noqa: E402
+from util.misc import ThreadingHTTPServer  # noqa: E402
+
+
+class _Faucet:
+    """Stand-in for the faucet, which refuses the addresses in `refused`"""
+
+    def __init__(self, refused=()):
+        self.funded = set()
+        self.refused = set(refused)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        faucet = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with faucet._lock:
+                    faucet.in_flight += 1
+                    faucet.max_in_flight = max(faucet.max_in_flight, faucet.in_flight)
+                threading.Event().wait(0.02)
+                with faucet._lock:
+                    faucet.in_flight -= 1
+                    if body['address'] in faucet.refused:
+                        answer = {'success': False, 'message': 'Too many requests'}
+                    else:
+                        faucet.funded.add(body['address'])
+                        answer = {'success': True}
+                content = json.dumps(answer).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_provision_accounts(monkeypatch, tmp_path):
+    addresses = iter('0x{:040x}'.format(i) for i in range(1, 100))
+    monkeypatch.setattr(provision, 'create_local_account',
+                        lambda: {'address': next(addresses), 'password': 'secret', 'encrypted_key': '{}'})
+    monkeypatch.setattr(provision, 'manifest_account', lambda entry: SimpleNamespace(address=entry['address']))
+    faucet = _Faucet(refused={'0x{:040x}'.format(3)})
+    tokens = list()
+    ocn = SimpleNamespace(accounts=SimpleNamespace(
+        balance=lambda acct: SimpleNamespace(eth=10 ** 18 if acct.address in faucet.funded else 0),
+        request_tokens=lambda acct, amount: tokens.append((acct.address, amount)) or True))
+    try:
+        manifest, failures = provision.provision_accounts(ocn, faucet.url, 12, ocean_amount=5, max_workers=4,
+                                                          timeout=5)
+    finally:
+        faucet.close()
+
+    assert len(manifest) == 11 and len(failures) == 1
+    assert 'Too many requests' in str(failures[0])
+    assert {entry['address'] for entry in manifest} == faucet.funded
+    assert sorted(tokens) == sorted((address, 5) for address in faucet.funded)
+    assert 1 < faucet.max_in_flight <= 4
+
+    provision.save_manifest(manifest, str(tmp_path / 'accounts.json'), str(tmp_path / 'passwords.csv'))
+    assert len((tmp_path / 'passwords.csv').read_text().splitlines()) == 11
@@ -0,0 +1,32 @@
+from results import ResultsStore, load_results, percentile, report
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([1, 2, 3, 4], 0.5) == 2
+    assert percentile([1, 2, 3, 4], 0.99) == 4
+
+
+def test_report_latency_from_the_intended_start(tmp_path):
+    store = ResultsStore(tmp_path / 'results.jsonl')
+    store.record('consume', 100, 102, intended=95, phases={'order': 1.5})
+    store.record('consume', 101, 102)
+    store.record('consume', 103, 104, error='AssertionError: no event', error_class='AssertionError')
+    store.record('search', 130, 131)
+    store.close()
+
+    rows = load_results(tmp_path / 'results.jsonl')
+    assert rows[0]['latency'] == 7 and rows[0]['duration'] == 2
+    assert rows[1]['intended'] == rows[1]['start']
+
+    consume, search = report(rows, window=30)
+    assert (consume['scenario'], consume['completed']) == ('consume', 3)
+    assert consume['error_rate'] == 1 / 3
+    assert consume['p99'] == 7 and consume['service_p99'] == 2
+    assert 'AssertionError' in consume['errors']
+    assert search['window_start'] != consume['window_start']
+
+
+def test_report_rows_without_intended_start():
+    rows = [{'scenario': 'consume', 'start': 0, 'end': 3, 'duration': 3, 'status': 'ok', 'error_class': None}]
+    assert report(rows)[0]['p50'] == 3
@@ -0,0 +1,41 @@
+import threading
+
+import pytest
+
+from util.tracing import Tracer, load_spans, to_chrome_trace
+
+
+def test_nested_spans(tmp_path):
+    tracer = Tracer(tmp_path / 'trace.jsonl')
+    with tracer.span('flow', did='did:op:1') as flow:
+        with tracer.span('order') as order:
+            order.set_attribute('agreement_id', '0x1')
+
+        def _wait():
+            with tracer.span('condition', parent=flow):
+                pass
+        thread = threading.Thread(target=_wait)
+        thread.start()
+        thread.join()
+    with pytest.raises(ValueError):
+        with tracer.span('failing'):
+            raise ValueError('no event')
+    tracer.close()
+
+    spans = {span['name']: span for span in load_spans(tmp_path / 'trace.jsonl')}
+    assert spans['order']['parent_id'] == spans['condition']['parent_id'] == spans['flow']['span_id']
+    assert spans['order']['trace_id'] == spans['flow']['trace_id']
+    assert spans['order']['attributes'] == {'agreement_id': '0x1'}
+    assert spans['flow']['duration'] >= spans['order']['duration']
+    assert spans['failing']['status'] != 'ok' and spans['failing']['parent_id'] is None
+
+
+def test_chrome_trace(tmp_path):
+    tracer = Tracer(tmp_path / 'trace.jsonl')
+    with tracer.span('flow'):
+        pass
+    tracer.close()
+    events = to_chrome_trace(load_spans(tmp_path / 'trace.jsonl'))['traceEvents']
+    complete = [event for event in events if event['ph'] == 'X']
+    assert [event['name'] for event in complete] == ['flow']
+    assert any(event['ph'] == 'M' for event in events)
@@ -0,0 +1,47 @@
+import os
+import pickle
+
+import pytest
+
+pytest.importorskip('ocean_keeper')
+
+from util.user import CredentialStore, get_credential_store  # noqa: E402
+
+
+def _write(path, rows, mtime):
+    path.write_text(''.join('{},{}\n'.format(*row) for row in rows))
+    os.utime(str(path), ns=(mtime, mtime))
+
+
+def test_reload_only_when_changed(tmp_path):
+    path = tmp_path / 'passwords.csv'
+    _write(path, [('0xABC', 'secret')], 10 ** 18)
+    store = CredentialStore(path)
+    assert store.get('0xabc') == 'secret' and '0xAbC' in store and len(store) == 1
+    assert store.reload_if_changed() is False
+
+    _write(path, [('0xabc', 'secret'), ('0xdef', 'other')], 2 * 10 ** 18)
+    assert store.reload_if_changed() is True
+    assert store.get('0xDEF') == 'other'
+
+
+def test_pickled_index(tmp_path):
+    path = tmp_path / 'passwords.csv'
+    index_path = tmp_path / 'passwords.pickle'
+    _write(path, [('0xabc', 'secret')], 10 ** 18)
+    CredentialStore(path, index_path)
+    with index_path.open('rb') as f:
+        index = pickle.load(f)
+    assert index['passwords'] == {'0xabc': 'secret'}
+
+    # A new process trusts the index as long as the file is unchanged
+    index['passwords']['0xabc'] = 'from index'
+    with index_path.open('wb') as f:
+        pickle.dump(index, f)
+    assert CredentialStore(path, index_path).get('0xabc') == 'from index'
+
+
+def test_one_store_per_file(tmp_path):
+    path = tmp_path / 'passwords.csv'
+    _write(path, [('0xabc', 'secret')], 10 ** 18)
+    assert get_credential_store(path) is get_credential_store(str(path))
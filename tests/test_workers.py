@@ -0,0 +1,70 @@
+import multiprocessing
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import workers
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                reason="The fake setup and scenarios are inherited by forked workers")
+
+
+def _whoami(ctx):
+    time.sleep(0.05)
+    return {'account': ctx, 'phases': {'whoami': 0.05}}
+
+
+def _unpicklable(ctx):
+    return {'output': threading.Lock()}
+
+
+@pytest.fixture
+def fake_flows(monkeypatch):
+    monkeypatch.setattr(workers, 'init_context', lambda entry: setattr(workers, '_context', entry['address']))
+    monkeypatch.setitem(sys.modules, 'scenarios',
+                        SimpleNamespace(SCENARIOS={'whoami': _whoami, 'unpicklable': _unpicklable}))
+
+
+def _run(pool, scenarios):
+    results = list()
+    done = threading.Semaphore(0)
+
+    def _callback(result):
+        results.append(result)
+        done.release()
+    for scenario in scenarios:
+        pool.submit(_callback, scenario)
+    for _ in scenarios:
+        assert done.acquire(timeout=20), "An iteration never called back"
+    return results
+
+
+def test_one_account_per_worker(fake_flows):
+    pool = workers.WarmWorkerPool(2, [{'address': '0xa'}, {'address': '0xb'}, {'address': '0xc'}])
+    try:
+        results = _run(pool, ['whoami'] * 10)
+    finally:
+        pool.close()
+    accounts = {result['worker']: result['output']['account'] for result in results}
+    assert len(set(accounts.values())) == len(accounts)
+    assert set(accounts.values()) <= {'0xa', '0xb'}
+    assert all(result['error'] is None for result in results)
+
+
+def test_failed_iteration_calls_back(fake_flows):
+    pool = workers.WarmWorkerPool(1, [{'address': '0xa'}])
+    try:
+        failed, ok = _run(pool, ['unpicklable', 'whoami'])
+    finally:
+        pool.close()
+    assert failed['scenario'] == 'unpicklable' and failed['error_class']
+    assert failed['phases'] == {} and failed['finished'] >= failed['started']
+    assert ok['error'] is None
+
+
+def test_workers_need_their_own_accounts():
+    with pytest.raises(AssertionError):
+        workers.WarmWorkerPool(2, [{'address': '0xa'}])
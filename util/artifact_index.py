@@ -0,0 +1,104 @@
+"""
+A compact, pre-parsed index of the keeper contract artifacts.
+
+The artifacts (<contract>.<network>.json) hold large ABIs and bytecode, and parsing them all takes long at
+every start-up. The index keeps only the name, address, ABI, version and event topic hashes of each contract,
+pickled next to the other caches and rebuilt when any artifact file changes (by name, mtime and size):
+
+    python -m util.artifact_index <artifacts path> <network name>
+"""
+import hashlib
+import json
+import logging
+import pickle
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from eth_utils import event_abi_to_log_topic
+
+from util.misc import atomic_write
+
+DEFAULT_INDEX_FOLDER = Path.home() / '.cache' / 'mantaray'
+
+# topics is a dict of event topic hash (hex): event name
+ContractArtifact = namedtuple('ContractArtifact', ('name', 'address', 'abi', 'version', 'topics', 'path'))
+
+_indexes = dict()
+_lock = threading.Lock()
+
+
+def artifacts_fingerprint(path_artifacts, network_name):
+    """Changes when any artifact file is added, removed or modified"""
+    stats = [(p.name, p.stat().st_mtime_ns, p.stat().st_size)
+             for p in sorted(Path(path_artifacts).glob("*.{}.json".format(network_name)))]
+    return hashlib.sha256(json.dumps(stats).encode()).hexdigest()
+
+
+def default_index_path(path_artifacts, network_name):
+    path_hash = hashlib.sha256(str(Path(path_artifacts).resolve()).encode()).hexdigest()[:16]
+    return DEFAULT_INDEX_FOLDER / 'artifacts.{}.{}.pickle'.format(network_name, path_hash)
+
+
+def build_index(path_artifacts, network_name):
+    """Parse the artifacts
+
+    :return: dict of contract name: ContractArtifact
+    """
+    contracts = dict()
+    for path_artifact_file in sorted(Path(path_artifacts).glob("*.{}.json".format(network_name))):
+        with open(path_artifact_file) as fp:
+            artifact = json.load(fp)
+        topics = {'0x' + event_abi_to_log_topic(abi).hex(): abi['name']
+                  for abi in artifact['abi'] if abi.get('type') == 'event'}
+        contracts[artifact['name']] = ContractArtifact(artifact['name'], artifact['address'], artifact['abi'],
+                                                       artifact.get('version'), topics, str(path_artifact_file))
+    return contracts
+
+
+def _save(index_path, index):
+    with atomic_write(index_path, 'wb') as fp:
+        pickle.dump(index, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_index(path_artifacts, network_name, index_path=None):
+    """The contract artifacts, from this process, the pickled index, or parsed if any artifact changed
+
+    :param index_path: Pickle file of the index, by default in ~/.cache/mantaray
+    :return: dict of contract name: ContractArtifact
+    """
+    index_path = Path(index_path) if index_path else default_index_path(path_artifacts, network_name)
+    fingerprint = artifacts_fingerprint(path_artifacts, network_name)
+    key = (str(index_path), network_name)
+    with _lock:
+        cached = _indexes.get(key)
+        if cached and cached['fingerprint'] == fingerprint:
+            return cached['contracts']
+
+        index = None
+        if index_path.exists():
+            try:
+                with index_path.open('rb') as fp:
+                    index = pickle.load(fp)
+            except Exception as e:
+                logging.warning("Unreadable artifact index {}: {}".format(index_path, e))
+        if not index or index.get('fingerprint') != fingerprint:
+            index = {'fingerprint': fingerprint, 'contracts': build_index(path_artifacts, network_name)}
+            _save(index_path, index)
+            logging.info("Indexed {} artifacts of {} in {}".format(len(index['contracts']), path_artifacts, index_path))
+        _indexes[key] = index
+        return index['contracts']
+
+
+def invalidate():
+    """Forget the indexes loaded in this process"""
+    with _lock:
+        _indexes.clear()
+
+
+if __name__ == '__main__':
+    import sys
+
+    assert len(sys.argv) == 3, "Usage: python -m util.artifact_index <artifacts path> <network name>"
+    for contract in load_index(sys.argv[1], sys.argv[2]).values():
+        print("{:>40} {} {} ({} events)".format(contract.name, contract.address, contract.version, len(contract.topics)))
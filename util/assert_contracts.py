@@ -1,12 +1,103 @@
-
 #%% CHECKING CONTRACT VERSIONS!
 # Assert versions of contract definitions (ABI files) match your installed keeper-contracts package version.
-import pip_api
+#
+# The artifacts are read from the pre-parsed util.artifact_index, and the on-chain code of all the contracts is
+# fetched in one batched JSON-RPC request (or a thread pool, if the provider can't batch). Verified contracts are
+# cached on disk per chain, so a later start-up with the same artifacts and chain skips the verification.
+import hashlib
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
+
+import pip_api
+import requests
 from ocean_keeper.web3_provider import Web3Provider
 
+from util.artifact_index import artifacts_fingerprint, load_index
+from util.misc import atomic_write
+
+DEFAULT_CACHE_PATH = Path.home() / '.cache' / 'mantaray' / 'verified_contracts.json'
+
+
+def _chain_key(web3):
+    """Chain ID and genesis block hash, to tell apart chains sharing an ID (i.e. local redeployments)"""
+    chain_id = web3.manager.request_blocking('net_version', [])
+    genesis = web3.eth.getBlock(0)['hash']
+    return "{}:{}".format(chain_id, genesis.hex() if hasattr(genesis, 'hex') else genesis)
+
+
+def _read_cache(cache_path):
+    try:
+        with open(str(cache_path)) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _write_cache(cache_path, cache):
+    with atomic_write(cache_path) as fp:
+        json.dump(cache, fp, indent=2)
+
+
+def get_codes(web3, addresses, max_workers=8):
+    """The code at each address, in one batched JSON-RPC request, or in a thread pool if the provider can't batch
+
+    :return: list of bytes, in the order of addresses
+    """
+    endpoint_uri = getattr(web3.provider, 'endpoint_uri', None)
+    if endpoint_uri and str(endpoint_uri).startswith('http'):
+        batch = [{'jsonrpc': '2.0', 'id': i, 'method': 'eth_getCode', 'params': [address, 'latest']}
+                 for i, address in enumerate(addresses)]
+        try:
+            res = requests.post(str(endpoint_uri), json=batch, timeout=30)
+            res.raise_for_status()
+            responses = {response['id']: response for response in res.json()}
+            return [bytes.fromhex(responses[i]['result'][2:]) for i in range(len(addresses))]
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            logging.debug("Batched eth_getCode failed ({}), falling back to a thread pool".format(e))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [bytes(code) for code in executor.map(web3.eth.getCode, addresses)]
+
+
+def verify_contracts(ocn, network_name, cache_path=DEFAULT_CACHE_PATH, check_version=True):
+    """Assert the ABI versions and the on-chain code of all the artifacts, unless verified before
+
+    :param cache_path: JSON file of the verified contracts per chain, None to always verify
+    :return: list of (name, address, code hash, ABI version)
+    """
+    path_artifacts = Path(ocn._config.keeper_path)
+    assert path_artifacts.exists()
+    web3 = Web3Provider.get_web3()
+    version_kc_installed = 'v'+str(pip_api.installed_distributions()['keeper-contracts'].version) if check_version else None
+
+    chain_key = _chain_key(web3)
+    fingerprint = artifacts_fingerprint(path_artifacts, network_name)
+    cache = _read_cache(cache_path) if cache_path else dict()
+    cached = cache.get(chain_key)
+    if cached and cached['fingerprint'] == fingerprint and cached['version'] == version_kc_installed:
+        logging.info("{} contracts verified before on chain {}, skipping".format(len(cached['contracts']), chain_key))
+        return [tuple(contract) for contract in cached['contracts']]
+
+    artifacts = list(load_index(path_artifacts, network_name).values())
+    if check_version:
+        for artifact in artifacts:
+            assert artifact.version == version_kc_installed, \
+                "Artifact version mismatch, ABI files {} != {} specified in environment".format(artifact.version, version_kc_installed)
+
+    codes = get_codes(web3, [artifact.address for artifact in artifacts])
+    contracts = list()
+    for artifact, code in zip(artifacts, codes):
+        assert code, "No code found on-chain for {} at {}".format(artifact.path, artifact.address)
+        contracts.append((artifact.name, artifact.address, hashlib.sha256(code).hexdigest(), artifact.version))
+    logging.info("All {} ABI addresses confirmed to exist on-chain.".format(len(contracts)))
+
+    if cache_path:
+        cache = _read_cache(cache_path)
+        cache[chain_key] = {'fingerprint': fingerprint, 'version': version_kc_installed, 'contracts': contracts}
+        _write_cache(cache_path, cache)
+    return contracts
+
 
 #%%
 def assert_contract_ABI_versions(ocn,network_name):
@@ -15,16 +106,12 @@ def assert_contract_ABI_versions(ocn,network_name):
     path_artifacts = Path(ocn._config.keeper_path)
     # path_artifacts = Path.cwd() / folder_artifacts
     assert path_artifacts.exists()
-    # path_artifacts.glob("*.{}.json".format(network_name))
     logging.info("Checking artifacts versions in {}".format(path_artifacts))
-    for path_artifact_file in path_artifacts.glob("*.{}.json".format(network_name)):
-        logging.debug("Checking {}".format(path_artifacts))
-        with open(path_artifact_file) as fp:
-            artifact_dict = json.load(fp)
-            # print(artifact_dict['version'])
-        assert artifact_dict['version'] == version_kc_installed, \
-            "Artifact version mismatch, ABI files {} != {} specified in environment".format(artifact_dict['version'], version_kc_installed)
-    logging.info("Contract ABI {} == installed version {}, confirmed".format(artifact_dict['version'], version_kc_installed))
+    for artifact in load_index(path_artifacts, network_name).values():
+        logging.debug("Checking {}".format(artifact.path))
+        assert artifact.version == version_kc_installed, \
+            "Artifact version mismatch, ABI files {} != {} specified in environment".format(artifact.version, version_kc_installed)
+    logging.info("Contract ABI {} == installed version {}, confirmed".format(artifact.version, version_kc_installed))
 
 
 #%% Assert code at this smart contract address
@@ -32,10 +119,9 @@ def assert_contract_code(ocn, network_name):
     # ConfigProvider.set_config(configuration)
     path_artifacts = Path(ocn._config.keeper_path)
     this_web3 = Web3Provider.get_web3()
-    for path_artifact_file in path_artifacts.glob("*.{}.json".format(network_name)):
-        with open(path_artifact_file) as fp:
-            artifact_dict = json.load(fp)
-            logging.debug("Checking {} at {}".format(artifact_dict['name'],artifact_dict['address']))
-        code = this_web3.eth.getCode(artifact_dict['address'])
-        assert code, "No code found on-chain for {} at {}".format(path_artifact_file, artifact_dict['address'])
-    logging.info("All {} ABI addresses confirmed to exist on-chain.".format(artifact_dict['version']))
+    artifacts = list(load_index(path_artifacts, network_name).values())
+    codes = get_codes(this_web3, [artifact.address for artifact in artifacts])
+    for artifact, code in zip(artifacts, codes):
+        logging.debug("Checking {} at {}".format(artifact.name, artifact.address))
+        assert code, "No code found on-chain for {} at {}".format(artifact.path, artifact.address)
+    logging.info("All {} ABI addresses confirmed to exist on-chain.".format(artifact.version))
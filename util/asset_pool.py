@@ -0,0 +1,124 @@
+"""
+A pool of pre-published assets for the consume flows.
+
+Publishing a new DDO before each order makes the consume benchmark measure the publish cost, and keeps
+growing Aquarius and the DID registry. The pool publishes a fixed number of assets once, persists their
+DIDs, drops the ones which no longer resolve, and hands them out round-robin.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from util.misc import atomic_write, file_lock, get_metadata_example
+
+DEFAULT_SIZE = 10
+
+
+class AssetPool:
+    """JSON file of published DIDs, shared by the processes running consume flows
+
+    Filling the pool takes an exclusive lock on `<path>.lock`, so concurrent worker processes don't publish
+    the missing assets twice.
+    """
+
+    def __init__(self, path, size=DEFAULT_SIZE):
+        self.path = Path(path)
+        self.size = size
+        self._lock = threading.Lock()
+        self._assets = self._read()
+        # Start at a random position, so the worker processes don't all order the same asset at once
+        self._next = random.randrange(max(len(self._assets), 1))
+
+    def _read(self):
+        if not self.path.exists():
+            return list()
+        try:
+            with self.path.open() as f:
+                return json.load(f)['assets']
+        except (ValueError, KeyError):
+            logging.warning("Corrupt asset pool file {}, starting empty".format(self.path))
+            return list()
+
+    def _write(self):
+        with atomic_write(self.path) as f:
+            json.dump({'assets': self._assets}, f, indent=2)
+
+    @property
+    def dids(self):
+        return [asset['did'] for asset in self._assets]
+
+    def __len__(self):
+        return len(self._assets)
+
+    def validate(self, ocn, max_workers=8):
+        """Drop the assets which don't resolve anymore, i.e. after a redeployment of the stack
+
+        :return: list of the dropped DIDs
+        """
+        def _resolves(did):
+            try:
+                return ocn.assets.resolve(did) is not None
+            except Exception as e:
+                logging.warning("Pooled asset {} does not resolve: {}".format(did, e))
+                return False
+
+        with self._lock:
+            assets = list(self._assets)
+        if not assets:
+            return list()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(assets))) as executor:
+            resolves = list(executor.map(_resolves, [asset['did'] for asset in assets]))
+        dropped = [asset['did'] for asset, ok in zip(assets, resolves) if not ok]
+        if dropped:
+            with file_lock(self.path), self._lock:
+                self._assets = [asset for asset in self._read() if asset['did'] not in dropped]
+                self._write()
+            logging.info("Dropped {} unresolvable assets from the pool".format(len(dropped)))
+        return dropped
+
+    def fill(self, ocn, publisher_account, metadata_factory=get_metadata_example, max_workers=1):
+        """Publish assets until the pool holds `size` of them
+
+        :param metadata_factory: Function returning the metadata of a new asset
+        :param max_workers: Concurrent publications, more than 1 needs an account which can send
+            concurrent transactions, i.e. routed through a util.nonce_manager.NonceManager
+        :return: list of the new DIDs
+        """
+        with file_lock(self.path):
+            # Another process may have filled the pool while waiting for the lock
+            with self._lock:
+                self._assets = self._read()
+            missing = self.size - len(self._assets)
+            if missing <= 0:
+                return list()
+
+            logging.info("Publishing {} assets for the pool {}".format(missing, self.path))
+            with ThreadPoolExecutor(max_workers=min(max_workers, missing)) as executor:
+                ddos = list(executor.map(lambda _: ocn.assets.create(metadata_factory(), publisher_account),
+                                         range(missing)))
+            with self._lock:
+                self._assets.extend({'did': ddo.did, 'publisher': publisher_account.address, 'created': time.time()}
+                                    for ddo in ddos)
+                self._write()
+        return [ddo.did for ddo in ddos]
+
+    def ensure(self, ocn, publisher_account, max_workers=1):
+        """Validate the pooled assets, and publish the missing ones
+
+        :param max_workers: Concurrent publications, see fill()
+        """
+        self.validate(ocn)
+        self.fill(ocn, publisher_account, max_workers=max_workers)
+        return self
+
+    def next(self):
+        """The next DID, round-robin"""
+        with self._lock:
+            assert self._assets, "The asset pool {} is empty, fill() it first".format(self.path)
+            asset = self._assets[self._next % len(self._assets)]
+            self._next += 1
+        return asset['did']
@@ -0,0 +1,172 @@
+"""
+Keep test accounts funded in the background.
+
+The BalanceMaintainer thread checks the balances of a set of accounts, and tops up the accounts below the
+ETH and OCEAN watermarks in one concurrent batch, so that refills stay off the critical path of a measured
+flow. The OCEAN refills are transactions of the account itself, so a flow holds in_use() while its account
+sends transactions, and the refills of that account wait for it rather than racing on the nonce.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from util.provision import request_eth, request_tokens, wait_for_eth
+
+SCALE = 10**18
+
+
+class BalanceMaintainer:
+    """Background thread refilling ETH (from the faucet) and OCEAN (from the dispenser) below watermarks"""
+
+    def __init__(self, ocn, accounts=(), faucet_url=None, min_eth=1, min_ocean=10, refill_ocean=100,
+                 interval=30, max_workers=4):
+        """
+        :param ocn: Ocean instance
+        :param accounts: Accounts to maintain, more can be added with add()
+        :param faucet_url: Faucet for the ETH refills, None to only refill OCEAN
+        :param min_eth: ETH watermark
+        :param min_ocean: OCEAN watermark
+        :param refill_ocean: OCEAN requested when below the watermark
+        :param interval: Seconds between the balance checks
+        :param max_workers: Maximum number of refills in parallel
+        """
+        self.ocn = ocn
+        self.faucet_url = faucet_url
+        self.min_eth = min_eth
+        self.min_ocean = min_ocean
+        self.refill_ocean = refill_ocean
+        self.interval = interval
+        self.max_workers = max_workers
+        self.refills = 0
+        self.refill_failures = 0
+        self._accounts = dict()
+        self._ready = dict()
+        self._in_use = dict()
+        self._errors = dict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        for acct in accounts:
+            self.add(acct)
+
+    def add(self, acct):
+        """Maintain one more account, checked right away if the thread is started"""
+        with self._lock:
+            self._accounts[acct.address.lower()] = acct
+            self._ready.setdefault(acct.address.lower(), threading.Event())
+            self._in_use.setdefault(acct.address.lower(), threading.Lock())
+        self._wake.set()
+
+    def remove(self, acct):
+        with self._lock:
+            self._accounts.pop(acct.address.lower(), None)
+            ready = self._ready.pop(acct.address.lower(), None)
+        if ready:
+            ready.set()
+
+    def wait_ready(self, acct, timeout=None):
+        """Block until the account was checked and is funded, or was refilled successfully
+
+        An account whose refill failed isn't ready until a later check refills it, see last_error().
+
+        :return: False on timeout
+        """
+        return self._ready[acct.address.lower()].wait(timeout)
+
+    @contextmanager
+    def in_use(self, acct):
+        """Hold while the account sends its own transactions, its refills wait until the block exits"""
+        lock = self._in_use.get(acct.address.lower())
+        if lock is None:
+            yield
+            return
+        with lock:
+            yield
+
+    def last_error(self, acct):
+        """The exception of the last failed refill of the account, None if it succeeded"""
+        return self._errors.get(acct.address.lower())
+
+    def _refill(self, acct, balance):
+        with self.in_use(acct):
+            self._refill_unlocked(acct, balance)
+
+    def _refill_unlocked(self, acct, balance):
+        if balance.eth / SCALE < self.min_eth:
+            if self.faucet_url:
+                tx_hash = request_eth(self.faucet_url, acct.address)
+                wait_for_eth(self.ocn, acct, tx_hash)
+            else:
+                logging.warning("{} is below {} ETH, and no faucet is configured".format(acct.address, self.min_eth))
+        if balance.ocn / SCALE < self.min_ocean:
+            assert request_tokens(self.ocn, acct, self.refill_ocean), "Token request failed for {}".format(acct.address)
+        logging.debug("Refilled {}".format(acct.address))
+
+    def check_once(self):
+        """Check all balances, and refill the low accounts in one batch
+
+        :return: Number of accounts refilled successfully
+        """
+        with self._lock:
+            accounts = list(self._accounts.values())
+        if not accounts:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            balances = list(executor.map(self.ocn.accounts.balance, accounts))
+            low = [(acct, balance) for acct, balance in zip(accounts, balances)
+                   if balance.eth / SCALE < self.min_eth or balance.ocn / SCALE < self.min_ocean]
+            futures = {acct.address.lower(): executor.submit(self._refill, acct, balance) for acct, balance in low}
+            failed = dict()
+            for address, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error("Refill of {} failed: {}".format(address, e))
+                    failed[address] = e
+
+        for acct in accounts:
+            address = acct.address.lower()
+            ready = self._ready.get(address)
+            if address in failed:
+                # Not funded, the flows wait for a later check to refill it
+                self._errors[address] = failed[address]
+                if ready:
+                    ready.clear()
+            else:
+                self._errors.pop(address, None)
+                if ready:
+                    ready.set()
+        refilled = len(low) - len(failed)
+        self.refills += refilled
+        self.refill_failures += len(failed)
+        if low:
+            logging.info("Refilled {} of {} accounts, {} failed".format(refilled, len(accounts), len(failed)))
+        return refilled
+
+    def start(self):
+        """Check the balances every `interval` seconds in a background thread, starting now"""
+        assert self._thread is None, "Balance maintainer already started"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='BalanceMaintainer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.check_once()
+            except Exception as e:
+                logging.error("Balance check failed: {}".format(e))
+            # Until the next interval, or an account is added
+            self._wake.wait(self.interval)
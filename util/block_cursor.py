@@ -0,0 +1,78 @@
+"""
+A small persistent store of block numbers, so that event subscriptions can start scanning
+from the block where an agreement was created instead of from genesis.
+
+Agreements without a recorded block start from the chain-head checkpoint, the chain head when this
+process (or, until it sets its own, an earlier run) started. Every agreement ordered since is at or after it.
+"""
+import json
+import logging
+import threading
+from pathlib import Path
+
+from util.misc import atomic_write, file_lock
+
+CHAIN_HEAD = 'chain_head'
+MAX_AGREEMENTS = 10000
+
+
+class BlockCursorStore:
+    """JSON file of agreement_id: block number, and the chain-head checkpoint
+
+    Every update re-reads the file and replaces it atomically under an exclusive lock on `<path>.lock`,
+    so that concurrent processes (the controller runs each flow in a new process, or in warm workers)
+    share the same cursors without losing each other's updates.
+    """
+
+    def __init__(self, path, max_agreements=MAX_AGREEMENTS):
+        self.path = Path(path)
+        self.max_agreements = max_agreements
+        self._lock = threading.Lock()
+        self._data = self._read()
+        # Kept in memory, a later checkpoint of another process may be after the agreements of this one
+        self.checkpoint = self._data['checkpoints'].get(CHAIN_HEAD, 0)
+
+    def _read(self):
+        if not self.path.exists():
+            return {'agreements': {}, 'checkpoints': {}}
+        try:
+            with self.path.open() as f:
+                data = json.load(f)
+        except ValueError:
+            logging.warning("Corrupt block cursor file {}, starting empty".format(self.path))
+            return {'agreements': {}, 'checkpoints': {}}
+        data.setdefault('agreements', {})
+        data.setdefault('checkpoints', {})
+        return data
+
+    def _write(self):
+        with atomic_write(self.path) as f:
+            json.dump(self._data, f)
+
+    def record(self, agreement_id, block_number):
+        """Record the block at (or before) which the agreement was created"""
+        with self._lock, file_lock(self.path):
+            self._data = self._read()
+            agreements = self._data['agreements']
+            agreements[agreement_id] = int(block_number)
+            # Python dicts keep insertion order, drop the oldest agreements first
+            for old_key in list(agreements)[:max(0, len(agreements) - self.max_agreements)]:
+                del agreements[old_key]
+            self._write()
+
+    def set_checkpoint(self, block_number):
+        """Record the chain head, before this process orders any agreement"""
+        self.checkpoint = int(block_number)
+        with self._lock, file_lock(self.path):
+            self._data = self._read()
+            checkpoints = self._data['checkpoints']
+            checkpoints[CHAIN_HEAD] = max(checkpoints.get(CHAIN_HEAD, 0), self.checkpoint)
+            self._write()
+
+    def get(self, agreement_id, default=0):
+        """The recorded block of an agreement, as of the last read of the file"""
+        return self._data['agreements'].get(agreement_id, default)
+
+    def from_block(self, agreement_id):
+        """The first block to scan for the events of an agreement"""
+        return self.get(agreement_id, self.checkpoint)
@@ -1,5 +1,8 @@
+import configparser
 import os
 import logging
+import threading
+from collections import namedtuple
 from pathlib import Path
 
 CONFIG_MAP = {
@@ -41,15 +44,17 @@ def name_deployment_type():
         logging.info("Environment configuration detected: Local machine with start-ocean local components.".format())
 
 
-def get_config_file_path():
+def get_config_file_path(deployment_type=None):
     # The configuration ini file is in the root of the project
-    proj_path = get_project_path() / CONFIG_MAP[get_deployment_type()]['config_ini_name']
+    deployment_type = deployment_type or get_deployment_type()
+    proj_path = get_project_path(deployment_type) / CONFIG_MAP[deployment_type]['config_ini_name']
     assert proj_path.exists(), "{} not found".format(proj_path)
     return proj_path
 
 
-def get_project_path():
-    if get_deployment_type() == 'JUPYTER_DEPLOYMENT':
+def get_project_path(deployment_type=None):
+    deployment_type = deployment_type or get_deployment_type()
+    if deployment_type == 'JUPYTER_DEPLOYMENT':
         # Detect a jupyter notebook running within one of the allowed folders
         return Path.home() / 'mantaray_jupyter'
         # if any(folder == Path.cwd().parts[-1] for folder in SCRIPT_FOLDERS):
@@ -58,12 +63,12 @@ def get_project_path():
         # else:
         #     print("JUPYTER_DEPLOYMENT is set, but can't find the correct paths!")
         #     raise EnvironmentError
-    elif get_deployment_type() == 'JUPYTER_DEPLOYMENT_TEST':
+    elif deployment_type == 'JUPYTER_DEPLOYMENT_TEST':
         this_path =  Path.cwd() / '..' / '..'
         return this_path.resolve()
-    elif get_deployment_type() == 'USE_K8S_CLUSTER':
+    elif deployment_type == 'USE_K8S_CLUSTER':
         return Path.cwd()
-    elif get_deployment_type() == 'DEFAULT':
+    elif deployment_type == 'DEFAULT':
         return Path.cwd()
     else:
         raise NameError
@@ -88,3 +93,93 @@ if 0:
         PATH_PROJECT = Path.cwd().parents[0]
 
     assert PATH_PROJECT.parts[-1] == 'mantaray_jupyter'
+
+
+class DeploymentConfig(namedtuple('DeploymentConfig', (
+        'deployment_type', 'project_path', 'config_file_path', 'network_name',
+        'keeper_url', 'parity_url', 'secret_store_url', 'faucet_url', 'aquarius_url', 'brizo_url',
+        'provider_address', 'keeper_path', 'storage_path', 'downloads_path'))):
+    """The deployment type, paths and endpoints of this process, parsed once from the environment and INI file
+
+    Get the shared instance with get_deployment_config(). It's immutable, after changing the environment
+    variables or the INI file call invalidate_deployment_config() to build a new one.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_environment(cls):
+        deployment_type = get_deployment_type()
+        project_path = get_project_path(deployment_type)
+        config_file_path = get_config_file_path(deployment_type)
+        parser = configparser.ConfigParser()
+        parser.read(str(config_file_path))
+        keeper = parser['keeper-contracts']
+        resources = parser['resources']
+
+        keeper_path = Path(os.path.expanduser(keeper.get('keeper.path', 'artifacts')))
+        if not keeper_path.is_absolute():
+            keeper_path = project_path / keeper_path
+        # Artifacts are named <contract>.<network>.json, i.e. artifacts_nile/DIDRegistry.nile.json
+        folder = keeper_path.name
+        network_name = folder[len('artifacts_'):] if folder.startswith('artifacts_') else 'development'
+
+        return cls(
+            deployment_type=deployment_type,
+            project_path=project_path,
+            config_file_path=config_file_path,
+            network_name=os.environ.get('NETWORK_NAME', network_name),
+            keeper_url=keeper.get('keeper.url'),
+            parity_url=keeper.get('parity.url'),
+            secret_store_url=keeper.get('secret_store.url'),
+            faucet_url=keeper.get('faucet.url'),
+            aquarius_url=resources.get('aquarius.url'),
+            brizo_url=resources.get('brizo.url'),
+            provider_address=resources.get('provider.address'),
+            keeper_path=keeper_path,
+            storage_path=resources.get('storage.path'),
+            downloads_path=resources.get('downloads.path'),
+        )
+
+    @property
+    def endpoints(self):
+        """The component URLs to check, by name"""
+        endpoints = {
+            'aquarius': self.aquarius_url,
+            'brizo': self.brizo_url,
+            'Ethereum node': self.keeper_url,
+            'secret_store': self.secret_store_url,
+        }
+        return {name: url for name, url in endpoints.items() if url}
+
+
+_deployment_config = None
+_squid_config = None
+_config_lock = threading.Lock()
+
+
+def get_deployment_config():
+    """The DeploymentConfig of this process, built on the first call"""
+    global _deployment_config
+    with _config_lock:
+        if _deployment_config is None:
+            _deployment_config = DeploymentConfig.from_environment()
+        return _deployment_config
+
+
+def get_squid_config():
+    """The squid_py Config of the deployment INI file, parsed on the first call"""
+    global _squid_config
+    deployment_config = get_deployment_config()
+    with _config_lock:
+        if _squid_config is None:
+            from squid_py import Config
+            _squid_config = Config(str(deployment_config.config_file_path))
+        return _squid_config
+
+
+def invalidate_deployment_config():
+    """Forget the cached configurations, the next calls parse the environment and the INI file again"""
+    global _deployment_config, _squid_config
+    with _config_lock:
+        _deployment_config = None
+        _squid_config = None
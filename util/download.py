@@ -0,0 +1,363 @@
+"""
+Concurrent, ranged and resumable downloads for the consume flow.
+
+ocn.assets.consume() downloads the files of an asset one after the other, each in a single stream.
+download_files() fetches the files concurrently, splits the files of servers supporting range requests into
+chunks fetched in parallel, and resumes from the chunks already on disk (recorded in a `.part.json` file next
+to the `.part` file). The length of each response is checked as the bytes arrive, and the file is verified
+against the contentLength and checksum of the DDO before it's renamed to its final name. Single stream downloads
+are hashed as the bytes arrive, ranged ones once all their chunks are on disk.
+
+consume_asset() builds the signed Brizo consume URLs of an agreement, as squid-py does, and downloads them.
+serve_directory() is a local stand-in for Brizo, serving a directory with range support:
+
+    python -m util.download serve <directory> [port]
+    python -m util.download <url> [<url> ...] <destination>
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import SimpleHTTPRequestHandler
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from util.misc import ThreadingHTTPServer, atomic_write
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ChecksumMismatch(DownloadError):
+    pass
+
+
+# One file to download, the name is taken from the Content-Disposition header or the URL if None.
+# content_length and checksum (hex digest of checksum_type, i.e. 'MD5') come from the DDO files metadata
+FileSpec = namedtuple('FileSpec', ('url', 'destination', 'name', 'content_length', 'checksum', 'checksum_type'))
+FileSpec.__new__.__defaults__ = (None, None, None, None)
+
+
+def _content_disposition_name(headers):
+    match = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', headers.get('Content-Disposition', ''))
+    return os.path.basename(unquote(match.group(1))) if match else None
+
+
+def request_first_chunk(session, url, chunk_size, timeout=30):
+    """Request the first chunk, its headers tell the size, the file name and the range support
+
+    The body of the response is the first chunk if the server answers range requests, the whole file if it
+    doesn't, and nothing for an empty file. The caller closes the response.
+
+    :return: (response, size or None, file name or None, True if the server answers range requests)
+    """
+    res = session.get(url, headers={'Range': 'bytes=0-{}'.format(chunk_size - 1)}, stream=True, timeout=timeout)
+    name = _content_disposition_name(res.headers)
+    if res.status_code == 416:
+        # Range Not Satisfiable, there is no first byte of an empty file
+        return res, 0, name, False
+    try:
+        res.raise_for_status()
+    except requests.HTTPError:
+        res.close()
+        raise
+    match = re.match(r'bytes \d+-\d+/(\d+)', res.headers.get('Content-Range', ''))
+    if res.status_code == 206 and match:
+        return res, int(match.group(1)), name, True
+    size = res.headers.get('Content-Length')
+    return res, (int(size) if size else None), name, False
+
+
+def _stream_to(res, f, expected, hasher=None):
+    """Write the response body to f, failing as soon as it exceeds the expected length
+
+    :param hasher: hashlib object updated with the body as it arrives
+    """
+    received = 0
+    for block in res.iter_content(STREAM_BLOCK_SIZE):
+        received += len(block)
+        if expected is not None and received > expected:
+            raise DownloadError("{} sent more than the expected {} bytes".format(res.url, expected))
+        f.write(block)
+        if hasher is not None:
+            hasher.update(block)
+    if expected is not None and received != expected:
+        raise DownloadError("{} sent {} of the expected {} bytes".format(res.url, received, expected))
+    return received
+
+
+class _ChunkState:
+    """The chunks of a .part file already downloaded, persisted to resume"""
+
+    def __init__(self, path, size, chunk_size):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+                if state['size'] == size and state['chunk_size'] == chunk_size:
+                    self.done = set(state['done'])
+            except (ValueError, KeyError):
+                logging.warning("Corrupt download state {}, starting over".format(path))
+        self.size = size
+        self.chunk_size = chunk_size
+
+    def add(self, index):
+        with self._lock:
+            self.done.add(index)
+            with atomic_write(self.path) as f:
+                json.dump({'size': self.size, 'chunk_size': self.chunk_size, 'done': sorted(self.done)}, f)
+
+
+def _new_hasher(spec):
+    return hashlib.new(spec.checksum_type.lower()) if spec.checksum and spec.checksum_type else None
+
+
+def _verify(path, spec, size, hasher=None):
+    """Check the length and the checksum of a downloaded file against the DDO
+
+    :param hasher: The _new_hasher() of the file updated as the bytes arrived, the file is hashed from disk if None
+    """
+    if spec.content_length is not None and size != int(spec.content_length):
+        raise DownloadError("{} is {} bytes, the DDO says {}".format(path, size, spec.content_length))
+    if spec.checksum and spec.checksum_type:
+        if hasher is None:
+            hasher = _new_hasher(spec)
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(STREAM_BLOCK_SIZE), b''):
+                    hasher.update(block)
+        if hasher.hexdigest().lower() != spec.checksum.lower():
+            raise ChecksumMismatch("{} {} is {}, the DDO says {}".format(
+                path, spec.checksum_type, hasher.hexdigest(), spec.checksum))
+
+
+def download_file(spec, session, chunk_executor=None, chunk_size=DEFAULT_CHUNK_SIZE, timeout=60):
+    """Download one file, in parallel chunks if the server supports range requests
+
+    :param chunk_executor: ThreadPoolExecutor for the chunks, the chunks are fetched one by one if None
+    :return: Path of the downloaded file
+    """
+    res, size, name, ranged = request_first_chunk(session, spec.url, chunk_size, timeout)
+    with res:
+        return _download(spec, session, chunk_executor, chunk_size, timeout, res, size, name, ranged)
+
+
+def _download(spec, session, chunk_executor, chunk_size, timeout, res, size, name, ranged):
+    """download_file() after the first response"""
+    name = spec.name or name or os.path.basename(urlparse(spec.url).path) or 'file'
+    os.makedirs(spec.destination, exist_ok=True)
+    path = os.path.join(spec.destination, name)
+    part_path = path + '.part'
+    if spec.content_length is not None and size is not None and size != int(spec.content_length):
+        raise DownloadError("{} is {} bytes, the DDO says {}".format(spec.url, size, spec.content_length))
+
+    hasher = None
+    if not ranged or not size:
+        # No range support, a single stream from the start, hashed as it arrives
+        hasher = _new_hasher(spec)
+        with open(part_path, 'wb') as f:
+            if size != 0:
+                size = _stream_to(res, f, size, hasher)
+    else:
+        # The chunks arrive out of order and may come from an earlier attempt, the file is hashed from disk
+        state = _ChunkState(part_path + '.json', size, chunk_size)
+        if not state.done or not os.path.exists(part_path):
+            state.done = set()
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+
+        def _write_chunk(index, chunk):
+            start = index * chunk_size
+            end = min(start + chunk_size, size) - 1
+            with open(part_path, 'r+b') as f:
+                f.seek(start)
+                _stream_to(chunk, f, end - start + 1)
+            state.add(index)
+
+        def _fetch_chunk(index):
+            start = index * chunk_size
+            end = min(start + chunk_size, size) - 1
+            with session.get(spec.url, headers={'Range': 'bytes={}-{}'.format(start, end)},
+                             stream=True, timeout=timeout) as chunk:
+                chunk.raise_for_status()
+                if chunk.status_code != 206:
+                    raise DownloadError("{} ignored the range request".format(spec.url))
+                _write_chunk(index, chunk)
+
+        # The first chunk is the body of the first response, read unless an earlier attempt has it
+        todo = [index for index in range(1, (size + chunk_size - 1) // chunk_size) if index not in state.done]
+        if state.done:
+            logging.info("Resuming {} with {} of {} chunks to go".format(
+                path, len(todo) + (0 not in state.done), (size + chunk_size - 1) // chunk_size))
+        futures = list()
+        if chunk_executor is not None and len(todo) > 1:
+            futures = [chunk_executor.submit(_fetch_chunk, index) for index in todo]
+            todo = list()
+        try:
+            if 0 not in state.done:
+                _write_chunk(0, res)
+            for index in todo:
+                _fetch_chunk(index)
+        finally:
+            wait(futures)
+        for future in futures:
+            future.result()
+
+    try:
+        _verify(part_path, spec, size, hasher)
+    except DownloadError:
+        # Start over on the next attempt, the chunk state says the bad file is complete
+        for stale_path in (part_path, part_path + '.json'):
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+        raise
+    os.replace(part_path, path)
+    if os.path.exists(part_path + '.json'):
+        os.remove(part_path + '.json')
+    return path
+
+
+def _session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def download_files(specs, max_files=4, max_chunks=8, chunk_size=DEFAULT_CHUNK_SIZE, session=None, timeout=60):
+    """Download files concurrently, each in parallel range chunks
+
+    :param specs: list of FileSpec
+    :param max_files: Files downloaded at once
+    :param max_chunks: Chunks downloaded at once, over all the files
+    :param session: HTTP session, by default a keep-alive session sized to max_files + max_chunks
+    :return: list of the downloaded paths, in the order of specs
+    """
+    session = session or _session(max_files + max_chunks)
+    with ThreadPoolExecutor(max_workers=max_chunks) as chunk_executor, \
+            ThreadPoolExecutor(max_workers=max_files) as file_executor:
+        futures = [file_executor.submit(download_file, spec, session, chunk_executor, chunk_size, timeout)
+                   for spec in specs]
+        wait(futures)
+    errors = [(spec.url, future.exception()) for spec, future in zip(specs, futures) if future.exception()]
+    if errors:
+        raise DownloadError("{} of {} downloads failed: {}".format(
+            len(errors), len(specs), '; '.join('{}: {}'.format(url, e) for url, e in errors)))
+    return [future.result() for future in futures]
+
+
+def consume_asset(ocn, agreement_id, did, consumer_account, destination, **kwargs):
+    """Download the files of an asset after its access agreement was fulfilled, like ocn.assets.consume()
+
+    :param kwargs: Passed to download_files()
+    :return: list of the downloaded paths
+    """
+    from ocean_keeper import Keeper
+    from ocean_keeper.utils import add_ethereum_prefix_and_hash_msg
+    from ocean_utils.agreements.service_types import ServiceTypes
+
+    ddo = ocn.assets.resolve(did)
+    service_endpoint = ddo.get_service(ServiceTypes.ASSET_ACCESS).service_endpoint
+    signature = Keeper.sign_hash(add_ethereum_prefix_and_hash_msg(agreement_id), consumer_account)
+    # One folder per agreement, the flows ordering the same pooled asset don't write the same files
+    folder = os.path.join(destination, 'datafile.{}.{}'.format(ddo.asset_id, agreement_id))
+    specs = list()
+    for file in ddo.metadata['main']['files']:
+        url = '{}?signature={}&serviceAgreementId={}&consumerAddress={}&index={}'.format(
+            service_endpoint, signature, agreement_id, consumer_account.address, file['index'])
+        specs.append(FileSpec(url, folder, None, file.get('contentLength'), file.get('checksum'),
+                              file.get('checksumType')))
+    return download_files(specs, **kwargs)
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler answering single `Range: bytes=start-end` requests with 206
+
+    Serves the `root` directory, or the working directory if None.
+    """
+    root = None
+
+    def translate_path(self, path):
+        # The directory argument of SimpleHTTPRequestHandler is Python 3.7+, without it the working directory is served
+        path = super().translate_path(path)
+        if self.root is None:
+            return path
+        return os.path.join(self.root, os.path.relpath(path, os.getcwd()))
+
+    def send_head(self):
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        start, end = match.groups()
+        if start:
+            start, end = int(start), min(int(end) if end else size - 1, size - 1)
+        else:
+            start, end = max(size - int(end), 0), size - 1
+        if start > end:
+            self.send_error(416)
+            return None
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Content-Disposition', 'attachment; filename="{}"'.format(os.path.basename(path)))
+        self.end_headers()
+        self._range_remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, '_range_remaining', None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            block = source.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            outputfile.write(block)
+            remaining -= len(block)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_directory(directory, port=0, host='127.0.0.1'):
+    """Serve a directory with range support from a daemon thread, as a stand-in for Brizo
+
+    :return: The HTTP server, its URL is http://host:server.server_address[1]/
+    """
+    handler = type('DirectoryRangeRequestHandler', (RangeRequestHandler,), {'root': os.path.abspath(directory)})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='download-server', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    if len(sys.argv) >= 3 and sys.argv[1] == 'serve':
+        server = serve_directory(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 8030, '')
+        print("Serving {} on port {}".format(sys.argv[2], server.server_address[1]))
+        while True:
+            time.sleep(3600)
+    assert len(sys.argv) >= 3, "Usage: python -m util.download <url> [<url> ...] <destination>"
+    started = time.time()
+    paths = download_files([FileSpec(url, sys.argv[-1]) for url in sys.argv[1:-1]])
+    print("Downloaded {} files in {:0.2f}s".format(len(paths), time.time() - started))
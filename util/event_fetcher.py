@@ -0,0 +1,228 @@
+"""
+Fetch the agreement events for many agreements at once.
+
+Instead of one polling filter per agreement and condition, a single eth_getLogs query per block range
+returns the AgreementCreated and Fulfilled logs of every watched agreement (the agreement ID is the first
+indexed topic of all these events). The logs are then fanned out to a Future per agreement and condition.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError, wait
+
+from eth_utils import event_abi_to_log_topic
+from ocean_keeper.web3_provider import Web3Provider
+from web3 import Web3
+
+from util.events import AGREEMENT_CONDITIONS, TIMEOUT, ConditionResult, event_sources
+
+MAX_BLOCK_RANGE = 5000
+
+
+def agreement_topic(agreement_id):
+    """The agreement ID as a 32 byte log topic"""
+    return '0x' + Web3.toHex(hexstr=agreement_id)[2:].lower().rjust(64, '0')
+
+
+def get_log_sources(keeper, conditions=AGREEMENT_CONDITIONS):
+    """Map the contract addresses to the conditions and events they emit
+
+    :return: ({contract address: [(condition name, web3 event class)]}, sorted list of event topics)
+    """
+    sources = dict()
+    event_topics = set()
+    for name in conditions:
+        contract_attr, event_name = event_sources[name]
+        contract = getattr(keeper, contract_attr)
+        event = getattr(contract.contract.events, event_name)
+        sources.setdefault(contract.address.lower(), []).append((name, event))
+        event_topics.add(Web3.toHex(event_abi_to_log_topic(event._get_event_abi())))
+    return sources, sorted(event_topics)
+
+
+def decode_log(sources, log):
+    """Decode a raw log against the sources of get_log_sources()
+
+    :return: list of (condition name, decoded event) matching this log
+    """
+    decoded = list()
+    for name, event in sources.get(log['address'].lower(), []):
+        try:
+            decoded.append((name, event().processLog(log)))
+        except Exception:
+            # Not this event, i.e. another event of the same contract
+            continue
+    return decoded
+
+
+class ConditionFuture(Future):
+    """Future of a condition event, with the time.time() it was received at"""
+    received = None
+
+
+class AgreementEventFetcher:
+    """Watch the agreement conditions of many agreements with one log query per block range
+
+    Use watch() to register an agreement, and poll_once() (or start() a background thread) to resolve
+    the condition futures as the events are mined.
+    """
+
+    def __init__(self, keeper, conditions=AGREEMENT_CONDITIONS, from_block=0, timeout=TIMEOUT,
+                 poll_interval=1, max_block_range=MAX_BLOCK_RANGE):
+        self.web3 = Web3Provider.get_web3()
+        self.conditions = tuple(conditions)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_block_range = max_block_range
+
+        self._sources, self._event_topics = get_log_sources(keeper, self.conditions)
+
+        self._lock = threading.Lock()
+        # Agreement topic: {condition name: Future}, all the futures and the ones not resolved yet
+        self._watched = dict()
+        self._pending = dict()
+        self._started = dict()
+        self._backfill = dict()
+        self._next_block = from_block
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def in_flight(self):
+        return len(self._watched)
+
+    def watch(self, agreement_id, from_block=None):
+        """Register an agreement and get a Future for each of its conditions
+
+        :param agreement_id: The service agreement ID
+        :param from_block: Block the agreement was created at, earlier blocks than the fetcher
+            cursor are back-filled on the next poll
+        :return: dict of condition name: ConditionFuture resolving to the decoded event
+        """
+        topic = agreement_topic(agreement_id)
+        with self._lock:
+            if topic not in self._watched:
+                self._watched[topic] = {name: ConditionFuture() for name in self.conditions}
+                self._pending[topic] = dict(self._watched[topic])
+                self._started[topic] = time.time()
+                if from_block is not None and from_block < self._next_block:
+                    self._backfill[topic] = from_block
+            return dict(self._watched[topic])
+
+    def seek(self, block_number):
+        """Move the fetcher cursor, i.e. to the chain head to skip the history"""
+        with self._lock:
+            self._next_block = block_number
+
+    def poll_once(self):
+        """Fetch the logs of all watched agreements, up to the current chain head"""
+        head = self.web3.eth.blockNumber
+        with self._lock:
+            backfill, self._backfill = self._backfill, dict()
+            from_block = self._next_block
+        if backfill:
+            self.fetch(min(backfill.values()), from_block - 1, list(backfill))
+        if from_block <= head:
+            self.fetch(from_block, head)
+            with self._lock:
+                self._next_block = head + 1
+        self._expire()
+
+    def fetch(self, from_block, to_block, agreement_topics=None):
+        """One log query per block range for the given (default: all watched) agreements"""
+        if agreement_topics is None:
+            with self._lock:
+                agreement_topics = list(self._watched)
+        if not agreement_topics or to_block < from_block:
+            return 0
+
+        n_logs = 0
+        for start in range(from_block, to_block + 1, self.max_block_range):
+            logs = self.web3.eth.getLogs({
+                'fromBlock': start,
+                'toBlock': min(start + self.max_block_range - 1, to_block),
+                'address': [Web3.toChecksumAddress(address) for address in self._sources],
+                'topics': [self._event_topics, agreement_topics],
+            })
+            for log in logs:
+                self._dispatch(log)
+            n_logs += len(logs)
+        return n_logs
+
+    def _dispatch(self, log):
+        topic = Web3.toHex(log['topics'][1])
+        decoded = decode_log(self._sources, log)
+        # Claim the futures under the lock, so a future is resolved once even if _expire() runs meanwhile
+        resolved = list()
+        with self._lock:
+            pending = self._pending.get(topic)
+            if not pending:
+                return
+            for name, event in decoded:
+                future = pending.pop(name, None)
+                if future is not None:
+                    resolved.append((name, future, event))
+            if not pending:
+                self._release(topic)
+        for name, future, event in resolved:
+            logging.debug("Received event {} for {}".format(name, topic))
+            # Before set_result(), which wakes up the waiters before running the done callbacks
+            future.received = time.time()
+            future.set_result(event)
+
+    def _release(self, topic):
+        """Forget an agreement, with self._lock held"""
+        del self._watched[topic]
+        del self._pending[topic]
+        del self._started[topic]
+
+    def _expire(self):
+        now = time.time()
+        expired = list()
+        with self._lock:
+            for topic in [topic for topic, started in self._started.items() if now - started > self.timeout]:
+                expired.extend(self._pending[topic].items())
+                self._release(topic)
+        for name, future in expired:
+            future.set_exception(TimeoutError("no event for {} after {}s".format(name, self.timeout)))
+
+    def start(self):
+        """Poll in a background thread until stop()"""
+        assert self._thread is None, "Fetcher already started"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='AgreementEventFetcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                logging.error("Event fetcher poll failed: {}".format(e))
+            self._stop.wait(self.poll_interval)
+
+    def wait_for_agreement(self, agreement_id, from_block=None, raise_on_error=True):
+        """Same as util.events.wait_for_agreement, served from the shared log queries
+
+        The fetcher must be started, or polled from another thread.
+        """
+        started = time.time()
+        futures = self.watch(agreement_id, from_block)
+        wait(futures.values())
+        results = dict()
+        for name, future in futures.items():
+            if future.exception():
+                results[name] = ConditionResult(name, started, error=future.exception())
+            else:
+                results[name] = ConditionResult(name, started, event=future.result(), received=future.received)
+
+        if raise_on_error:
+            failed = [name for name, result in results.items() if not result.fulfilled]
+            assert not failed, "Agreement {} conditions not fulfilled: {}".format(agreement_id, failed)
+        return results
@@ -0,0 +1,182 @@
+"""
+Local SQLite index of the agreement events.
+
+An EventIndexer thread ingests the AgreementCreated and condition Fulfilled events of the keeper contracts
+into an EventStore, indexed by agreement ID and block number. Agreement checks are then answered from the
+local store, and only the blocks after the last indexed block (the tail) need to be queried on-chain.
+"""
+import json
+import logging
+import sqlite3
+import threading
+
+from ocean_keeper.web3_provider import Web3Provider
+from web3 import Web3
+
+from util.event_fetcher import MAX_BLOCK_RANGE, agreement_topic, decode_log, get_log_sources
+from util.events import AGREEMENT_CONDITIONS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    agreement_id TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (block_number, log_index, condition)
+);
+CREATE INDEX IF NOT EXISTS events_agreement ON events (agreement_id, condition);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def _to_json(value):
+    if isinstance(value, bytes):
+        return Web3.toHex(value)
+    raise TypeError("Can't serialize {!r}".format(value))
+
+
+class EventStore:
+    """SQLite store of the agreement condition events"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def _get_meta(self, key, default):
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    @property
+    def first_block(self):
+        """The first block indexed, None if nothing was indexed yet"""
+        return self._get_meta('first_block', None)
+
+    @property
+    def last_block(self):
+        """The last block fully indexed, -1 if nothing was indexed yet"""
+        return self._get_meta('last_block', -1)
+
+    def covers(self, from_block):
+        """True if every event from this block up to last_block is in the store"""
+        first_block = self.first_block
+        return first_block is not None and from_block >= first_block
+
+    def add_events(self, events, first_block, last_block):
+        """Insert decoded events, and move the indexed block cursor, in a single transaction
+
+        :param events: iterable of (condition name, decoded web3 event)
+        :param first_block: The first block covered by these events
+        :param last_block: The last block covered by these events
+        """
+        rows = [(agreement_topic(Web3.toHex(event['args']['_agreementId'])), name, event['blockNumber'],
+                 event['logIndex'], Web3.toHex(event['transactionHash']),
+                 json.dumps(dict(event['args']), default=_to_json))
+                for name, event in events]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._connection.execute("INSERT OR IGNORE INTO meta VALUES ('first_block', ?)", (first_block,))
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('last_block', ?)", (last_block,))
+        return len(rows)
+
+    def get_event(self, agreement_id, condition):
+        """The stored event of this agreement condition as a dict, or None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT block_number, log_index, tx_hash, args FROM events "
+                "WHERE agreement_id = ? AND condition = ? ORDER BY block_number LIMIT 1",
+                (agreement_topic(agreement_id), condition)).fetchone()
+        if row is None:
+            return None
+        return {
+            'event': condition,
+            'blockNumber': row[0],
+            'logIndex': row[1],
+            'transactionHash': row[2],
+            'args': json.loads(row[3]),
+        }
+
+    def get_agreement_events(self, agreement_id):
+        """All the stored condition events of an agreement, as a dict of condition name: event"""
+        return {name: event for name, event in
+                ((name, self.get_event(agreement_id, name)) for name in AGREEMENT_CONDITIONS) if event}
+
+    def is_fulfilled(self, agreement_id, condition):
+        return self.get_event(agreement_id, condition) is not None
+
+    def is_access_granted(self, agreement_id, grantee=None):
+        """Local equivalent of ocn.agreements.is_access_granted(), from the AccessSecretStoreCondition event
+
+        :param grantee: Consumer address, also checked against the event if given
+        """
+        event = self.get_event(agreement_id, "access secret store")
+        if event is None:
+            return False
+        return grantee is None or event['args'].get('_grantee', '').lower() == grantee.lower()
+
+
+class EventIndexer:
+    """Background thread ingesting the agreement events of every agreement into an EventStore"""
+
+    def __init__(self, keeper, store, from_block=0, poll_interval=1, max_block_range=MAX_BLOCK_RANGE):
+        self.web3 = Web3Provider.get_web3()
+        self.store = store
+        self.poll_interval = poll_interval
+        self.max_block_range = max_block_range
+        self._sources, self._event_topics = get_log_sources(keeper)
+        self._next_block = max(from_block, store.last_block + 1)
+        self._thread = None
+        self._stop = threading.Event()
+
+    def index_once(self):
+        """Ingest all blocks up to the chain head
+
+        :return: Number of events stored
+        """
+        head = self.web3.eth.blockNumber
+        n_events = 0
+        for start in range(self._next_block, head + 1, self.max_block_range):
+            end = min(start + self.max_block_range - 1, head)
+            logs = self.web3.eth.getLogs({
+                'fromBlock': start,
+                'toBlock': end,
+                'address': [Web3.toChecksumAddress(address) for address in self._sources],
+                'topics': [self._event_topics],
+            })
+            events = [decoded for log in logs for decoded in decode_log(self._sources, log)]
+            n_events += self.store.add_events(events, start, end)
+            self._next_block = end + 1
+        if n_events:
+            logging.debug("Indexed {} agreement events up to block {}".format(n_events, head))
+        return n_events
+
+    def start(self):
+        """Index in a background thread until stop()"""
+        assert self._thread is None, "Indexer already started"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='EventIndexer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.index_once()
+            except Exception as e:
+                logging.error("Event indexer failed: {}".format(e))
+            self._stop.wait(self.poll_interval)
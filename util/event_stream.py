@@ -0,0 +1,109 @@
+"""
+Asyncio interface to the agreement events.
+
+A single BlockWatcher task per event loop watches the chain head, and on each new block runs one batched
+log query (see util.event_fetcher) for every pending agreement. Waiting agreements are plain coroutines,
+so thousands of them fit in one event loop without a thread per wait:
+
+    watcher = start_block_watcher(keeper)
+    async for ev in agreement_events(agreement_id):
+        print(ev.name, ev.event['blockNumber'])
+
+Only eth_blockNumber and eth_getLogs are used, which are supported by parity, ganache and eth-tester.
+"""
+import asyncio
+import logging
+from collections import namedtuple
+
+from util.event_fetcher import AgreementEventFetcher
+from util.events import AGREEMENT_CONDITIONS, TIMEOUT
+
+AgreementEvent = namedtuple('AgreementEvent', ['name', 'agreement_id', 'event', 'received'])
+
+_watchers = dict()
+
+
+class BlockWatcher:
+    """Event loop task which polls the chain head and pushes agreement events to the subscribers"""
+
+    def __init__(self, keeper, conditions=AGREEMENT_CONDITIONS, from_block=None, timeout=TIMEOUT,
+                 poll_interval=1, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.fetcher = AgreementEventFetcher(keeper, conditions, from_block=from_block or 0, timeout=timeout)
+        self.poll_interval = poll_interval
+        self._from_block = from_block
+        self._task = None
+        # Resolved once the fetcher cursor is set, the agreements watched earlier would not be back-filled
+        self._ready = self.loop.create_future()
+
+    def start(self):
+        assert self._task is None, "Block watcher already started"
+        self._task = self.loop.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if _watchers.get(self.loop) is self:
+            del _watchers[self.loop]
+
+    async def _run(self):
+        web3 = self.fetcher.web3
+        if self._from_block is None:
+            # Without a starting block, older agreements are back-filled from the block given to watch()
+            try:
+                self.fetcher.seek(await self.loop.run_in_executor(None, lambda: web3.eth.blockNumber))
+            except Exception as e:
+                self._ready.set_exception(e)
+                raise
+        self._ready.set_result(None)
+        while True:
+            try:
+                # Logs are only queried when the head moved, or to back-fill newly watched agreements
+                await self.loop.run_in_executor(None, self.fetcher.poll_once)
+            except Exception as e:
+                logging.error("Block watcher poll failed: {}".format(e))
+            await asyncio.sleep(self.poll_interval)
+
+    async def agreement_events(self, agreement_id, from_block=None):
+        """Yield an AgreementEvent for each condition, in the order they are fulfilled
+
+        Raises concurrent.futures.TimeoutError if a condition is not fulfilled in time.
+        """
+        await self._ready
+        queue = asyncio.Queue()
+        futures = self.fetcher.watch(agreement_id, from_block)
+        for name, future in futures.items():
+            future.add_done_callback(
+                lambda f, name=name: self.loop.call_soon_threadsafe(queue.put_nowait, (name, f, f.received)))
+
+        for _ in range(len(futures)):
+            name, future, received = await queue.get()
+            yield AgreementEvent(name, agreement_id, future.result(), received)
+
+    async def wait_for_agreement(self, agreement_id, from_block=None):
+        """Collect all the condition events of the agreement, as a dict of name: AgreementEvent"""
+        events = dict()
+        async for ev in self.agreement_events(agreement_id, from_block):
+            events[ev.name] = ev
+        return events
+
+
+def start_block_watcher(keeper, loop=None, **kwargs):
+    """Start the shared block watcher of the event loop, used by agreement_events()"""
+    loop = loop or asyncio.get_event_loop()
+    if loop not in _watchers:
+        _watchers[loop] = BlockWatcher(keeper, loop=loop, **kwargs).start()
+    return _watchers[loop]
+
+
+def agreement_events(agreement_id, from_block=None, loop=None):
+    """Async iterator over the condition events of one agreement, from the shared block watcher"""
+    loop = loop or asyncio.get_event_loop()
+    assert loop in _watchers, "Call start_block_watcher(keeper) first"
+    return _watchers[loop].agreement_events(agreement_id, from_block)
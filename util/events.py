@@ -1,9 +1,39 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+
+from ocean_keeper.web3_provider import Web3Provider
+
+from util import metrics, tracing
 
 TIMEOUT = 20
 
 
-def subscribe_event(event_func_name, keeper, agreement_id):
-    event_map[event_func_name](keeper, agreement_id)
+def subscribe_event(event_func_name, keeper, agreement_id, from_block=0, store=None):
+    """Wait for an agreement event
+
+    :param store: Optional util.event_store.EventStore, the event is answered locally if it was indexed,
+        otherwise only the blocks after the last indexed block are queried
+    """
+    started = time.time()
+    if store is not None:
+        # Before the lookup, an event indexed in between is after this block and found on-chain
+        last_block = store.last_block
+        event = store.get_event(agreement_id, event_func_name)
+        if event:
+            _log_event(event_func_name)(event)
+            return event
+        if store.covers(from_block):
+            from_block = max(from_block, last_block + 1)
+    event = event_map[event_func_name](keeper, agreement_id, from_block)
+    metrics.registry.observe('event_wait_seconds', time.time() - started, phase=event_func_name)
+    return event
+
+
+@lru_cache(maxsize=1024)
+def get_block_timestamp(block_number):
+    return Web3Provider.get_web3().eth.getBlock(block_number)['timestamp']
 
 
 def _log_event(event_name):
@@ -13,52 +43,56 @@ def _log_event(event_name):
     return _process_event
 
 
-def subscribe_agreement_created_event(keeper, agreement_id):
+def subscribe_agreement_created_event(keeper, agreement_id, from_block=0):
     event = keeper.agreement_manager.subscribe_agreement_created(
         agreement_id,
         TIMEOUT,
         _log_event('EscrowAccessSecretStoreTemplate.AgreementCreated'),
         (),
-        from_block=0,
+        from_block=from_block,
         wait=True
     )
     assert event, 'no event for EscrowAccessSecretStoreTemplate.AgreementCreated'
+    return event
 
 
-def subscribe_fulfilled_lock_reward_condition(keeper, agreement_id):
+def subscribe_fulfilled_lock_reward_condition(keeper, agreement_id, from_block=0):
     event = keeper.lock_reward_condition.subscribe_condition_fulfilled(
         agreement_id,
         TIMEOUT,
         _log_event('LockRewardCondition.Fulfilled'),
         (),
-        from_block=0,
+        from_block=from_block,
         wait=True
     )
     assert event, 'no event for LockRewardCondition.Fulfilled'
+    return event
 
 
-def subscribe_fulfilled_access_secret_store_condition(keeper, agreement_id):
+def subscribe_fulfilled_access_secret_store_condition(keeper, agreement_id, from_block=0):
     event = keeper.access_secret_store_condition.subscribe_condition_fulfilled(
         agreement_id,
         TIMEOUT,
         _log_event('AccessSecretStoreCondition.Fulfilled'),
         (),
-        from_block=0,
+        from_block=from_block,
         wait=True
     )
     assert event, 'no event for AccessSecretStoreCondition.Fulfilled'
+    return event
 
 
-def subscribe_fulfilled_escrow_reward(keeper, agreement_id):
+def subscribe_fulfilled_escrow_reward(keeper, agreement_id, from_block=0):
     event = keeper.escrow_reward_condition.subscribe_condition_fulfilled(
         agreement_id,
         TIMEOUT,
         _log_event('EscrowReward.Fulfilled'),
         (),
-        from_block=0,
+        from_block=from_block,
         wait=True
     )
     assert event, 'no event for EscrowReward.Fulfilled'
+    return event
 
 
 event_map = {
@@ -67,3 +101,130 @@ event_map = {
     "access secret store": subscribe_fulfilled_access_secret_store_condition,
     "escrow reward": subscribe_fulfilled_escrow_reward,
 }
+
+AGREEMENT_CONDITIONS = tuple(event_map.keys())
+
+# The keeper contract attribute and event name behind each of the subscriptions above
+event_sources = {
+    "created agreement": ('agreement_manager', 'AgreementCreated'),
+    "lock reward": ('lock_reward_condition', 'Fulfilled'),
+    "access secret store": ('access_secret_store_condition', 'Fulfilled'),
+    "escrow reward": ('escrow_reward_condition', 'Fulfilled'),
+}
+
+
+class ConditionResult:
+    """Outcome of waiting on a single agreement condition"""
+
+    def __init__(self, name, started, event=None, received=None, error=None):
+        self.name = name
+        self.started = started
+        self.event = event
+        self.received = received
+        self.error = error
+
+    @property
+    def block_number(self):
+        """The block the event was mined in"""
+        if self.event is None:
+            return None
+        return self.event['blockNumber']
+
+    @property
+    def block_timestamp(self):
+        """Timestamp of the block the event was mined in, an RPC unless cached"""
+        if self.event is None:
+            return None
+        return get_block_timestamp(self.block_number)
+
+    @property
+    def fulfilled(self):
+        return self.error is None and self.event is not None
+
+    @property
+    def latency(self):
+        """Seconds between the start of the wait and the event being received"""
+        if self.received is None:
+            return None
+        return self.received - self.started
+
+    def __repr__(self):
+        if self.fulfilled:
+            return "<ConditionResult {} after {:0.2f}s>".format(self.name, self.latency)
+        return "<ConditionResult {} failed: {}>".format(self.name, self.error)
+
+
+def _wait_condition(name, keeper, agreement_id, from_block, store, started, parent_span=None):
+    with tracing.tracer.span(name, parent=parent_span, agreement_id=agreement_id, from_block=from_block) as span:
+        try:
+            event = subscribe_event(name, keeper, agreement_id, from_block, store)
+        except Exception as e:
+            span.set_error(e)
+            return ConditionResult(name, started, error=e)
+        span.set_attribute('block', event['blockNumber'])
+    return ConditionResult(name, started, event=event, received=time.time())
+
+
+def wait_for_agreement(keeper, agreement_id, conditions=AGREEMENT_CONDITIONS, from_block=0, store=None,
+                       raise_on_error=True):
+    """Wait on all the agreement conditions at once
+
+    Each condition is subscribed in its own thread, so the call returns as soon as the slowest
+    condition is fulfilled (or times out), rather than after the sum of every wait. Pass the results to
+    record_phase_latencies() once the measured flow is done.
+
+    :param keeper: Keeper instance
+    :param agreement_id: The service agreement ID, as returned from ocn.assets.order()
+    :param conditions: Names of the conditions to wait on, keys of event_map
+    :param from_block: First block to scan for events, i.e. the block the agreement was created in
+    :param store: Optional util.event_store.EventStore to answer from before querying the chain
+    :param raise_on_error: Raise an AssertionError if any condition was not fulfilled
+    :return: dict of condition name: ConditionResult, in the order of `conditions`
+    """
+    for name in conditions:
+        assert name in event_map, "Unknown condition {}, select from {}".format(name, list(event_map))
+
+    started = time.time()
+    # The condition spans are children of the caller's span, although they run in the pool threads
+    parent_span = tracing.tracer.current()
+    with ThreadPoolExecutor(max_workers=len(conditions)) as executor:
+        futures = {name: executor.submit(_wait_condition, name, keeper, agreement_id, from_block, store, started,
+                                         parent_span)
+                   for name in conditions}
+        wait(futures.values())
+    results = {name: futures[name].result() for name in conditions}
+
+    if raise_on_error:
+        failed = [name for name, result in results.items() if not result.fulfilled]
+        assert not failed, "Agreement {} conditions not fulfilled: {}".format(agreement_id, failed)
+    return results
+
+
+def record_phase_latencies(results, ordered_at=None, registry=metrics.registry):
+    """Observe the latency of each agreement phase (order -> created -> lock reward -> access -> escrow)
+
+    Each phase is measured from the previous fulfilled phase, on the wall-clock (time received) and
+    on-chain (block timestamp). The first phase is measured from the order, if its time is given.
+    The block timestamps are fetched here, so call it after the measured flow. Failing to fetch them
+    is logged, and doesn't fail the agreement.
+
+    :param results: dict of condition name: ConditionResult, as returned by wait_for_agreement
+    :param ordered_at: time.time() just before ocn.assets.order() was called
+    """
+    fulfilled = [results[name] for name in AGREEMENT_CONDITIONS if name in results and results[name].fulfilled]
+    previous_wall = ordered_at
+    for result in fulfilled:
+        if previous_wall is not None:
+            registry.observe('agreement_phase_wall_seconds', max(0, result.received - previous_wall),
+                             phase=result.name)
+        previous_wall = result.received
+    if fulfilled and ordered_at is not None:
+        registry.observe('agreement_total_seconds', fulfilled[-1].received - ordered_at)
+
+    try:
+        timestamps = [result.block_timestamp for result in fulfilled]
+    except Exception as e:
+        logging.warning("No block timestamps for the agreement phases: {}".format(e))
+        return
+    for result, previous, timestamp in zip(fulfilled[1:], timestamps, timestamps[1:]):
+        registry.observe('agreement_phase_block_seconds', timestamp - previous, phase=result.name)
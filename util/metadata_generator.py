@@ -0,0 +1,144 @@
+"""
+Synthetic asset metadata for catalog-scale benchmarks.
+
+MetadataGenerator reads the metadata template once (util.misc.load_metadata_template) and streams new
+OEP-8 dataset metadata documents, with the names, tags, categories, prices, number of files and file sizes
+drawn from configurable distributions. Each distribution is a function of a random.Random instance, so a
+seeded generator always produces the same catalog:
+
+    generator = MetadataGenerator(seed=42, price=lambda rng: str(rng.choice([0, 1, 10])))
+    for metadata in itertools.islice(generator, 1000000):
+        ...
+
+    python -m util.metadata_generator 1000 > catalog.jsonl
+"""
+import datetime
+import itertools
+import random
+
+from util.misc import load_metadata_template
+
+ADJECTIVES = ('Daily', 'Hourly', 'Annual', 'Regional', 'Global', 'Urban', 'Historical', 'Realtime', 'Aggregated',
+              'Raw', 'Cleaned', 'Sampled', 'Synthetic', 'Monthly', 'Weekly', 'Open')
+SUBJECTS = ('weather', 'traffic', 'energy', 'rental car', 'air quality', 'retail sales', 'shipping', 'genome',
+            'satellite image', 'sensor', 'stock price', 'mobility', 'crop yield', 'housing', 'health', 'sports')
+KINDS = ('measurements', 'records', 'transactions', 'observations', 'time series', 'logs', 'statistics', 'survey')
+TAGS = ('csv', 'json', 'time-series', 'geospatial', 'machine-learning', 'open-data', 'iot', 'finance',
+        'transportation', 'climate', 'images', 'text', 'labelled', 'research', 'public', 'benchmark')
+CATEGORIES = ('Transportation', 'Energy', 'Finance', 'Health', 'Agriculture', 'Environment', 'Economy',
+              'Science', 'Sports', 'Technology')
+LICENSES = ('CC0: Public Domain Dedication', 'CC-BY', 'CC-BY-SA', 'ODbL', 'MIT')
+AUTHORS = ('Mark', 'Met Office', 'Ocean Protocol', 'Open Data Institute', 'City Council', 'Research Lab')
+CONTENT_TYPES = (('text/csv', 'csv', 'plain'), ('application/json', 'json', 'plain'),
+                 ('application/zip', 'zip', 'zip'), ('text/plain', 'txt', 'plain'))
+
+
+def _default_files(rng):
+    return min(1 + int(rng.expovariate(1.0)), 10)
+
+
+def _default_file_size(rng):
+    # Log-normal around ~500kB, from a few kB to a few GB
+    return max(1024, int(rng.lognormvariate(13, 2)))
+
+
+def _default_price(rng):
+    return '0' if rng.random() < 0.5 else str(rng.randint(1, 100))
+
+
+def _default_tags(rng):
+    return rng.sample(TAGS, rng.randint(1, 4))
+
+
+class MetadataGenerator:
+    """Infinite iterator of varied OEP-8 dataset metadata, built on the metadata template"""
+
+    def __init__(self, template=None, seed=None, n_files=_default_files, file_size=_default_file_size,
+                 price=_default_price, tags=_default_tags, url_base='https://example.com/data',
+                 date_start=datetime.datetime(2015, 1, 1), date_range_days=5 * 365):
+        """
+        :param template: Metadata dict, by default the sample metadata of util.misc
+        :param seed: Seed of the random distributions
+        :param n_files: function(rng) returning the number of files of an asset
+        :param file_size: function(rng) returning a file contentLength in bytes
+        :param price: function(rng) returning the price, as a string
+        :param tags: function(rng) returning the list of tags
+        :param url_base: The file URLs are url_base/<asset number>/<file index>.<extension>
+        :param date_start: dateCreated is drawn uniformly from date_start to date_start + date_range_days
+        """
+        template = template or load_metadata_template()
+        self._main = {k: v for k, v in template['main'].items() if k not in ('files', 'datePublished')}
+        self._additional = dict(template.get('additionalInformation', {}))
+        self._rng = random.Random(seed)
+        self.n_files = n_files
+        self.file_size = file_size
+        self.price = price
+        self.tags = tags
+        self.url_base = url_base.rstrip('/')
+        self.date_start = date_start
+        self.date_range_seconds = int(date_range_days * 86400)
+        self._counter = itertools.count()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.generate()
+
+    def generate(self):
+        """One new metadata document"""
+        rng = self._rng
+        number = next(self._counter)
+        subject = rng.choice(SUBJECTS)
+        name = "{} {} {} #{}".format(rng.choice(ADJECTIVES), subject, rng.choice(KINDS), number)
+        date_created = self.date_start + datetime.timedelta(seconds=rng.randrange(self.date_range_seconds))
+
+        files = list()
+        for index in range(self.n_files(rng)):
+            content_type, extension, compression = rng.choice(CONTENT_TYPES)
+            files.append({
+                'index': index,
+                'contentType': content_type,
+                'contentLength': str(self.file_size(rng)),
+                'compression': compression,
+                'url': '{}/{}/{}.{}'.format(self.url_base, number, index, extension),
+            })
+
+        main = dict(self._main)
+        main.update({
+            'type': 'dataset',
+            'name': name,
+            'dateCreated': date_created.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'author': rng.choice(AUTHORS),
+            'license': rng.choice(LICENSES),
+            'price': self.price(rng),
+            'files': files,
+        })
+        additional = dict(self._additional)
+        additional.update({
+            'description': "{} of {} data, {} file(s).".format(name, subject, len(files)),
+            'tags': self.tags(rng),
+            'categories': [rng.choice(CATEGORIES)],
+        })
+        return {'main': main, 'additionalInformation': additional}
+
+
+def assert_valid_metadata(metadata):
+    """Check the attributes required by OEP-8 for a dataset"""
+    main = metadata['main']
+    for key in ('name', 'type', 'dateCreated', 'author', 'license', 'price', 'files'):
+        assert key in main, "Metadata is missing main.{}".format(key)
+    assert isinstance(main['price'], str), "main.price must be a string"
+    assert main['files'], "Metadata needs at least one file"
+    for index, file in enumerate(main['files']):
+        assert file['index'] == index, "File indexes must be 0..n-1"
+        assert file['url'] and file['contentType'], "Files need a url and a contentType"
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for metadata in itertools.islice(MetadataGenerator(seed=int(sys.argv[2]) if len(sys.argv) > 2 else None), n):
+        sys.stdout.write(json.dumps(metadata) + '\n')
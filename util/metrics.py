@@ -0,0 +1,293 @@
+"""
+In-process latency histograms, counters and gauges.
+
+Histograms are registered by name and labels (i.e. the agreement phase) in a HistogramRegistry, and can be
+queried from code, or dumped to JSON or CSV. The module level `registry` is used by util.events.
+serve() exposes the registry over HTTP in the Prometheus text format, to watch a soak test live.
+"""
+import bisect
+import csv
+import json
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler
+
+from util.misc import ThreadingHTTPServer
+
+# Upper bounds in seconds, chosen around the block time and the 20s event TIMEOUT
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 7.5, 10, 15, 20, 30, 60, 120, math.inf)
+
+
+class Histogram:
+    """Bucketed histogram, with count, sum, min and max"""
+
+    def __init__(self, name, labels=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = dict(labels or {})
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0 < q < 1) by linear interpolation within the buckets"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, self.counts):
+            if count and cumulative + count >= rank:
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = upper
+        return self.max
+
+    def merge(self, other):
+        assert self.buckets == other.buckets, "Can't merge histograms with different buckets"
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+            self.count += other.count
+            self.sum += other.sum
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'labels': self.labels,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'buckets': [[str(upper), count] for upper, count in zip(self.buckets, self.counts)],
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        histogram = cls(values['name'], values['labels'], [float(upper) for upper, _ in values['buckets']])
+        histogram.counts = [count for _, count in values['buckets']]
+        histogram.count = values['count']
+        histogram.sum = values['sum']
+        if values['count']:
+            histogram.min = values['min']
+            histogram.max = values['max']
+        return histogram
+
+
+def _format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class HistogramRegistry:
+    """Histograms, counters and gauges by name and labels"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = dict()
+        self._counters = dict()
+        self._gauges = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def histogram(self, name, **labels):
+        """Get or create the histogram"""
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(name, labels, self.buckets)
+            return self._histograms[key]
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def get(self, name, **labels):
+        return self._histograms.get(self._key(name, labels))
+
+    def histograms(self, name=None):
+        with self._lock:
+            histograms = list(self._histograms.values())
+        return [h for h in histograms if name is None or h.name == name]
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def add_gauge(self, name, value, **labels):
+        """Add to a gauge, i.e. +1 when a flow starts and -1 when it finishes"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def counters(self):
+        """List of (name, labels, value)"""
+        with self._lock:
+            return [(name, dict(labels), value) for (name, labels), value in self._counters.items()]
+
+    def gauges(self):
+        """List of (name, labels, value)"""
+        with self._lock:
+            return [(name, dict(labels), value) for (name, labels), value in self._gauges.items()]
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def merge(self, other):
+        """Add the observations of another registry, i.e. loaded from the JSON of another run"""
+        for other_histogram in other.histograms():
+            self.histogram(other_histogram.name, **other_histogram.labels).merge(other_histogram)
+
+    def summary(self, quantiles=(0.5, 0.95, 0.99)):
+        """One dict per histogram with count, mean, min, max and the quantiles"""
+        rows = list()
+        for histogram in self.histograms():
+            row = {'name': histogram.name}
+            row.update(histogram.labels)
+            row.update({'count': histogram.count, 'mean': histogram.mean,
+                        'min': histogram.min if histogram.count else None,
+                        'max': histogram.max if histogram.count else None})
+            row.update({'p{:g}'.format(q * 100): histogram.quantile(q) for q in quantiles})
+            rows.append(row)
+        return rows
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump([histogram.to_dict() for histogram in self.histograms()], f, indent=2)
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path) as f:
+            values = json.load(f)
+        registry = cls()
+        for histogram_values in values:
+            histogram = Histogram.from_dict(histogram_values)
+            registry._histograms[cls._key(histogram.name, histogram.labels)] = histogram
+        return registry
+
+    def to_csv(self, path):
+        rows = self.summary()
+        fieldnames = list()
+        for row in rows:
+            fieldnames.extend(k for k in row if k not in fieldnames)
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def to_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = list()
+        for kind, values in (('counter', self.counters()), ('gauge', self.gauges())):
+            for name in sorted(set(name for name, _, _ in values)):
+                lines.append('# TYPE {} {}'.format(name, kind))
+                lines.extend('{}{} {}'.format(name, _format_labels(labels), _format_value(value))
+                             for metric_name, labels, value in values if metric_name == name)
+
+        histograms = self.histograms()
+        for name in sorted(set(histogram.name for histogram in histograms)):
+            lines.append('# TYPE {} histogram'.format(name))
+            for histogram in histograms:
+                if histogram.name != name:
+                    continue
+                with histogram._lock:
+                    counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+                cumulative = 0
+                for upper, bucket_count in zip(histogram.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _format_labels(histogram.labels, le=_format_value(upper)), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _format_labels(histogram.labels), _format_value(total)))
+                lines.append('{}_count{} {}'.format(name, _format_labels(histogram.labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+registry = HistogramRegistry()
+
+
+def serve(port, host='', registry=registry):
+    """Serve the registry in the Prometheus text format at http://host:port/metrics, from a daemon thread
+
+    :return: The HTTP server, stop it with .shutdown()
+    """
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info("Serving metrics on http://{}:{}/metrics".format(host or '0.0.0.0', server.server_address[1]))
+    return server
+
+
+def rpc_counter_middleware(make_request, web3, registry=registry):
+    """web3 middleware counting the JSON-RPC requests by method, and the failed ones"""
+    def middleware(method, params):
+        registry.inc('rpc_requests_total', method=method)
+        response = make_request(method, params)
+        if 'error' in response:
+            registry.inc('rpc_errors_total', method=method)
+        return response
+    return middleware
+
+
+def install_rpc_counter(web3):
+    """Add rpc_counter_middleware to the middlewares of a web3 instance, once"""
+    middlewares = getattr(web3, 'middleware_onion', None) or web3.middleware_stack
+    try:
+        middlewares.add(rpc_counter_middleware, 'rpc_counter')
+    except ValueError:
+        pass
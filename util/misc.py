@@ -1,13 +1,81 @@
+import copy
+import fcntl
 import json
+import os
+import socketserver
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import HTTPServer
+from pathlib import Path
 
-from ocean_utils.utils.utilities import get_timestamp
+METADATA_TEMPLATE_PATH = 'assets/sample_metadata.json'
 
 
-def get_metadata_example():
-    metadata_path = 'assets/sample_metadata.json'
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which is Python 3.7+ while the images run 3.6"""
+    daemon_threads = True
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """Open a temporary file next to `path`, which replaces `path` when the block exits without error
+
+    Readers, including other processes, see either the previous or the new complete file:
+
+        with atomic_write(path) as f:
+            json.dump(data, f)
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=path.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on `<path>.lock`, shared with the other processes locking the same path
+
+        with file_lock(path):
+            data = read(path)
+            ...
+            with atomic_write(path) as f:
+                json.dump(data, f)
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(str(path) + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+@lru_cache(maxsize=None)
+def load_metadata_template(metadata_path=METADATA_TEMPLATE_PATH):
+    """The parsed metadata template, read once per process. Don't modify it, copy it"""
     with open(metadata_path) as f:
-        metadata = json.load(f)
+        return json.load(f)
+
+
+def get_metadata_example():
+    # Imported here, so the file helpers of this module don't need ocean_utils
+    from ocean_utils.utils.utilities import get_timestamp
+
+    metadata = copy.deepcopy(load_metadata_template())
 
     metadata['main']['dateCreated'] = get_timestamp()
     return metadata
 
+
+def get_algorithm_example():
+    algorithm_path = 'assets/sample_algorithm.py'
+    with open(algorithm_path) as f:
+        algorithm_text = f.read()
+
+    return algorithm_text
@@ -0,0 +1,375 @@
+"""
+Client-side nonce management, to pipeline the transactions of one account.
+
+Transactions are signed locally with nonces assigned by the NonceManager, and sent without waiting for the
+previous one to be mined, up to `max_outstanding` per account. A background thread follows the receipts:
+a transaction which is neither mined nor replaced after `resend_after` seconds is considered dropped and sent
+again with the same nonce and a higher gas price, one whose nonce was used by another transaction is failed
+with TransactionReplaced, and one still not mined after `timeout` seconds with a TimeoutError. A nonce whose
+send failed, or whose transaction the node dropped, after later nonces were reserved would hold the later
+transactions in the node's future queue, so it's filled with a 0 value transfer to self.
+
+Contract calls made directly go through transact():
+
+    manager = NonceManager().start()
+    signer = signer_from_key_file(os.environ['PARITY_KEY_FILE'], os.environ['PARITY_PASSWORD'])
+    pending = [manager.transact(signer, fn) for fn in contract_functions]
+    receipts = [p.result() for p in pending]
+
+squid-py sends its transactions through the ocean_keeper contract wrappers, routed() hands those of one
+account to the manager, so concurrent ocn.assets.create() calls of a publisher don't race on its nonce:
+
+    with manager.routed(keeper.did_registry, signer):
+        ddos = list(executor.map(lambda metadata: ocn.assets.create(metadata, publisher_account), metadatas))
+"""
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+from ocean_keeper.web3_provider import Web3Provider
+
+# The account sending the transactions, with its private key to sign them
+Signer = namedtuple('Signer', ('address', 'private_key'))
+
+# Errors of sendRawTransaction (geth and parity wording) meaning the nonce was already used
+NONCE_USED_ERRORS = ('nonce too low', 'nonce is too low', 'already known', 'already imported')
+
+
+class TransactionReplaced(Exception):
+    """Another transaction with the same nonce was mined"""
+
+
+def signer_from_key_file(key_file, password):
+    web3 = Web3Provider.get_web3()
+    with open(key_file) as f:
+        encrypted_key = json.load(f)
+    return Signer(web3.toChecksumAddress(encrypted_key['address']),
+                  web3.eth.account.decrypt(encrypted_key, password))
+
+
+def signer_from_manifest(entry):
+    """The Signer of a util.provision manifest entry"""
+    web3 = Web3Provider.get_web3()
+    return Signer(entry['address'], web3.eth.account.decrypt(json.loads(entry['encrypted_key']), entry['password']))
+
+
+class PendingTransaction:
+    """A sent transaction, and every hash it was sent as"""
+
+    def __init__(self, signer, transaction):
+        self.signer = signer
+        self.transaction = transaction
+        self.tx_hashes = list()
+        self.first_sent = None
+        self.last_sent = None
+        self.future = Future()
+
+    @property
+    def nonce(self):
+        return self.transaction['nonce']
+
+    def result(self, timeout=None):
+        """Wait for the receipt"""
+        return self.future.result(timeout)
+
+    def __repr__(self):
+        return "<PendingTransaction {} nonce {}, sent {} times>".format(
+            self.signer.address, self.nonce, len(self.tx_hashes))
+
+
+class NonceManager:
+    """Assign nonces locally, and follow the outstanding transactions of each account"""
+
+    def __init__(self, web3=None, max_outstanding=16, timeout=300, resend_after=60, gas_price_bump=1.125,
+                 poll_interval=1):
+        """
+        :param max_outstanding: Maximum number of unmined transactions per account, send() blocks beyond
+        :param timeout: Seconds after which a transaction which isn't mined is failed with a TimeoutError
+        :param resend_after: Seconds after which an unmined transaction is sent again, with a higher gas price
+        :param gas_price_bump: Gas price multiplier of a resend, nodes reject replacements below ~10%
+        """
+        self.web3 = web3 or Web3Provider.get_web3()
+        self.max_outstanding = max_outstanding
+        self.timeout = timeout
+        self.resend_after = resend_after
+        self.gas_price_bump = gas_price_bump
+        self.poll_interval = poll_interval
+        self._nonces = dict()
+        self._pending = dict()
+        # Nonces handed out by _reserve() and not sent yet, per account
+        self._reserved = dict()
+        # Nonces of failed sends to hand out again, when filling the gap they left failed as well
+        self._free = dict()
+        self._slots = dict()
+        self._account_locks = dict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _account_slots(self, address):
+        with self._lock:
+            if address not in self._slots:
+                self._slots[address] = threading.BoundedSemaphore(self.max_outstanding)
+                self._pending[address] = dict()
+                self._reserved[address] = set()
+                self._free[address] = set()
+                self._account_locks[address] = threading.RLock()
+            return self._slots[address]
+
+    def sync(self, address):
+        """Reset the next nonce of the account from the node, i.e. after a transaction sent outside the manager"""
+        self._account_slots(address)
+        with self._account_locks[address]:
+            chain_nonce = self.web3.eth.getTransactionCount(address, 'pending')
+            with self._lock:
+                in_use = list(self._pending[address]) + list(self._reserved[address])
+                self._nonces[address] = max([chain_nonce] + [nonce + 1 for nonce in in_use])
+                self._free[address] = {nonce for nonce in self._free[address] if nonce >= chain_nonce}
+                return self._nonces[address]
+
+    def _reserve(self, address):
+        # The first reservations of an account are serialized, so they don't each sync() and get the same nonce
+        with self._account_locks[address]:
+            if address not in self._nonces:
+                self.sync(address)
+            with self._lock:
+                if self._free[address]:
+                    nonce = min(self._free[address])
+                    self._free[address].remove(nonce)
+                else:
+                    nonce = self._nonces[address]
+                    self._nonces[address] += 1
+                self._reserved[address].add(nonce)
+                return nonce
+
+    def _release(self, address, nonce):
+        """Give back a nonce which was never sent
+
+        :return: True if it was the last nonce reserved, False if later nonces are in use and it left a gap
+        """
+        with self._lock:
+            self._reserved[address].discard(nonce)
+            if self._nonces.get(address) == nonce + 1:
+                self._nonces[address] = nonce
+                return True
+            return False
+
+    def _fill_gap(self, signer, nonce, gas_price, chain_id=None):
+        """Send a 0 value transfer to self with a nonce whose transaction failed, to unblock the later ones
+
+        Takes over the slot of the failed transaction.
+        """
+        transaction = {'to': signer.address, 'value': 0, 'gas': 21000, 'gasPrice': gas_price, 'nonce': nonce}
+        if chain_id is not None:
+            transaction['chainId'] = chain_id
+        pending = PendingTransaction(signer, transaction)
+        try:
+            self._send_raw(pending)
+        except Exception as e:
+            logging.warning("Filling the nonce {} of {} failed ({}), it goes to the next transaction".format(
+                nonce, signer.address, e))
+            with self._lock:
+                self._free[signer.address].add(nonce)
+            self._slots[signer.address].release()
+            return None
+        logging.info("Filled the nonce {} of {} with a transfer to self".format(nonce, signer.address))
+        with self._lock:
+            self._pending[signer.address][nonce] = pending
+        return pending
+
+    def _send_failed(self, signer, transaction):
+        """Release the nonce and the slot of a transaction whose send failed"""
+        if self._release(signer.address, transaction['nonce']):
+            self._slots[signer.address].release()
+        else:
+            self._fill_gap(signer, transaction['nonce'], transaction['gasPrice'], transaction.get('chainId'))
+
+    def _send_raw(self, pending):
+        signed = self.web3.eth.account.signTransaction(pending.transaction, pending.signer.private_key)
+        tx_hash = self.web3.eth.sendRawTransaction(signed.rawTransaction)
+        pending.tx_hashes.append(tx_hash)
+        pending.last_sent = time.time()
+        pending.first_sent = pending.first_sent or pending.last_sent
+        return tx_hash
+
+    def send(self, signer, transaction):
+        """Sign and send a transaction with the next nonce of the account, without waiting for it to be mined
+
+        :param transaction: dict of to, data, value, gas and optionally gasPrice, without nonce
+        :return: PendingTransaction, its result() is the receipt
+        """
+        slots = self._account_slots(signer.address)
+        slots.acquire()
+        transaction = dict(transaction)
+        transaction.setdefault('gasPrice', self.web3.eth.gasPrice)
+        for attempt in range(2):
+            transaction['nonce'] = self._reserve(signer.address)
+            pending = PendingTransaction(signer, transaction)
+            try:
+                self._send_raw(pending)
+            except ValueError as e:
+                if any(error in str(e).lower() for error in NONCE_USED_ERRORS):
+                    # Used outside the manager, there is no gap to fill
+                    with self._lock:
+                        self._reserved[signer.address].discard(transaction['nonce'])
+                    if attempt == 0:
+                        logging.info("Nonce {} of {} already used, resyncing".format(
+                            transaction['nonce'], signer.address))
+                        self.sync(signer.address)
+                        continue
+                    slots.release()
+                    raise
+                self._send_failed(signer, transaction)
+                raise
+            except Exception:
+                self._send_failed(signer, transaction)
+                raise
+            break
+        with self._lock:
+            self._reserved[signer.address].discard(pending.nonce)
+            self._pending[signer.address][pending.nonce] = pending
+        return pending
+
+    def transact(self, signer, contract_function, gas=None, value=0):
+        """Send a contract function call, i.e. keeper.did_registry.contract.functions.registerAttribute(...)
+
+        :param gas: Gas limit, estimated by the node if None
+        :return: PendingTransaction
+        """
+        transaction = {'from': signer.address, 'value': value}
+        if gas:
+            transaction['gas'] = gas
+        transaction = contract_function.buildTransaction(transaction)
+        transaction.pop('from', None)
+        return self.send(signer, transaction)
+
+    @contextmanager
+    def routed(self, contract, signer):
+        """Send the transactions of the signer made through an ocean_keeper contract wrapper with the manager
+
+        The wrapper's send_transaction() returns the hash without waiting, the caller waits for the receipt
+        as before. Transactions from other accounts are sent by the wrapper itself.
+
+        :param contract: ocean_keeper ContractBase, i.e. keeper.did_registry
+        """
+        send_transaction = contract.send_transaction
+
+        def _send_transaction(fn_name, fn_args, transact=None):
+            if not transact or transact.get('from', '').lower() != signer.address.lower():
+                return send_transaction(fn_name, fn_args, transact)
+            contract_function = getattr(contract.contract.functions, fn_name)(*fn_args)
+            return self.transact(signer, contract_function, gas=transact.get('gas')).tx_hashes[0]
+
+        contract.send_transaction = _send_transaction
+        try:
+            yield contract
+        finally:
+            del contract.send_transaction
+
+    def outstanding(self, address=None):
+        """Number of unmined transactions, of one account or of all"""
+        with self._lock:
+            if address:
+                return len(self._pending.get(address, {}))
+            return sum(len(pending) for pending in self._pending.values())
+
+    def _receipt(self, pending):
+        for tx_hash in pending.tx_hashes:
+            receipt = self.web3.eth.getTransactionReceipt(tx_hash)
+            if receipt:
+                return receipt
+        return None
+
+    def _finish(self, pending, receipt=None, error=None):
+        with self._lock:
+            self._pending[pending.signer.address].pop(pending.nonce, None)
+        self._slots[pending.signer.address].release()
+        if error:
+            pending.future.set_exception(error)
+        else:
+            pending.future.set_result(receipt)
+
+    def poll_once(self):
+        """Check the outstanding transactions for receipts, replacements, drops and timeouts"""
+        with self._lock:
+            accounts = {address: sorted(pending.values(), key=lambda p: p.nonce)
+                        for address, pending in self._pending.items() if pending}
+        for address, pendings in accounts.items():
+            mined_nonce = None
+            for pending in pendings:
+                receipt = self._receipt(pending)
+                if receipt:
+                    self._finish(pending, receipt)
+                    continue
+                if mined_nonce is None:
+                    mined_nonce = self.web3.eth.getTransactionCount(address)
+                if mined_nonce > pending.nonce:
+                    # The nonce is used, check again in case one of our hashes was mined meanwhile
+                    receipt = self._receipt(pending)
+                    if receipt:
+                        self._finish(pending, receipt)
+                    else:
+                        self._finish(pending, error=TransactionReplaced(
+                            "Nonce {} of {} was used by another transaction".format(pending.nonce, address)))
+                    continue
+                now = time.time()
+                if now - pending.first_sent > self.timeout:
+                    self._timed_out(pending)
+                elif now - pending.last_sent > self.resend_after:
+                    self._resend(pending)
+
+    def _timed_out(self, pending):
+        """Fail a transaction which wasn't mined in time, and hand its nonce over if the node dropped it
+
+        The node's pending nonce counts the mined and the pooled transactions without gap, if it isn't past
+        the transaction's nonce the transaction is gone: the nonce goes to the next send if it was the last
+        one, or is filled so the later transactions aren't held in the future queue.
+        """
+        address = pending.signer.address
+        with self._lock:
+            self._pending[address].pop(pending.nonce, None)
+        pending.future.set_exception(TimeoutError(
+            "Nonce {} of {} not mined after {}s".format(pending.nonce, address, self.timeout)))
+        if self.web3.eth.getTransactionCount(address, 'pending') > pending.nonce:
+            self._slots[address].release()
+        elif self._release(address, pending.nonce):
+            self._slots[address].release()
+        else:
+            self._fill_gap(pending.signer, pending.nonce,
+                           int(pending.transaction['gasPrice'] * self.gas_price_bump) + 1,
+                           pending.transaction.get('chainId'))
+
+    def _resend(self, pending):
+        """Send the transaction again with the same nonce, dropped by the node or stuck at a low gas price"""
+        pending.transaction['gasPrice'] = int(pending.transaction['gasPrice'] * self.gas_price_bump) + 1
+        try:
+            tx_hash = self._send_raw(pending)
+            logging.info("Resent nonce {} of {} as {}".format(pending.nonce, pending.signer.address, tx_hash.hex()))
+        except ValueError as e:
+            # i.e. the previous hash was mined in between, the next poll finds its receipt
+            pending.last_sent = time.time()
+            logging.warning("Resend of nonce {} of {} failed: {}".format(pending.nonce, pending.signer.address, e))
+
+    def start(self):
+        """Follow the outstanding transactions in a background thread"""
+        assert self._thread is None, "Nonce manager already started"
+        self._thread = threading.Thread(target=self._run, name='nonce-manager', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll_once()
+            except Exception as e:
+                logging.error("Nonce manager poll failed: {}".format(e))
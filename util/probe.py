@@ -0,0 +1,229 @@
+"""
+Concurrent health and latency probes of the Ocean component endpoints.
+
+All the endpoints are checked at once, each over its own keep-alive connection and with its own timeout, so a
+hung endpoint only delays its own result. Each probe times the connection (TCP and TLS, zero when the
+connection is reused), the time to the first byte of the response and the total time.
+
+Use EndpointProber.wait_ready() as a readiness gate before a load test, and start() to record the latencies
+to the metrics registry (and optionally a JSON lines file) during the test:
+
+    python -m util.probe                # check once the endpoints of util.config.get_deployment_config()
+    python -m util.probe 10 probes.jsonl  # probe every 10s, and append the results to probes.jsonl
+"""
+import http.client
+import json
+import logging
+import ssl
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from util import metrics
+
+DEFAULT_TIMEOUT = 5
+
+# Errors of a reused keep-alive connection which the server closed while idle, retried on a new connection
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+ProbeResult = namedtuple('ProbeResult', ('name', 'url', 'timestamp', 'ok', 'status', 'connect', 'ttfb', 'total',
+                                         'error', 'software', 'version'))
+
+
+class _Endpoint:
+    """One URL, with its persistent connection"""
+
+    def __init__(self, name, url, timeout):
+        self.name = name
+        self.url = url
+        self.timeout = timeout
+        parsed = urlparse(url)
+        self.https = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = (parsed.path or '/') + ('?' + parsed.query if parsed.query else '')
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _new_connection(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                               context=ssl.create_default_context())
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def _request(self, started):
+        """GET the path, over the open connection if any
+
+        :return: (connect, ttfb, total, response, body)
+        """
+        if self.connection is None or self.connection.sock is None:
+            self.connection = self._new_connection()
+            self.connection.connect()
+            connect = time.time() - started
+        else:
+            connect = 0.0
+        self.connection.request('GET', self.path, headers={'Connection': 'keep-alive'})
+        response = self.connection.getresponse()
+        ttfb = time.time() - started
+        body = response.read()
+        total = time.time() - started
+        if response.will_close:
+            self.close()
+        return connect, ttfb, total, response, body
+
+    def probe(self):
+        with self.lock:
+            started = time.time()
+            connect = ttfb = total = status = software = version = None
+            try:
+                reused = self.connection is not None and self.connection.sock is not None
+                try:
+                    connect, ttfb, total, response, body = self._request(started)
+                except STALE_CONNECTION_ERRORS:
+                    if not reused:
+                        raise
+                    # The server closed the idle connection, not a failure of the component
+                    self.close()
+                    started = time.time()
+                    connect, ttfb, total, response, body = self._request(started)
+                status = response.status
+                if response.getheader('Content-Type', '').startswith('application/json'):
+                    try:
+                        about = json.loads(body)
+                        software, version = about.get('software'), about.get('version')
+                    except (ValueError, AttributeError):
+                        pass
+            except Exception as e:
+                self.close()
+                return ProbeResult(self.name, self.url, started, False, status, connect, ttfb, total,
+                                   "{}: {}".format(type(e).__name__, e), None, None)
+            # Any answer means the component is up, i.e. the Ethereum node answers GET with an error status
+            return ProbeResult(self.name, self.url, started, status < 500, status, connect, ttfb, total,
+                               None, software, version)
+
+
+class EndpointProber:
+    """Probe a set of endpoints concurrently, once or continuously"""
+
+    def __init__(self, endpoints, timeout=DEFAULT_TIMEOUT, timeouts=None, registry=metrics.registry):
+        """
+        :param endpoints: dict of name: URL, i.e. util.config.get_deployment_config().endpoints
+        :param timeout: Default connect and read timeout in seconds
+        :param timeouts: dict of name: timeout, for the endpoints needing another timeout
+        """
+        timeouts = timeouts or dict()
+        self.endpoints = {name: _Endpoint(name, url, timeouts.get(name, timeout)) for name, url in endpoints.items()}
+        self.registry = registry
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self.endpoints), 1))
+        self._stop = threading.Event()
+        self._thread = None
+        self._results_file = None
+
+    def probe_all(self):
+        """Probe every endpoint at once
+
+        :return: dict of name: ProbeResult
+        """
+        futures = {name: self._executor.submit(endpoint.probe) for name, endpoint in self.endpoints.items()}
+        results = {name: future.result() for name, future in futures.items()}
+        for result in results.values():
+            self._record(result)
+        return results
+
+    def _record(self, result):
+        if result.ok:
+            self.registry.observe('endpoint_connect_seconds', result.connect, endpoint=result.name)
+            self.registry.observe('endpoint_ttfb_seconds', result.ttfb, endpoint=result.name)
+            self.registry.observe('endpoint_total_seconds', result.total, endpoint=result.name)
+        else:
+            self.registry.inc('endpoint_probe_failures_total', endpoint=result.name)
+        if self._results_file:
+            self._results_file.write(json.dumps(result._asdict()) + '\n')
+
+    def wait_ready(self, timeout=300, interval=5):
+        """Probe until every endpoint answers
+
+        :return: True when all are up, False on timeout
+        """
+        deadline = time.time() + timeout
+        while True:
+            results = self.probe_all()
+            down = [name for name, result in results.items() if not result.ok]
+            if not down:
+                return True
+            if time.time() + interval > deadline:
+                logging.error("Endpoints not ready after {}s: {}".format(timeout, ', '.join(down)))
+                return False
+            logging.info("Waiting for {}".format(', '.join(down)))
+            time.sleep(interval)
+
+    def start(self, interval=10, results_path=None):
+        """Probe every `interval` seconds in a background thread, recording the latencies
+
+        :param results_path: Optional JSON lines file to append every ProbeResult to
+        """
+        assert self._thread is None, "Prober already started"
+        if results_path:
+            self._results_file = open(str(results_path), 'a', buffering=1)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='endpoint-prober', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._results_file:
+            self._results_file.close()
+            self._results_file = None
+
+    def close(self):
+        self.stop()
+        self._executor.shutdown()
+        for endpoint in self.endpoints.values():
+            endpoint.close()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.probe_all()
+            except Exception as e:
+                logging.error("Probe failed: {}".format(e))
+            self._stop.wait(max(0, interval - (time.time() - started)))
+
+
+def format_result(result):
+    if not result.ok:
+        return "{:>14} Failed! {}".format(result.name, result.error or "status {}".format(result.status))
+    about = " {} v{}".format(result.software, result.version) if result.software and result.version else ""
+    return "{:>14} Success{} (status {}, connect {:0.3f}s, TTFB {:0.3f}s, total {:0.3f}s)".format(
+        result.name, about, result.status, result.connect, result.ttfb, result.total)
+
+
+if __name__ == '__main__':
+    import sys
+    from util.config import get_deployment_config
+
+    prober = EndpointProber(get_deployment_config().endpoints)
+    if len(sys.argv) == 1:
+        results = prober.probe_all()
+        for result in results.values():
+            print(format_result(result))
+        sys.exit(0 if all(result.ok for result in results.values()) else 1)
+    prober.start(float(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else None)
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(prober.registry.summary()))
+    except KeyboardInterrupt:
+        prober.close()
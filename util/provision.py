@@ -0,0 +1,148 @@
+"""
+Bulk provisioning of funded test accounts.
+
+New accounts are created locally, funded with ETH from the faucet and with OCEAN from the token dispenser,
+with bounded parallelism. Each step waits on the transaction receipt (or the balance) rather than sleeping
+for a fixed time. The result is an account manifest, which can be saved as JSON and as a password file
+for util.user.load_passwords().
+"""
+import csv
+import json
+import logging
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from ocean_keeper.account import Account
+from ocean_keeper.web3_provider import Web3Provider
+
+from util import metrics
+
+FAUCET_AGENT = 'mantaray'
+
+
+def create_local_account(password=None):
+    """Create a new key pair, with the private key encrypted by the password
+
+    :return: Manifest entry, dict of address, password, encrypted_key
+    """
+    web3 = Web3Provider.get_web3()
+    password = password or secrets.token_hex(16)
+    new_account = web3.eth.account.create()
+    encrypted_key = web3.eth.account.encrypt(new_account.privateKey, password)
+    return {'address': new_account.address, 'password': password, 'encrypted_key': json.dumps(encrypted_key)}
+
+
+def manifest_account(entry):
+    """The keeper Account of a manifest entry"""
+    return Account(entry['address'], password=entry['password'], encrypted_key=entry['encrypted_key'])
+
+
+def request_eth(faucet_url, address, session=None, timeout=30):
+    """Ask the faucet for ETH
+
+    :return: Transaction hash, if the faucet returns one, or None
+    """
+    session = session or requests
+    res = session.post('{}/faucet'.format(faucet_url.rstrip('/')),
+                       json={'address': address, 'agent': FAUCET_AGENT}, timeout=timeout)
+    metrics.registry.inc('faucet_requests_total', status=res.status_code)
+    res.raise_for_status()
+    body = res.json() if res.content else dict()
+    assert body.get('success', True), "Faucet refused {}: {}".format(address, body.get('message'))
+    return body.get('trxHash')
+
+
+def request_tokens(ocn, acct, amount):
+    """Ask the dispenser for OCEAN, returns after the dispenser transaction is mined
+
+    :return: True on success
+    """
+    success = ocn.accounts.request_tokens(acct, amount)
+    metrics.registry.inc('dispenser_requests_total', status='ok' if success else 'failed')
+    return success
+
+
+def wait_for_eth(ocn, acct, tx_hash=None, timeout=120, poll_interval=1):
+    """Wait on the faucet transaction receipt, or on a positive ETH balance if the hash is unknown"""
+    if tx_hash:
+        receipt = Web3Provider.get_web3().eth.waitForTransactionReceipt(tx_hash, timeout=timeout)
+        assert receipt.status == 1, "Faucet transaction {} failed".format(tx_hash)
+        return
+    deadline = time.time() + timeout
+    while ocn.accounts.balance(acct).eth == 0:
+        if time.time() > deadline:
+            raise TimeoutError("No ETH for {} after {}s".format(acct.address, timeout))
+        time.sleep(poll_interval)
+
+
+def provision_account(ocn, faucet_url, ocean_amount=100, session=None, timeout=120):
+    """Create one account, funded with faucet ETH and `ocean_amount` OCEAN
+
+    :return: Manifest entry
+    """
+    entry = create_local_account()
+    acct = manifest_account(entry)
+    tx_hash = request_eth(faucet_url, acct.address, session)
+    wait_for_eth(ocn, acct, tx_hash, timeout)
+    if ocean_amount:
+        assert request_tokens(ocn, acct, ocean_amount), \
+            "Token request failed for {}".format(acct.address)
+    return entry
+
+
+def provision_accounts(ocn, faucet_url, n_accounts, ocean_amount=100, max_workers=8, timeout=120, session=None):
+    """Create and fund `n_accounts` accounts concurrently
+
+    :param ocn: Ocean instance
+    :param faucet_url: Faucet endpoint, i.e. ocn.config.get('keeper-contracts', 'faucet.url')
+    :param n_accounts: Number of accounts to create
+    :param ocean_amount: OCEAN to request for each account, 0 to skip
+    :param max_workers: Maximum number of accounts provisioned in parallel
+    :param timeout: Seconds to wait for the ETH of each account
+    :param session: HTTP session for the faucet requests, by default a keep-alive session sized to max_workers
+    :return: list of manifest entries (dict of address, password, encrypted_key), and list of failures
+    """
+    manifest = list()
+    failures = list()
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(provision_account, ocn, faucet_url, ocean_amount, session, timeout)
+                   for _ in range(n_accounts)]
+        for future in as_completed(futures):
+            try:
+                entry = future.result()
+            except Exception as e:
+                logging.error("Account provisioning failed: {}".format(e))
+                failures.append(e)
+                continue
+            manifest.append(entry)
+            logging.debug("Provisioned {} ({}/{})".format(entry['address'], len(manifest), n_accounts))
+    logging.info("Provisioned {} of {} accounts in {:0.1f}s".format(len(manifest), n_accounts, time.time() - started))
+    return manifest, failures
+
+
+def save_manifest(manifest, path_manifest, path_passwords=None):
+    """Save the manifest as JSON, and optionally as an address,password file for util.user.load_passwords()"""
+    with open(path_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    if path_passwords:
+        with open(path_passwords, 'w', newline='') as f:
+            csv.writer(f).writerows((entry['address'], entry['password']) for entry in manifest)
+
+
+def load_manifest(path_manifest):
+    """Load the accounts of a saved manifest
+
+    :return: list of Account
+    """
+    with open(path_manifest) as f:
+        manifest = json.load(f)
+    return [manifest_account(entry) for entry in manifest]
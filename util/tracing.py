@@ -0,0 +1,179 @@
+"""
+Lightweight tracing of the test flows.
+
+Steps are wrapped in nested spans, timed on the monotonic clock and tagged with attributes (DID, agreement ID,
+account). Finished spans are appended to a JSON lines file, one span per line. to_chrome_trace() converts the
+file to the Chrome trace event format, to view it as a timeline or flame chart in chrome://tracing or
+https://ui.perfetto.dev:
+
+    python -m util.tracing /test_logs/<trace file>.jsonl > trace.json
+
+The module level `tracer` writes to the TRACE_PATH environment variable if set, or to the file given to
+tracer.open(). Without a file, spans are still timed but not exported.
+"""
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Span:
+    """One timed step, child of the span it was started in"""
+
+    def __init__(self, name, trace_id, span_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.thread = threading.current_thread().name
+        # Wall-clock start to align the spans of several processes, the duration is on the monotonic clock
+        self.start = time.time()
+        self._start_monotonic = time.perf_counter()
+        self.duration = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = 'error'
+        self.attributes['error'] = "{}: {}".format(type(error).__name__, error)
+
+    def end(self):
+        self.duration = time.perf_counter() - self._start_monotonic
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'status': self.status,
+            'pid': os.getpid(),
+            'thread': self.thread,
+            'attributes': self.attributes,
+        }
+
+    def __repr__(self):
+        return "<Span {} {}>".format(self.name, self.span_id)
+
+
+class Tracer:
+    """Create nested spans per thread, and append the finished spans to a JSON lines file"""
+
+    def __init__(self, path=None):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._file = None
+        if path:
+            self.open(path)
+
+    def open(self, path):
+        """Export the finished spans to this file, appending"""
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = open(str(path), 'a', buffering=1)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = list()
+        return self._local.stack
+
+    def current(self):
+        """The innermost open span of this thread, or None"""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def _new_id(self):
+        # The pid keeps the IDs unique across the worker processes writing to the same file
+        return '{}-{}'.format(os.getpid(), next(self._ids))
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Time the enclosed block as a span
+
+        :param parent: Parent span, by default the current span of this thread. Pass it explicitly to
+            nest the spans of a worker thread under the span which started the thread
+        :param attributes: Attributes of the span, more can be added with span.set_attribute()
+        """
+        parent = parent or self.current()
+        span_id = self._new_id()
+        span = Span(name, parent.trace_id if parent else span_id, span_id,
+                    parent.span_id if parent else None, attributes)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(e)
+            raise
+        finally:
+            stack.pop()
+            span.end()
+            self._export(span)
+
+    def _export(self, span):
+        if self._file is None:
+            return
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            if self._file:
+                self._file.write(line + '\n')
+
+
+tracer = Tracer(os.environ.get('TRACE_PATH'))
+
+
+def load_spans(path):
+    spans = list()
+    with open(str(path)) as f:
+        for line in f:
+            if line.strip():
+                spans.append(json.loads(line))
+    return spans
+
+
+def to_chrome_trace(spans):
+    """Spans in the Chrome trace event format, one complete ('X') event per span, in microseconds
+
+    :param spans: Span dicts, as from load_spans()
+    :return: dict, to dump as JSON
+    """
+    thread_ids = dict()
+    events = list()
+    for span in spans:
+        tid = thread_ids.setdefault((span['pid'], span['thread']), len(thread_ids) + 1)
+        args = dict(span['attributes'], trace_id=span['trace_id'], span_id=span['span_id'],
+                    parent_id=span['parent_id'], status=span['status'])
+        events.append({
+            'name': span['name'],
+            'cat': span['status'],
+            'ph': 'X',
+            'ts': span['start'] * 1e6,
+            'dur': (span['duration'] or 0) * 1e6,
+            'pid': span['pid'],
+            'tid': tid,
+            'args': args,
+        })
+    for (pid, thread), tid in thread_ids.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+if __name__ == '__main__':
+    assert len(sys.argv) == 2, "Usage: python -m util.tracing <trace.jsonl>"
+    json.dump(to_chrome_trace(load_spans(sys.argv[1])), sys.stdout)
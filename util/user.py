@@ -4,11 +4,20 @@ The User() class, a helper class for simulating users of Ocean Protocol.
 import logging
 import csv
 import os
+import pickle
 import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from ocean_keeper.account import Account
 from ocean_keeper.web3_provider import Web3Provider
 
+from util.misc import atomic_write
+
 
 def password_map(address, password_dict):
     """Simple utility to match lowercase addresses to the password dictionary
@@ -17,6 +26,10 @@ def password_map(address, password_dict):
     :param password_dict:
     :return:
     """
+    # The dictionaries from load_passwords() are already keyed by lowercase address
+    password = password_dict.get(str.lower(address))
+    if password is not None:
+        return password
     lower_case_pw_dict = {k.lower(): v for k, v in password_dict.items()}
     if str.lower(address) in lower_case_pw_dict:
         password = lower_case_pw_dict[str.lower(address)]
@@ -25,28 +38,216 @@ def password_map(address, password_dict):
         return False
 
 
+class CredentialStore:
+    """Password file parsed once, keyed by lowercase address
+
+    The file is only parsed again when its modification time changes. With an `index_path`, the parsed
+    dictionary is also pickled to disk, so that new processes skip the CSV parsing.
+    """
+
+    def __init__(self, path_passwords, index_path=None):
+        self.path = str(path_passwords)
+        self.index_path = str(index_path) if index_path else None
+        self.passwords = dict()
+        self._stat = None
+        self._lock = threading.Lock()
+        self.reload_if_changed()
+
+    def _read_csv(self):
+        passwords = dict()
+        with open(self.path) as f:
+            for row in csv.reader(f):
+                if row:
+                    passwords[row[0].lower()] = row[1]
+        return passwords
+
+    def _read_index(self, stat):
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if index.get('stat') != stat:
+            return None
+        return index['passwords']
+
+    def _write_index(self, stat, passwords):
+        with atomic_write(self.index_path, 'wb') as f:
+            pickle.dump({'stat': stat, 'passwords': passwords}, f, pickle.HIGHEST_PROTOCOL)
+
+    def reload_if_changed(self):
+        """Parse the file again if its modification time (or size) changed
+
+        :return: True if the passwords were reloaded
+        """
+        assert os.path.exists(self.path), "Password file not found: {}".format(self.path)
+        file_stat = os.stat(self.path)
+        stat = (file_stat.st_mtime_ns, file_stat.st_size)
+        if stat == self._stat:
+            return False
+        with self._lock:
+            passwords = self._read_index(stat) if self.index_path else None
+            if passwords is None:
+                passwords = self._read_csv()
+                if self.index_path:
+                    self._write_index(stat, passwords)
+            self.passwords = passwords
+            self._stat = stat
+        logging.info("{} account-password pairs loaded".format(len(passwords)))
+        return True
+
+    def get(self, address, default=None):
+        return self.passwords.get(address.lower(), default)
+
+    def __contains__(self, address):
+        return address.lower() in self.passwords
+
+    def __len__(self):
+        return len(self.passwords)
+
+
+_credential_stores = dict()
+
+
+def get_credential_store(path_passwords, index_path=None):
+    """The CredentialStore of this file, created once per process and reloaded if the file changed"""
+    key = os.path.abspath(str(path_passwords))
+    if key not in _credential_stores:
+        _credential_stores[key] = CredentialStore(path_passwords, index_path)
+    else:
+        _credential_stores[key].reload_if_changed()
+    return _credential_stores[key]
+
+
 def load_passwords_environ():
     assert 'PASSWORD_PATH' in os.environ
-    return load_passwords(os.environ['PASSWORD_PATH'])
+    return load_passwords(os.environ['PASSWORD_PATH'], os.environ.get('PASSWORD_INDEX_PATH'))
 
 
-def load_passwords(path_passwords):
+def load_passwords(path_passwords, index_path=None):
     """Load password file into an address:password dictionary
 
+    The file is parsed once per process, see CredentialStore. The returned dictionary is shared, and
+    must not be modified.
+
     :param path_passwords:
+    :param index_path: Optional path of a pickled index of the file, to load it faster in new processes
     :return: dict
     """
+    return get_credential_store(path_passwords, index_path).passwords
+
+
+class AccountPool:
+    """Pool of funded accounts, leased exclusively to concurrent flows
+
+    The balances of all accounts with a password are fetched concurrently, and cached for `ttl` seconds.
+    A leased account is not handed out again until it is released, so concurrent flows never share
+    an account (and its nonce).
+    """
 
-    assert os.path.exists(path_passwords), "Password file not found: {}".format(path_passwords)
-    passwords = dict()
-    with open(path_passwords) as f:
-        for row in csv.reader(f):
-            if row:
-                passwords[row[0]] = row[1]
+    def __init__(self, ocn, password_dict=None, min_eth=1, ttl=300, max_workers=16):
+        self.ocn = ocn
+        if password_dict is None:
+            password_dict = load_passwords_environ()
+        self.password_dict = {k.lower(): v for k, v in password_dict.items()}
+        self.min_eth = min_eth
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.balances = dict()
+        self._free = deque()
+        self._leased = dict()
+        # All the funded accounts, leased or not, for random_account()
+        self._funded = list()
+        self._refreshed = None
+        self._refreshing = False
+        self._condition = threading.Condition()
 
-    passwords = {k.lower(): v for k, v in passwords.items()}
-    logging.info("{} account-password pairs loaded".format(len(passwords)))
-    return passwords
+    def _fetch_balance(self, acct):
+        return acct, self.ocn.accounts.balance(acct)
+
+    def refresh(self):
+        """Fetch all balances concurrently, and rebuild the free accounts from the funded ones
+
+        A call during another refresh waits for it, instead of fetching all the balances again.
+        """
+        with self._condition:
+            if self._refreshing:
+                self._condition.wait_for(lambda: not self._refreshing)
+                return
+            self._refreshing = True
+        try:
+            accounts = list()
+            for acct in self.ocn.accounts.list():
+                acct.password = self.password_dict.get(acct.address.lower())
+                # Only select the allowed accounts
+                if acct.password:
+                    accounts.append(acct)
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                balances = dict(executor.map(self._fetch_balance, accounts))
+        except BaseException:
+            with self._condition:
+                self._refreshing = False
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            self.balances = {acct.address.lower(): balance for acct, balance in balances.items()}
+            # Only select accounts with enough ETH balance, and not currently leased
+            self._funded = [acct for acct, balance in balances.items() if balance.eth/10**18 >= self.min_eth]
+            free = [acct for acct in self._funded if acct.address.lower() not in self._leased]
+            random.shuffle(free)
+            self._free = deque(free)
+            self._refreshed = time.time()
+            self._refreshing = False
+            self._condition.notify_all()
+        logging.info("{} of {} accounts funded with at least {} ETH".format(
+            len(self._funded), len(accounts), self.min_eth))
+
+    @property
+    def expired(self):
+        return self._refreshed is None or time.time() - self._refreshed > self.ttl
+
+    def lease(self, timeout=None):
+        """Get a funded account for exclusive use, until release()
+
+        :param timeout: Seconds to wait for a free account, None to wait forever
+        :return: Account, with the password set
+        """
+        if self.expired:
+            self.refresh()
+        with self._condition:
+            assert self._free or self._leased, "No funded accounts available"
+            if not self._condition.wait_for(lambda: self._free, timeout):
+                raise TimeoutError("No free account after {}s".format(timeout))
+            acct = self._free.popleft()
+            self._leased[acct.address.lower()] = acct
+            return acct
+
+    def release(self, acct):
+        with self._condition:
+            if self._leased.pop(acct.address.lower(), None) is not None:
+                self._free.append(acct)
+                self._condition.notify()
+
+    @contextmanager
+    def leased(self, timeout=None):
+        acct = self.lease(timeout)
+        try:
+            yield acct
+        finally:
+            self.release(acct)
+
+    def random_account(self):
+        """A random funded account, without leasing it"""
+        if self.expired:
+            self.refresh()
+        funded = self._funded
+        assert funded, "No funded accounts available"
+        return random.choice(funded)
+
+
+_pools = weakref.WeakKeyDictionary()
 
 
 def get_account(ocn):
@@ -55,25 +256,14 @@ def get_account(ocn):
     Account must have a password
     Account must have positive ETH balance
 
+    The balances are cached in an AccountPool per Ocean instance.
+
     :param ocn:
     :return:
     """
-    password_dict = load_passwords_environ()
-
-    addresses = [str.lower(addr) for addr in password_dict.keys()]
-
-    possible_accounts = list()
-    for acct in ocn.accounts.list():
-        # Only select the allowed accounts
-        if str.lower(acct.address) not in addresses:
-            continue
-        # Only select accounts with positive ETH balance
-        if ocn.accounts.balance(acct).eth/10**18 < 1:
-            continue
-        possible_accounts.append(acct)
-
-    this_account = random.choice(possible_accounts)
-    this_account.password = password_map(this_account.address, password_dict)
+    if ocn not in _pools:
+        _pools[ocn] = AccountPool(ocn)
+    this_account = _pools[ocn].random_account()
     assert this_account.password, "No password loaded for {}".format(this_account.address)
     return this_account
 
@@ -89,12 +279,10 @@ def get_account_by_index(ocn, acct_number):
     """
     password_dict = load_passwords_environ()
 
-    addresses = [str.lower(addr) for addr in password_dict.keys()]
-
     possible_accounts = list()
     for acct in ocn.accounts.list():
         # Only select the allowed accounts
-        if str.lower(acct.address) not in addresses:
+        if str.lower(acct.address) not in password_dict:
             continue
         possible_accounts.append(acct)
 